@@ -291,6 +291,9 @@ class HistoryPlaylist(Playlist):
     def __delitem__(self, i):
         pass
 
+    def remove_positions(self, positions):
+        pass
+
     def append(self, other):
         pass
 
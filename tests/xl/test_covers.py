@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+
+from xl import covers
+from xl.trax import Track
+
+
+class FakeRemoteMethod(covers.CoverSearchMethod):
+    name = 'fakeremote'
+    timeout = 5
+
+    def __init__(self, results, delay=0):
+        self.results = results
+        self.delay = delay
+        self.searched = []
+
+    def find_covers(self, track, limit=-1):
+        self.searched.append(track)
+        time.sleep(self.delay)
+        return self.results
+
+
+class TestCoverManager(object):
+    def setup(self):
+        self.tracks = [Track('file:///covers%d' % i) for i in range(2)]
+        for track in self.tracks:
+            track.set_tags(album=u'Album', artist=u'Artist')
+
+    def manager(self, tmpdir, method):
+        manager = covers.CoverManager(str(tmpdir))
+        manager.on_provider_added(method)
+        return manager
+
+    def test_same_album_searched_once(self, tmpdir):
+        method = FakeRemoteMethod(['cover'], delay=0.2)
+        manager = self.manager(tmpdir, method)
+        found = []
+        threads = [
+            threading.Thread(target=lambda t=t: found.append(manager.find_covers(t)))
+            for t in self.tracks
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert found == [['fakeremote:cover']] * 2
+        assert len(method.searched) == 1
+
+    def test_nothing_found_is_cached(self, tmpdir):
+        method = FakeRemoteMethod([])
+        manager = self.manager(tmpdir, method)
+        assert manager.find_covers(self.tracks[0]) == []
+        assert manager.find_covers(self.tracks[1]) == []
+        assert len(method.searched) == 1
+
+    def test_hung_searches(self, tmpdir):
+        method = FakeRemoteMethod(['cover'], delay=5)
+        method.timeout = 0.1
+        manager = self.manager(tmpdir, method)
+        for i in range(manager.REMOTE_WORKERS):
+            track = Track('file:///hung%d' % i)
+            track.set_tags(album=u'Hung %d' % i)
+            assert manager.find_covers(track) == []
+        method.delay = 0
+        assert manager.find_covers(self.tracks[0]) == ['fakeremote:cover']
+
+    def test_thumbnails_removed(self, tmpdir):
+        manager = self.manager(tmpdir, FakeRemoteMethod([]))
+        manager.set_cover(self.tracks[0], 'fakeremote:a', 'data1')
+        db_string = manager.get_db_string(self.tracks[0])
+        for size in [(10, 10), (20, 20)]:
+            manager.set_thumbnail_data(db_string, size, 'thumbnail')
+        manager.set_cover(self.tracks[0], 'fakeremote:b', 'data2')
+        for size in [(10, 10), (20, 20)]:
+            assert manager.get_thumbnail_data(db_string, size) is None
+
+        db_string = manager.get_db_string(self.tracks[0])
+        manager.set_thumbnail_data(db_string, (10, 10), 'thumbnail')
+        manager.remove_cover(self.tracks[0])
+        assert manager.get_thumbnail_data(db_string, (10, 10)) is None
+
+
+class TestCacher(object):
+    def test_prune(self, tmpdir):
+        cacher = covers.Cacher(str(tmpdir))
+        for i in range(4):
+            key = cacher.add('x' * 10, 'key%d' % i)
+            os.utime(str(tmpdir.join(key)), (i, i))
+        cacher.prune(25)
+        assert sorted(path.basename for path in tmpdir.listdir()) == ['key2', 'key3']
+
+
+class TestCoverDB(object):
+    def test_journal(self, tmpdir):
+        path = str(tmpdir.join('covers.db'))
+        db = covers._CoverDB(path, 2)
+        db[u'album1'] = 'cache:1'
+        db[u'album2'] = 'cache:2'
+        db.save()
+        del db[u'album1']
+        db[u'album3'] = 'cache:3'
+        db.save()
+        assert tmpdir.join('covers.db.journal').check()
+
+        db = covers._CoverDB(path, 2)
+        assert db.version == 2
+        assert db.get(u'album1') is None
+        assert db[u'album2'] == 'cache:2'
+        assert db[u'album3'] == 'cache:3'
+
+    def test_damaged_journal(self, tmpdir):
+        path = str(tmpdir.join('covers.db'))
+        db = covers._CoverDB(path, 2)
+        db[u'album1'] = 'cache:1'
+        db.save()
+        tmpdir.join('covers.db.journal').write('\x80\x02', mode='ab')
+
+        db = covers._CoverDB(path, 2)
+        db[u'album2'] = 'cache:2'
+        assert db[u'album1'] == 'cache:1'
+        db.save()
+        assert covers._CoverDB(path, 2)[u'album2'] == 'cache:2'
+
+    def test_damaged_journal_saved_first(self, tmpdir):
+        path = str(tmpdir.join('covers.db'))
+        db = covers._CoverDB(path, 2)
+        db[u'album1'] = 'cache:1'
+        db.save()
+        damaged = covers.pickle.dumps((u'album3', 'cache:3'), 2)[:-2]
+        tmpdir.join('covers.db.journal').write(damaged, mode='ab')
+
+        db = covers._CoverDB(path, 2)
+        db[u'album2'] = 'cache:2'
+        db.save()
+        assert db[u'album2'] == 'cache:2'
+        assert covers._CoverDB(path, 2)[u'album2'] == 'cache:2'
+
+    def test_outdated_journal(self, tmpdir):
+        path = str(tmpdir.join('covers.db'))
+        db = covers._CoverDB(path, 2)
+        for i in range(5):
+            db[u'album1'] = 'cache:%d' % i
+            db.save()
+        journal = tmpdir.join('covers.db.journal').read('rb')
+
+        # interrupted after writing the snapshot, before removing the journal
+        db.COMPACT_SIZE = 0
+        db[u'album1'] = 'cache:new'
+        db.save()
+        assert not tmpdir.join('covers.db.journal').check()
+        tmpdir.join('covers.db.journal').write(journal, mode='wb')
+        assert covers._CoverDB(path, 2)[u'album1'] == 'cache:new'
+
+    def test_old_format(self, tmpdir):
+        path = tmpdir.join('covers.db')
+        with path.open('wb') as f:
+            covers.pickle.dump({'version': 2, u'album1': 'cache:1'}, f)
+        db = covers._CoverDB(str(path), 2)
+        assert db.version == 2 and db[u'album1'] == 'cache:1'
+        db.save()
+        assert covers._CoverDB(str(path), 2)[u'album1'] == 'cache:1'
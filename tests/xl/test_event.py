@@ -97,3 +97,90 @@ def test_thread_events():
     ncb.destroy()
 
     _finish_events()
+
+
+class Nothing(object):
+    pass
+
+
+class BatchCallback(object):
+    def __init__(self):
+        self.calls = []
+        event.add_batch_callback(self.on_cb, 'test')
+
+    def destroy(self):
+        event.remove_callback(self.on_cb, 'test')
+
+    def on_cb(self, type, items):
+        self.calls.append((type, items, on_ui_thread[0]))
+
+
+def test_batch_events():
+    _init_events()
+    bcb = BatchCallback()
+    pending = []
+    obj1, obj2 = Nothing(), Nothing()
+
+    def _run():
+        on_ui_thread[0] = False
+        event.log_event('test', obj1, {'a'})
+        event.log_event('test', obj2, 'x')
+        event.log_event('test', obj1, {'b'})
+        event.log_event('test', obj2, 'y')
+
+    orig_idle_add = GLib.idle_add
+    GLib.idle_add = lambda fn, *args: pending.append((fn, args))
+    try:
+        t = threading.Thread(target=_run)
+        t.start()
+        t.join()
+    finally:
+        GLib.idle_add = orig_idle_add
+
+    # nothing is delivered until the main loop is idle, and then only once
+    assert bcb.calls == []
+    on_ui_thread[0] = True
+    for fn, args in pending:
+        fn(*args)
+
+    assert bcb.calls == [('test', [(obj1, {'a', 'b'}), (obj2, 'y')], True)]
+
+    bcb.destroy()
+    _finish_events()
+
+
+def test_batch_events_removed():
+    _init_events()
+    bcb = BatchCallback()
+    pending = []
+
+    orig_idle_add = GLib.idle_add
+    GLib.idle_add = lambda fn, *args: pending.append((fn, args))
+    try:
+        event.log_event('test', Nothing(), 'x')
+    finally:
+        GLib.idle_add = orig_idle_add
+
+    bcb.destroy()
+    for fn, args in pending:
+        fn(*args)
+    assert bcb.calls == []
+
+    _finish_events()
+
+
+def test_event_stats():
+    _init_events()
+    ncb = NormalCallback()
+    event.EVENT_MANAGER.collect_stats = True
+
+    on_ui_thread[0] = True
+    event.log_event('test', ncb, None)
+    event.log_event('test', ncb, None)
+
+    stats = event.EVENT_MANAGER.get_stats()
+    assert stats['test'][1] == 2
+    assert stats['test'][2] == 2
+
+    ncb.destroy()
+    _finish_events()
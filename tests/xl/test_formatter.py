@@ -0,0 +1,48 @@
+from xl import formatter, providers
+from xl.trax import Track
+
+
+class TestFormatter(object):
+    def test_format(self):
+        f = formatter.Formatter(
+            '$$${a}: ${b:prefix=[, suffix=]} ${c:pad=3, padstring=0}'
+        )
+        f._substitutions = {'a': u'A', 'b': lambda: u'B', 'c': u'7'}
+        assert f.format() == u'$A: [B] 007'
+        f.props.format = '${b:prefix=[} $missing'
+        assert f.format() == u'[B $missing'
+
+    def test_extract(self):
+        f = formatter.Formatter('$a ${b:x=1\\,2, y}')
+        assert f.extract() == {
+            'a': ('a', {}),
+            'b:x=1\\,2, y': ('b', {'x': '1,2', 'y': True}),
+        }
+
+
+class TestTrackFormatter(object):
+    def setup(self):
+        self.tracks = [Track('file:///formatter%d' % i) for i in range(3)]
+        for i, track in enumerate(self.tracks):
+            track.set_tags(title=u'Title %d' % i, tracknumber=u'%d/3' % (i + 1))
+
+    def test_format_many(self):
+        f = formatter.TrackFormatter('$tracknumber - $title')
+        texts = f.format_many(self.tracks)
+        assert texts == [u'1 - Title 0', u'2 - Title 1', u'3 - Title 2']
+        assert texts == [f.format(track) for track in self.tracks]
+
+    def test_provider_changes(self):
+        class Provider(formatter.TagFormatter):
+            def format(self, track, parameters):
+                return u'provided'
+
+        f = formatter.TrackFormatter('$formattertest')
+        assert f.format(self.tracks[0]) == u''
+        provider = Provider('formattertest')
+        providers.register('tag-formatting', provider)
+        try:
+            assert f.format(self.tracks[0]) == u'provided'
+        finally:
+            providers.unregister('tag-formatting', provider)
+        assert f.format(self.tracks[0]) == u''
@@ -0,0 +1,213 @@
+from gi.repository import Gio
+
+from xl import event
+from xl.playlist import Playlist, import_playlist
+from xl.trax import Track
+
+
+class TestPlaylist(object):
+    def setup(self):
+        self.tracks = [Track('file:///playlist%d' % i) for i in range(6)]
+        self.playlist = Playlist('test', self.tracks[:4])
+
+    def test_membership(self):
+        self.playlist.append(self.tracks[0])
+        assert self.tracks[0] in self.playlist
+        assert self.tracks[5] not in self.playlist
+        assert self.playlist.count(self.tracks[0]) == 2
+        del self.playlist[0]
+        assert self.playlist.count(self.tracks[0]) == 1
+        assert self.playlist.index(self.tracks[0]) == 3
+
+    def test_positions_follow_changes(self):
+        self.playlist.current_position = 2
+        self.playlist.spat_position = 3
+        self.playlist[0:0] = [self.tracks[4], self.tracks[5]]
+        assert self.playlist.current_position == 4
+        assert self.playlist.spat_position == 5
+        del self.playlist[1]
+        assert self.playlist.current_position == 3
+        assert self.playlist.spat_position == 4
+
+    def test_unset_spat_position(self):
+        self.playlist.spat_position = 1
+        self.playlist.spat_position = -1
+        self.playlist.append(self.tracks[4])
+        assert self.playlist.spat_position == -1
+
+    def test_remove_positions(self):
+        removed = []
+
+        def on_removed(type, playlist, tracks):
+            removed.append(list(tracks))
+
+        event.add_callback(on_removed, 'playlist_tracks_removed', self.playlist)
+        try:
+            self.playlist.current_position = 2
+            self.playlist.remove_positions([3, 0])
+        finally:
+            event.remove_callback(on_removed, 'playlist_tracks_removed', self.playlist)
+
+        assert removed == [[(0, self.tracks[0]), (3, self.tracks[3])]]
+        assert list(self.playlist) == self.tracks[1:3]
+        assert self.playlist.current_position == 1
+
+    def test_duration(self):
+        for i, track in enumerate(self.tracks):
+            track.set_tag_raw('__length', i + 1)
+        assert self.playlist.get_duration() == 10
+        assert self.playlist.get_duration(1, 3) == 5
+        self.playlist[1:1] = self.tracks[4:6]
+        del self.playlist[0]
+        assert self.playlist.get_duration() == 20
+        assert self.playlist.get_duration(2) == 9
+
+        self.tracks[5].set_tag_raw('__length', None)
+        assert self.playlist.get_duration() == 14
+        assert self.playlist.get_duration(0, 2, allow_unknown=False) is None
+        assert self.playlist.get_duration(2, allow_unknown=False) == 9
+
+
+class TestPlaylistShuffle(object):
+    def setup(self):
+        self.tracks = [Track('file:///shuffle%d' % i) for i in range(12)]
+        for i, track in enumerate(self.tracks):
+            track.set_tags(album=u'album%d' % (i // 4), tracknumber=u'%d' % (i % 4 + 1))
+        self.playlist = Playlist('test', self.tracks)
+
+    def play_all(self, mode):
+        self.playlist.shuffle_mode = mode
+        self.playlist.current_position = 0
+        played = [0]
+        while self.playlist.next() is not None:
+            played.append(self.playlist.current_position)
+        return played
+
+    def test_track_shuffle(self):
+        played = self.play_all('track')
+        assert sorted(played) == range(12)
+
+    def test_track_shuffle_appended(self):
+        self.playlist.shuffle_mode = 'track'
+        self.playlist.current_position = 0
+        self.playlist.next()
+        extra = Track('file:///shuffle_extra')
+        self.playlist.append(extra)
+        played = set()
+        while self.playlist.next() is not None:
+            played.add(self.playlist.current)
+        assert extra in played
+
+    def test_album_shuffle(self):
+        played = self.play_all('album')
+        assert sorted(played) == range(12)
+        for i in range(0, 12, 4):
+            assert played[i : i + 4] == range(played[i], played[i] + 4)
+
+    def test_shuffle_history_saved(self, tmpdir):
+        self.playlist.shuffle_mode = 'track'
+        self.playlist.current_position = 0
+        self.playlist.next()
+        self.playlist.next()
+        history = self.playlist.shuffle_history_positions
+        assert len(history) == 2 and history[0] == 0
+
+        location = str(tmpdir.join('playlist'))
+        self.playlist.save_to_location(location)
+        playlist = Playlist('loaded')
+        playlist.load_from_location(location)
+        assert playlist.shuffle_history_positions == history
+
+
+class TestPlaylistSave(object):
+    def setup(self):
+        self.tracks = [Track('file:///playlist%d' % i) for i in range(6)]
+        self.playlist = Playlist('test', self.tracks[:4])
+
+    def load(self, location):
+        playlist = Playlist('loaded')
+        playlist.load_from_location(location)
+        return playlist
+
+    def test_journal(self, tmpdir):
+        location = str(tmpdir.join('playlist'))
+        self.playlist.current_position = 1
+        self.playlist.save_to_location(location)
+        size = tmpdir.join('playlist').size()
+
+        self.playlist.append(self.tracks[4])
+        self.playlist.remove_positions([0, 2])
+        self.playlist[::2] = [self.tracks[5], self.tracks[0]]
+        self.playlist.save_to_location(location)
+        assert tmpdir.join('playlist').size() > size
+
+        playlist = self.load(location)
+        assert list(playlist) == list(self.playlist)
+        assert playlist.current_position == self.playlist.current_position
+        assert playlist.name == 'test'
+
+    def test_stream_tags(self, tmpdir):
+        location = str(tmpdir.join('playlist'))
+        stream = Track('http://playlist.invalid/stream')
+        stream.set_tag_raw('title', u'Str\xe4am')
+        self.playlist.append(stream)
+        self.playlist.save_to_location(location)
+        stream.set_tag_raw('title', None)
+
+        playlist = self.load(location)
+        assert playlist[-1] is stream
+        assert stream.get_tag_raw('title') == [u'Str\xe4am']
+
+    def test_text_format(self, tmpdir):
+        path = tmpdir.join('playlist')
+        path.write(
+            'file:///playlist0\tartist=Foo\n'
+            'file:///playlist1\n'
+            'EOF\n'
+            'name=U: text\n'
+            'repeat_mode=U: playlist\n'
+        )
+        playlist = self.load(str(path))
+        assert list(playlist) == self.tracks[:2]
+        assert playlist.name == u'text'
+        assert playlist.repeat_mode == 'all'
+        assert Playlist.read_attributes(str(path))['name'] == u'text'
+
+
+class TestPlaylistImport(object):
+    def test_m3u(self, tmpdir):
+        path = tmpdir.join('test.m3u')
+        path.write(
+            '#EXTM3U\n'
+            '#PLAYLIST: Imported\n'
+            '#EXTINF:10,Artist - Title\n'
+            'missing1.ogg\n'
+            'missing2.ogg\n'
+        )
+        playlist = import_playlist(Gio.File.new_for_path(str(path)).get_uri())
+        assert playlist.name == 'Imported'
+        assert [track.get_loc_for_io() for track in playlist] == [
+            Gio.File.new_for_path(str(tmpdir.join(name))).get_uri()
+            for name in ('missing1.ogg', 'missing2.ogg')
+        ]
+        assert playlist[0].get_tag_display('title') == u'Title'
+        assert playlist[0].get_tag_display('artist') == u'Artist'
+        assert playlist[1].get_tag_raw('artist') is None
+
+    def test_xspf(self, tmpdir):
+        path = tmpdir.join('test.xspf')
+        path.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<playlist version="1" xmlns="http://xspf.org/ns/0/">'
+            '<title>Imported</title><trackList>'
+            '<track><location>file:///xspf1.ogg</location><title>One</title></track>'
+            '<track><location>file:///xspf2.ogg</location></track>'
+            '</trackList></playlist>'
+        )
+        playlist = import_playlist(Gio.File.new_for_path(str(path)).get_uri())
+        assert playlist.name == 'Imported'
+        assert [track.get_loc_for_io() for track in playlist] == [
+            'file:///xspf1.ogg',
+            'file:///xspf2.ogg',
+        ]
+        assert playlist[0].get_tag_display('title') == u'One'
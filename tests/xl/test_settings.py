@@ -0,0 +1,32 @@
+from xl import settings
+
+
+class TestSettingsManager(object):
+    def setup(self):
+        self.settings = settings.SettingsManager(None)
+
+    def test_cached_values(self):
+        self.settings.set_option('test/list', [u'a', [1, 2]])
+        value = self.settings.get_option('test/list')
+        assert value == [u'a', [1, 2]]
+        value[1].append(3)
+        assert self.settings.get_option('test/list') == [u'a', [1, 2]]
+
+        self.settings.set_option('test/list', [u'b'])
+        assert self.settings.get_option('test/list') == [u'b']
+        self.settings.remove_option('test/list')
+        assert self.settings.get_option('test/list', 'default') == 'default'
+
+    def test_unchanged_value(self):
+        self.settings.set_option('test/int', 1)
+        self.settings._dirty = False
+        self.settings.set_option('test/int', 1)
+        assert not self.settings._dirty
+        self.settings.set_option('test/int', 2)
+        assert self.settings._dirty and self.settings.get_option('test/int') == 2
+
+    def test_literal_values(self):
+        self.settings._set_direct('test/dict', "D: {u'a': [1, None]}")
+        assert self.settings.get_option('test/dict') == {u'a': [1, None]}
+        self.settings._set_direct('test/list', "L: __import__('os').getpid()")
+        assert self.settings.get_option('test/list') == []
@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+from xl.startup import StartupScheduler
+
+
+class TestStartupScheduler(object):
+    def setup(self):
+        self.scheduler = StartupScheduler()
+        self.calls = []
+
+    def phase(self, name):
+        return lambda: self.calls.append(name)
+
+    def test_dependency_order(self):
+        self.scheduler.add('a', self.phase('a'))
+        self.scheduler.add('b', self.phase('b'), ['a'])
+        self.scheduler.add('c', self.phase('c'))
+        self.scheduler.run()
+        assert self.calls == ['a', 'b', 'c']
+        assert [t[0] for t in self.scheduler.timings] == ['a', 'b', 'c']
+
+    def test_unknown_dependency(self):
+        with pytest.raises(ValueError):
+            self.scheduler.add('a', self.phase('a'), ['b'])
+
+    def test_threaded_runs_concurrently(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def threaded():
+            started.set()
+            release.wait(5)
+            self.calls.append('threaded')
+
+        def waiting():
+            # runs while the threaded phase is still busy
+            assert started.wait(5)
+            self.calls.append('main')
+            release.set()
+
+        self.scheduler.add('threaded', threaded, threaded=True)
+        self.scheduler.add('main', waiting)
+        self.scheduler.add('after', self.phase('after'), ['threaded', 'main'])
+        self.scheduler.run()
+        assert self.calls == ['main', 'threaded', 'after']
+
+    def test_threaded_error(self):
+        def fail():
+            raise RuntimeError('fail')
+
+        self.scheduler.add('fail', fail, threaded=True)
+        self.scheduler.add('after', self.phase('after'), ['fail'])
+        with pytest.raises(RuntimeError):
+            self.scheduler.run()
+        assert self.calls == []
+
+    def test_deferred(self):
+        callbacks = []
+        self.scheduler.add('a', self.phase('a'))
+        self.scheduler.add('later', self.phase('later'), ['a'], deferred=True)
+        self.scheduler.run()
+        assert self.calls == ['a']
+        self.scheduler.run_deferred(callbacks.append)
+        assert self.calls == ['a']
+        while callbacks:
+            callbacks.pop(0)()
+        assert self.calls == ['a', 'later']
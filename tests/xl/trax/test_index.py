@@ -0,0 +1,79 @@
+# -*- coding: utf-8
+
+from xl.trax import search
+from xl.trax import track
+from xl.trax import trackdb
+
+
+def get_track(uri, **tags):
+    tr = track.Track(uri)
+    tr.set_tags(**tags)
+    return tr
+
+
+def search_db(db, query, keyword_tags=None, case_sensitive=False):
+    return {
+        x.track
+        for x in search.search_tracks_from_string(
+            db, query, case_sensitive=case_sensitive, keyword_tags=keyword_tags
+        )
+    }
+
+
+class TestTrackSearchIndex(object):
+    def setup(self):
+        self.db = trackdb.TrackDB()
+        self.foo = get_track(
+            'file:///foo', artist=u'Foo Fighters', album=u'Colour', __rating=80
+        )
+        self.bar = get_track(
+            'file:///bar', artist=u'The Bar', album=u'Colour', __rating=20
+        )
+        self.baz = get_track('file:///baz', artist=u'Baz')
+        self.db.add_tracks([self.foo, self.bar, self.baz])
+
+    def test_exact(self):
+        assert search_db(self.db, 'album=="colour"') == {self.foo, self.bar}
+        assert search_db(self.db, 'album==__null__') == {self.baz}
+
+    def test_contains(self):
+        assert search_db(self.db, 'artist="ghter"') == {self.foo}
+        assert search_db(self.db, 'artist="foo fig"') == {self.foo}
+        assert search_db(self.db, 'artist="fighters foo"') == set()
+
+    def test_numeric(self):
+        assert search_db(self.db, '__rating>50', case_sensitive=True) == {self.foo}
+        assert search_db(self.db, '__rating<50', case_sensitive=True) == {
+            self.bar,
+            self.baz,
+        }
+        assert search_db(self.db, '__rating==80', case_sensitive=True) == {self.foo}
+
+    def test_keyword(self):
+        tags = ['artist', 'album']
+        assert search_db(self.db, 'bar', tags) == {self.bar}
+        assert search_db(self.db, 'col', tags) == {self.foo, self.bar}
+
+    def test_candidates_narrow_search(self):
+        matcher = search.TracksMatcher('album=="colour"', case_sensitive=False)
+        assert self.db.get_search_candidates([matcher]) == {self.foo, self.bar}
+
+        matcher = search.TracksMatcher('album~colour', case_sensitive=False)
+        assert self.db.get_search_candidates([matcher]) is None
+
+    def test_tag_change(self):
+        assert search_db(self.db, 'album=="colour"') == {self.foo, self.bar}
+        self.bar.set_tag_raw('album', u'Other')
+        assert search_db(self.db, 'album=="colour"') == {self.foo}
+        assert search_db(self.db, 'album=="other"') == {self.bar}
+
+    def test_derived_tag_change(self):
+        assert search_db(self.db, 'albumartist=="baz"') == {self.baz}
+        self.baz.set_tag_raw('artist', u'Qux')
+        assert search_db(self.db, 'albumartist=="baz"') == set()
+        assert search_db(self.db, 'albumartist=="qux"') == {self.baz}
+
+    def test_remove(self):
+        assert search_db(self.db, 'album=="colour"') == {self.foo, self.bar}
+        self.db.remove_tracks([self.foo])
+        assert search_db(self.db, 'album=="colour"') == {self.bar}
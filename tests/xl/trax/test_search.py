@@ -354,6 +354,30 @@ class TestTracksMatcher(object):
         self.str.track.set_tag_raw('artist', 'bar')
         assert not matcher.match(self.str)
 
+    def test_match_nested(self):
+        matcher = search.TracksMatcher(
+            "artist~^fo ! ( album==bar | __rating>50 ) foo", keyword_tags=['title']
+        )
+        self.str.track.set_tags(artist=u'foo', title=u'foo', album=u'baz')
+        assert matcher.match(self.str)
+        assert sorted(self.str.on_tags) == ['artist', 'title']
+        self.str.track.set_tag_raw('__rating', 60)
+        assert not matcher.match(self.str)
+
+    def test_plan_cached(self):
+        matcher = search.TracksMatcher("artist=foo")
+        other = search.TracksMatcher("artist=foo")
+        assert matcher._plan is other._plan
+        assert matcher.matchers is not other.matchers
+
+    def test_append_matcher(self):
+        matcher = search.TracksMatcher("artist=foo")
+        self.str.track.set_tag_raw('artist', 'foo')
+        assert matcher.match(self.str)
+        matcher.append_matcher(search.TracksNotInList([self.str.track]))
+        assert not matcher.match(self.str)
+        assert search.TracksMatcher("artist=foo").match(self.str)
+
 
 class TestSearchTracks(object):
     def test_search_tracks(self):
@@ -427,3 +451,48 @@ class TestSearchTracks(object):
         assert gen.next().track == tracks[2]
         with pytest.raises(StopIteration):
             gen.next()
+
+
+class TestKeywordText(object):
+    def setup(self):
+        self.tags = ['artist', 'album', '__rating']
+        self.tracks = [track.Track('file:///keyword%d' % i) for i in range(3)]
+        self.tracks[0].set_tags(artist=u'Foo Fighters', album=u'Colour', __rating=80)
+        self.tracks[1].set_tags(artist=[u'The', u'Bar'], album=None)
+        self.tracks[2].set_tags(artist=u'Baz', album=u'Fooo', __rating=20)
+
+    def test_get_keywords(self):
+        matcher = search.TracksMatcher('foo "b"', keyword_tags=self.tags)
+        assert sorted(matcher.get_keywords()) == [(u'b', u'b'), (u'foo', u'foo')]
+
+    def test_get_keywords_not_plain(self):
+        for query in ('artist=foo', 'foo | bar', '! foo', 'foo __rating>5'):
+            matcher = search.TracksMatcher(query, keyword_tags=self.tags)
+            assert matcher.get_keywords() is None
+        assert search.TracksMatcher('foo').get_keywords() is None
+
+    @pytest.mark.parametrize(
+        "query", ["foo", "FOO", "bar", "oo fi", "e\0b", "8", "ba co", "zzz"]
+    )
+    def test_match_keyword_text(self, query):
+        matcher = search.TracksMatcher(
+            query, case_sensitive=False, keyword_tags=self.tags
+        )
+        keywords = matcher.get_keywords()
+        if keywords is None:
+            return
+        for tr in self.tracks:
+            text = search.get_keyword_text(tr, self.tags, case_sensitive=False)
+            assert search.match_keyword_text(keywords, text) == matcher.match(
+                search.SearchResultTrack(tr)
+            )
+
+    def test_keywords_narrowed(self):
+        def keywords(query):
+            return search.TracksMatcher(query, keyword_tags=self.tags).get_keywords()
+
+        assert search.keywords_narrowed(keywords('bea'), keywords('beat'))
+        assert search.keywords_narrowed(keywords('bea'), keywords('beat les'))
+        assert search.keywords_narrowed(keywords('be les'), keywords('beat les'))
+        assert not search.keywords_narrowed(keywords('beat'), keywords('bea'))
+        assert not search.keywords_narrowed(keywords('bea les'), keywords('beat'))
@@ -0,0 +1,79 @@
+# -*- coding: utf-8
+
+import os
+
+import pytest
+
+from xl.trax import snapshot
+from xl.trax import track
+from xl.trax import trackdb
+
+
+def test_snapshot_roundtrip(tmpdir):
+    path = str(tmpdir.join('test.snapshot'))
+    entries = [
+        (
+            {
+                '__loc': 'file:///foo',
+                'artist': [u'Fö', u'Bar'],
+                '__rating': 80.0,
+                '__playcount': 3,
+                '__compilation': ('/foo', u'album'),
+            },
+            3,
+            {},
+        ),
+        ({'__loc': 'file:///bar', 'artist': [u'Fö']}, 7, {'extra': 1}),
+    ]
+    snapshot.write_snapshot(path, 42, entries)
+
+    snap = snapshot.TrackSnapshot(path)
+    assert snap.serial == 42
+    assert snap.get_locations() == ['file:///foo', 'file:///bar']
+    assert list(snap.get_keys()) == [3, 7]
+    for row, (state, key, attrs) in enumerate(entries):
+        assert snap.get_state(row) == state
+        assert snap.get_attrs(row) == attrs
+    snap.close()
+
+
+def test_snapshot_invalid(tmpdir):
+    path = tmpdir.join('test.snapshot')
+    path.write('not a snapshot' * 10)
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.TrackSnapshot(str(path))
+
+
+def test_trackdb_loads_snapshot(tmpdir):
+    location = str(tmpdir.join('music.db'))
+    db = trackdb.TrackDB('test', location=location)
+    tr = track.Track('file:///foo')
+    tr.set_tags(artist=u'Foo')
+    db.add(tr)
+    db.save_snapshot()
+    assert os.path.exists(location + '.snapshot')
+
+    del db, tr
+    track.Track._Track__tracksdict.clear()
+
+    db = trackdb.TrackDB('test', location=location)
+    assert not db.tracks['file:///foo']._loaded
+    tr = db.get_track_by_loc('file:///foo')
+    assert tr.get_tag_raw('artist') == [u'Foo']
+    assert db.tracks['file:///foo']._loaded
+
+
+def test_trackdb_ignores_outdated_snapshot(tmpdir):
+    location = str(tmpdir.join('music.db'))
+    db = trackdb.TrackDB('test', location=location)
+    tr = track.Track('file:///foo')
+    db.add(tr)
+    db.save_snapshot()
+    tr.set_tags(artist=u'Bar')
+    db.save_to_location()
+
+    del db, tr
+    track.Track._Track__tracksdict.clear()
+
+    db = trackdb.TrackDB('test', location=location)
+    assert db.get_track_by_loc('file:///foo').get_tag_raw('artist') == [u'Bar']
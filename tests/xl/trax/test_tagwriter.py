@@ -0,0 +1,42 @@
+from xl.trax import tagwriter
+from xl.trax import track
+
+
+class TestTagWriter(object):
+    def setup(self):
+        self.writer = tagwriter.TagWriter(retries=0)
+
+    def test_nothing_pending(self, tmpdir):
+        location = str(tmpdir.join('tagwriter.queue'))
+        assert self.writer.load_from_location(location) is None
+        tmpdir.join('tagwriter.queue').write('\n')
+        assert self.writer.load_from_location(location) is None
+
+    def test_missing_file(self, tmpdir):
+        self.writer.location = str(tmpdir.join('tagwriter.queue'))
+        loc = 'file://' + str(tmpdir.join('missing.ogg'))
+        batch = self.writer.write_tracks([track.Track(loc)])
+        batch.start()
+        batch.join(10)
+        assert batch.finished == 1
+        assert batch.errors == [loc]
+        assert not tmpdir.join('tagwriter.queue').check()
+
+    def test_pending_tags(self, tmpdir):
+        location = str(tmpdir.join('tagwriter.queue'))
+        loc = 'file://' + str(tmpdir.join('missing.ogg'))
+        with open(location, 'wb') as f:
+            for record in [
+                (0, {'__loc': loc, 'title': [u'Old']}),
+                (1, {'__loc': loc, 'title': [u'New']}),
+                (0, None),
+            ]:
+                tagwriter.pickle.dump(record, f)
+            f.write(tagwriter.pickle.dumps((2, {'__loc': loc}))[:-2])
+
+        batch = self.writer.load_from_location(location)
+        assert [key for _, _, key in batch.jobs] == [1]
+        assert batch.jobs[0][0].get_tag_raw('title') == [u'New']
+        batch.join(10)
+        assert batch.errors == [loc]
+        assert not tmpdir.join('tagwriter.queue').check()
@@ -5,9 +5,8 @@ import unittest
 import logging
 import random
 import string
-import types
+import time
 
-from gi.repository import GLib
 from mox3 import mox
 import pytest
 
@@ -18,62 +17,61 @@ import xl.settings as settings
 LOG = logging.getLogger(__name__)
 
 
+class FakeFormat(object):
+    def __init__(self, data=''):
+        self.data = data
+
+    def _get_raw(self):
+        return {'data': self.data}
+
+
 class Test_MetadataCacher(object):
 
     TIMEOUT = 2000
-    MAX_ENTRIES = 2048
+    MAX_SIZE = 4 * track._MetadataCacher.BASE_SIZE
 
     def setup(self):
-        self.mox = mox.Mox()
-        self.mc = track._MetadataCacher(self.TIMEOUT, self.MAX_ENTRIES)
+        self.mc = track._MetadataCacher(self.TIMEOUT, self.MAX_SIZE)
 
     def teardown(self):
-        self.mox.UnsetStubs()
+        self.mc.clear()
 
     def test_add(self):
-        timeout_id = 1
-        self.mox.StubOutWithMock(GLib, 'timeout_add_seconds')
-        self.mox.StubOutWithMock(GLib, 'source_remove')
-        GLib.timeout_add_seconds(
-            self.TIMEOUT, self.mc._MetadataCacher__cleanup
-        ).AndReturn(timeout_id)
-
-        self.mox.ReplayAll()
-        self.mc.add('foo', 'bar')
-        assert self.mc.get('foo') == 'bar'
-        self.mox.VerifyAll()
+        f = FakeFormat()
+        assert self.mc.add('foo', f) is f
+        assert self.mc.get('foo') is f
 
     def test_double_add(self):
-        timeout_id = 1
-        self.mox.StubOutWithMock(GLib, 'timeout_add_seconds')
-        self.mox.StubOutWithMock(GLib, 'source_remove')
-        GLib.timeout_add_seconds(
-            mox.IsA(types.IntType), mox.IsA(types.MethodType)
-        ).AndReturn(timeout_id)
-
-        self.mox.ReplayAll()
-        self.mc.add('foo', 'bar')
-        assert self.mc.get('foo') == 'bar'
-        self.mc.add('foo', 'bar')
-        assert self.mc.get('foo') == 'bar'
-        self.mox.VerifyAll()
+        f = FakeFormat()
+        self.mc.add('foo', f)
+        assert self.mc.add('foo', FakeFormat()) is f
+        assert self.mc.get('foo') is f
+        g = FakeFormat()
+        assert self.mc.add('foo', g, replace=True) is g
+        assert self.mc.get('foo') is g
 
     def test_remove(self):
-        timeout_id = 1
-        self.mox.StubOutWithMock(GLib, 'timeout_add_seconds')
-        GLib.timeout_add_seconds(self.TIMEOUT, mox.IsA(types.MethodType)).AndReturn(
-            timeout_id
-        )
-
-        self.mox.ReplayAll()
-        self.mc.add('foo', 'bar')
+        self.mc.add('foo', FakeFormat())
         self.mc.remove('foo')
         assert self.mc.get('foo') is None
-        self.mox.VerifyAll()
 
     def test_remove_not_exist(self):
         assert self.mc.remove('foo') is None
 
+    def test_size_limit(self):
+        for key in ('foo', 'bar', 'baz'):
+            self.mc.add(key, FakeFormat())
+        self.mc.get('foo')
+        self.mc.add('big', FakeFormat('x' * track._MetadataCacher.BASE_SIZE))
+        assert self.mc.get('bar') is None and self.mc.get('baz') is None
+        assert self.mc.get('foo') is not None and self.mc.get('big') is not None
+
+    def test_expiry(self):
+        self.mc.timeout = 0.05
+        self.mc.add('foo', FakeFormat())
+        time.sleep(0.2)
+        assert not self.mc._cache and self.mc._timer is None
+
 
 def random_str(l=8):
     return ''.join(random.choice(string.ascii_letters) for _ in range(l))
@@ -452,6 +450,31 @@ class TestTrack(object):
         tr.set_tag_raw('artistsort', value)
         assert tr.get_tag_sort('artist') == retval
 
+    def test_get_sort_tag_cache_tag_change(self):
+        tr = track.Track('/sortcache1')
+        tr.set_tag_raw('album', u'Foo')
+        assert tr.get_tag_sort('album') == u'foo foo Foo Foo'
+        tr.set_tag_raw('album', u'Bar')
+        assert tr.get_tag_sort('album') == u'bar bar Bar Bar'
+
+    def test_get_sort_tag_cache_compilation(self):
+        tr = track.Track('/sortcache2')
+        tr.set_tag_raw('artist', u'foo')
+        tr.set_tag_raw('__compilation', 'foo')
+        assert tr.get_tag_sort('albumartist') == u'foo foo foo foo'
+        retval = u' '.join([u'\uffff\uffff\uffff\ufffe'] * 4)
+        assert tr.get_tag_sort('albumartist', artist_compilations=True) == retval
+
+    def test_get_sort_tag_cache_cuts_cb(self):
+        tr = track.Track('/sortcache3')
+        tr.set_tag_raw('album', u'The Foo')
+        settings.set_option('collection/strip_list', [])
+        track.Track._the_cuts_cb(None, None, 'collection/strip_list')
+        assert tr.get_tag_sort('album') == u'the foo the foo The Foo The Foo'
+        settings.set_option('collection/strip_list', ['the'])
+        track.Track._the_cuts_cb(None, None, 'collection/strip_list')
+        assert tr.get_tag_sort('album') == u'foo the foo The Foo The Foo'
+
     def test_get_sort_tag_length(self):
         tr = track.Track('/foo')
         tr.set_tag_raw('__length', 36)
@@ -0,0 +1,54 @@
+from xl.trax import track
+from xl.trax import trackdb
+
+
+class TestTrackDBSave(object):
+    def setup(self):
+        track.Track._Track__tracksdict.clear()
+
+    def test_saves_changed_tracks(self, tmpdir):
+        location = str(tmpdir.join('music.db'))
+        db = trackdb.TrackDB('test', location=location)
+        foo = track.Track('file:///foo')
+        bar = track.Track('file:///bar')
+        db.add_tracks([foo, bar])
+        assert db._dirty_tracks == {'file:///foo', 'file:///bar'}
+        db.save_to_location()
+        assert not db._dirty_tracks
+
+        bar.set_tags(artist=u'Bar')
+        assert db._dirty_tracks == {'file:///bar'}
+        other = track.Track('file:///other')
+        other.set_tags(artist=u'Other')
+        assert db._dirty_tracks == {'file:///bar'}
+        db.save_to_location()
+        assert not db._dirty_tracks and not bar._dirty
+
+        del db, foo, bar, other
+        track.Track._Track__tracksdict.clear()
+
+        db = trackdb.TrackDB('test', location=location)
+        assert db.get_track_by_loc('file:///bar').get_tag_raw('artist') == [u'Bar']
+        assert db.get_track_by_loc('file:///foo') is not None
+
+    def test_removed_tracks(self, tmpdir):
+        db = trackdb.TrackDB('test', location=str(tmpdir.join('music.db')))
+        foo = track.Track('file:///foo')
+        db.add(foo)
+        db.remove(foo)
+        foo.set_tags(artist=u'Foo')
+        assert not db._dirty_tracks
+
+    def test_failed_save(self, tmpdir):
+        db = trackdb.TrackDB('test', location=str(tmpdir.join('music.db')))
+        foo = track.Track('file:///foo')
+        db.add(foo)
+        db.save_to_location()
+
+        foo.set_tag_raw('comment', [lambda: None])
+        db.save_to_location()
+        assert db._dirty_tracks == {'file:///foo'} and not db._saving
+
+        foo.set_tag_raw('comment', u'Foo')
+        db.save_to_location()
+        assert not db._dirty_tracks
@@ -39,14 +39,27 @@ from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gio
 import logging
+import multiprocessing
+import os
+import Queue
 import threading
 
-from xl import common, event, settings, trax
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from xl import common, event, metadata, settings, trax
+from xl.common import PICKLE_PROTOCOL
+from xl.trax.track import get_file_mtime, read_format_tags
 
 logger = logging.getLogger(__name__)
 
 COLLECTIONS = set()
 
+# number of new tracks added to the collection at once while scanning
+SCAN_COMMIT_BATCH = 256
+
 
 def get_collection_by_loc(loc):
     """
@@ -139,6 +152,8 @@ class Collection(trax.TrackDB):
         self._running_total_count = 0
         self._frozen = False
         self._libraries_dirty = False
+        self._scan_fast = False
+        self._manifests = None
         pickle_attrs += ['_serial_libraries']
         trax.TrackDB.__init__(self, name, location=location, pickle_attrs=pickle_attrs)
         COLLECTIONS.add(self)
@@ -207,6 +222,7 @@ class Collection(trax.TrackDB):
             if tr.startswith(location):
                 to_rem.append(self.tracks[tr]._track)
         self.remove_tracks(to_rem)
+        self._set_manifest(library, None)
 
         self.serialize_libraries()
         self._dirty = True
@@ -243,6 +259,12 @@ class Collection(trax.TrackDB):
 
         self._scanning = True
         self._scan_stopped = False
+        # startup scans only look at directories that have changed
+        self._scan_fast = (
+            startup_only
+            and not force_update
+            and settings.get_option('collection/fast_startup_scan', True)
+        )
 
         self.file_count = -1  # negative means we dont know it yet
 
@@ -269,6 +291,7 @@ class Collection(trax.TrackDB):
             try:
                 if self.location is not None:
                     self.save_to_location()
+                    self._save_manifests()
             except AttributeError:
                 logger.exception("Exception occurred while saving")
 
@@ -277,6 +300,7 @@ class Collection(trax.TrackDB):
         self._running_total_count = 0
         self._running_count = 0
         self._scanning = False
+        self._scan_fast = False
         self.file_count = -1
 
     @common.threaded
@@ -311,6 +335,63 @@ class Collection(trax.TrackDB):
         except ZeroDivisionError:
             pass
 
+    def _get_manifest_location(self):
+        if self.location is None:
+            return None
+        return self.location + '.dirs'
+
+    @common.synchronized
+    def _get_manifest(self, library):
+        """
+            Returns the directory manifest of a library, which maps the
+            uri of every directory to a tuple of (mtime, file names,
+            subdirectory names) as of the last completed scan.
+        """
+        if self._manifests is None:
+            self._manifests = {}
+            path = self._get_manifest_location()
+            if path is not None and os.path.exists(path):
+                try:
+                    with open(path, 'rb') as f:
+                        self._manifests = pickle.load(f)
+                except Exception:
+                    logger.exception("Could not load directory manifest %s", path)
+        return self._manifests.get(library.location, {})
+
+    @common.synchronized
+    def _set_manifest(self, library, manifest):
+        self._get_manifest(library)
+        if manifest is None:
+            self._manifests.pop(library.location, None)
+        else:
+            self._manifests[library.location] = manifest
+
+    @common.synchronized
+    def _save_manifests(self):
+        """
+            Saves the directory manifests of all libraries
+        """
+        path = self._get_manifest_location()
+        if path is None or self._manifests is None:
+            return
+        manifests = {
+            loc: manifest
+            for loc, manifest in self._manifests.iteritems()
+            if loc in self.libraries
+        }
+        tmp = path + '.new'
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump(manifests, f, PICKLE_PROTOCOL)
+            common.replace_file(tmp, path)
+        except (IOError, OSError):
+            # without the manifests the next scan reads every directory again
+            logger.exception("Could not save the library manifests")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
     def serialize_libraries(self):
         """
             Save information about libraries
@@ -519,6 +600,251 @@ class LibraryMonitor(GObject.GObject):
                 self.emit('location-removed', directory)
 
 
+class _ScanItem(object):
+    """
+        A directory or file found while scanning a library
+    """
+
+    __slots__ = [
+        'gfile',
+        'uri',
+        'mtime',
+        'track',
+        'read',
+        'format',
+        'tags',
+        'done',
+        'skipped',
+    ]
+
+    def __init__(self, gfile, fileinfo, skipped=0):
+        self.gfile = gfile
+        # number of files of an unchanged directory that weren't walked
+        self.skipped = skipped
+        self.uri = None
+        self.mtime = None
+        self.track = None
+        self.read = False  # whether the tags of the file were read
+        self.format = None
+        self.tags = None
+        self.done = fileinfo is None
+
+    @property
+    def is_dir(self):
+        return self.mtime is None
+
+
+class _ScanPipeline(object):
+    """
+        Reads the tags of the files in a library in parallel
+
+        A walker thread enumerates the library and skips files that
+        have not changed since they were last read, a pool of worker
+        threads reads the tags of the remaining files, and iterating
+        over the pipeline yields every walked item in walk order once
+        it is done. Nothing is modified by the pipeline itself, the
+        results are committed by the thread iterating over it.
+
+        Threads are used rather than processes because Gio and GLib
+        cannot safely be used after a fork, and reading tags mostly
+        waits for disk I/O, during which other threads can run.
+
+        While walking, the pipeline records the directory manifest of
+        the library (see :meth:`Collection._get_manifest`) in
+        :attr:`manifest`. It is only complete once the pipeline has
+        been fully consumed.
+    """
+
+    def __init__(
+        self,
+        library,
+        force_update=False,
+        workers=None,
+        max_pending=1024,
+        manifest=None,
+        fast=False,
+    ):
+        """
+            :param library: the :class:`Library` to scan
+            :param force_update: read files even if they are unchanged
+            :param workers: the number of threads reading tags
+            :param max_pending: the maximum number of walked items that
+                haven't been consumed yet
+            :param manifest: the directory manifest of the previous scan
+            :param fast: don't enumerate directories whose modification
+                time matches the previous manifest. Files modified in
+                place are not noticed then.
+        """
+        if workers is None:
+            workers = settings.get_option(
+                'collection/scan_threads', min(multiprocessing.cpu_count(), 8)
+            )
+        self.library = library
+        self.force_update = force_update
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.old_manifest = manifest or {}
+        self.fast = fast
+        self.manifest = {}
+
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._jobs = Queue.Queue()
+        self._walking = False
+        self._stopped = False
+
+    def __iter__(self):
+        self._walking = True
+        threads = [threading.Thread(target=self._walk, name='LibraryScanWalker')]
+        for i in range(self.workers):
+            threads.append(
+                threading.Thread(target=self._work, name='LibraryScanWorker-%d' % i)
+            )
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            while True:
+                with self._cond:
+                    while not self._pending or not self._pending[0].done:
+                        if self._stopped or not (self._walking or self._pending):
+                            return
+                        self._cond.wait()
+                    item = self._pending.popleft()
+                    self._cond.notify_all()
+                yield item
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+            Stops walking and reading files
+        """
+        with self._cond:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._cond.notify_all()
+
+    def _walk_directories(self):
+        """
+            Walks the library like :func:`common.walk_with_info` and
+            records the manifest. In fast mode, unchanged directories
+            are yielded with the number of files they contain, and only
+            their subdirectories are visited.
+
+            :rtype: tuples of (:class:`Gio.File`, :class:`Gio.FileInfo`,
+                number of skipped files)
+        """
+        root = Gio.File.new_for_uri(self.library.location)
+        queue = deque()
+        queue.append((root, None))
+
+        while queue:
+            directory, mtime = queue.pop()
+            uri = directory.get_uri()
+            if mtime is None:
+                try:
+                    mtime = get_file_mtime(
+                        directory.query_info(
+                            "time::modified", Gio.FileQueryInfoFlags.NONE, None
+                        )
+                    )
+                except GLib.Error:
+                    logger.debug("Directory %s is gone", uri)
+                    continue
+
+            entry = self.old_manifest.get(uri)
+            if self.fast and entry is not None and entry[0] == mtime:
+                self.manifest[uri] = entry
+                yield directory, None, len(entry[1])
+                for name in entry[2]:
+                    queue.append((directory.get_child(name), None))
+                continue
+
+            yield directory, None, 0
+            files = []
+            subdirs = []
+            try:
+                for fil, fileinfo in common.list_directory(directory, root):
+                    name = fileinfo.get_name()
+                    if fileinfo.get_file_type() == Gio.FileType.DIRECTORY:
+                        subdirs.append(name)
+                        queue.append((fil, get_file_mtime(fileinfo)))
+                    else:
+                        files.append(name)
+                        yield fil, fileinfo, 0
+            except GLib.Error:
+                logger.exception("Unhandled exception while walking on %s.", uri)
+            else:
+                self.manifest[uri] = (mtime, frozenset(files), tuple(subdirs))
+
+    def _walk(self):
+        collection = self.library.collection
+        try:
+            for gfile, fileinfo, skipped in self._walk_directories():
+                item = _ScanItem(gfile, fileinfo, skipped)
+                if fileinfo is not None:
+                    self._prepare(item, fileinfo, collection)
+
+                with self._cond:
+                    while len(self._pending) >= self.max_pending and not self._stopped:
+                        self._cond.wait()
+                    if self._stopped:
+                        break
+                    self._pending.append(item)
+                    if item.done:
+                        self._cond.notify_all()
+
+                if not item.done:
+                    self._jobs.put(item)
+        except Exception:
+            logger.exception("Error while walking %s", self.library.location)
+        finally:
+            for i in range(self.workers):
+                self._jobs.put(None)
+            with self._cond:
+                self._walking = False
+                self._cond.notify_all()
+
+    def _prepare(self, item, fileinfo, collection):
+        """
+            Determines whether the tags of a file need to be read
+        """
+        item.uri = item.gfile.get_uri()
+        item.mtime = get_file_mtime(fileinfo)
+        if not item.uri:  # we get segfaults if this check is removed
+            item.done = True
+            return
+
+        item.track = collection.get_track_by_loc(item.uri)
+        if (
+            item.track is not None
+            and not self.force_update
+            and (item.track.get_tag_raw('__modified') or 0) >= item.mtime
+        ):
+            item.done = True
+
+    def _work(self):
+        while True:
+            item = self._jobs.get()
+            if item is None:
+                return
+            if not self._stopped:
+                item.read = True
+                try:
+                    item.format = metadata.get_format(item.uri)
+                    if item.format is not None:
+                        item.tags = read_format_tags(item.format, item.uri, item.mtime)
+                except Exception:
+                    item.tags = None
+                    logger.exception("Error reading tags for %s", item.uri)
+            with self._cond:
+                item.done = True
+                self._cond.notify_all()
+
+
 class Library(object):
     """
         Scans and watches a folder for tracks, and adds them to
@@ -641,6 +967,11 @@ class Library(object):
         """
             Counts the number of files present in this directory
         """
+        if self.collection and self.collection._scan_fast:
+            manifest = self.collection._get_manifest(self)
+            if manifest:
+                return sum(1 + len(entry[1]) for entry in manifest.itervalues())
+
         count = 0
         for file in common.walk(Gio.File.new_for_uri(self.location)):
             if self.collection:
@@ -734,6 +1065,40 @@ class Library(object):
                 self.collection.add(tr)
         return tr
 
+    def _commit_scan_item(self, item, added):
+        """
+            Applies the tags read by a :class:`_ScanPipeline` to the
+            track of a file
+
+            :param item: the :class:`_ScanItem` of the file
+            :param added: new tracks are appended to this list, they
+                must be added to the collection by the caller
+
+            returns: the Track object, None if there is none
+        """
+        if not item.uri:
+            return None
+
+        tr = item.track
+        if tr is None:
+            tr = trax.Track(item.uri, scan=False)
+            if item.tags is not None:
+                # the track only existed already if _init is False
+                tr._set_read_tags(item.format, item.tags, notify_changed=not tr._init)
+                added.append(tr)
+            elif not tr._init:
+                # Track already existed. This fixes trax.get_tracks_from_uri
+                # on windows, unknown why fix isnt needed on linux.
+                added.append(tr)
+            else:
+                return None
+        elif item.read:
+            if item.tags is not None:
+                tr._set_read_tags(item.format, item.tags)
+            else:
+                tr._scan_valid = False
+        return tr
+
     def rescan(self, notify_interval=None, force_update=False):
         """
             Rescan the associated folder and add the contained files
@@ -752,15 +1117,20 @@ class Library(object):
         libloc = Gio.File.new_for_uri(self.location)
 
         count = 0
+        notified = 0
         dirtracks = deque()
         compilations = deque()
         ccheck = {}
-        for fil in common.walk(libloc):
-            count += 1
-            type = fil.query_info(
-                "standard::type", Gio.FileQueryInfoFlags.NONE, None
-            ).get_file_type()
-            if type == Gio.FileType.DIRECTORY:
+        added = []
+        pipeline = _ScanPipeline(
+            self,
+            force_update=force_update,
+            manifest=self.collection._get_manifest(self),
+            fast=self.collection._scan_fast,
+        )
+        for scanned in pipeline:
+            count += 1 + scanned.skipped
+            if scanned.is_dir:
                 if dirtracks:
                     for tr in dirtracks:
                         self._check_compilation(ccheck, compilations, tr)
@@ -779,8 +1149,11 @@ class Library(object):
                 dirtracks = deque()
                 compilations = deque()
                 ccheck = {}
-            elif type == Gio.FileType.REGULAR:
-                tr = self.update_track(fil, force_update=force_update)
+            else:
+                tr = self._commit_scan_item(scanned, added)
+                if len(added) >= SCAN_COMMIT_BATCH:
+                    self.collection.add_tracks(added)
+                    added = []
                 if not tr:
                     continue
 
@@ -797,27 +1170,35 @@ class Library(object):
                         logger.debug(
                             "Too many files, skipping "
                             "compilation detection heuristic for %s",
-                            fil.get_uri(),
+                            scanned.uri,
                         )
                         dirtracks = None
 
             if self.collection and self.collection._scan_stopped:
+                pipeline.stop()
+                if added:
+                    self.collection.add_tracks(added)
                 self.scanning = False
                 logger.info("Scan canceled")
                 return
 
             # progress update
-            if notify_interval is not None and count % notify_interval == 0:
+            if notify_interval is not None and count - notified >= notify_interval:
+                notified = count
                 event.log_event('tracks_scanned', self, count)
 
+        if added:
+            self.collection.add_tracks(added)
+        manifest = pipeline.manifest
+        self.collection._set_manifest(self, manifest)
+
         # final progress update
         if notify_interval is not None:
             event.log_event('tracks_scanned', self, count)
 
+        # Only files that weren't seen while walking have to be checked
         removals = deque()
-        for tr in self.collection.tracks.itervalues():
-            tr = tr._track
-            loc = tr.get_loc_for_io()
+        for loc, holder in self.collection.tracks.items():
             if not loc:
                 continue
             gloc = Gio.File.new_for_uri(loc)
@@ -828,8 +1209,13 @@ class Library(object):
                 logger.exception("Error decoding file location")
                 continue
 
+            parent = gloc.get_parent()
+            entry = manifest.get(parent.get_uri()) if parent else None
+            if entry is not None and gloc.get_basename() in entry[1]:
+                continue
+
             if not gloc.query_exists(None):
-                removals.append(tr)
+                removals.append(holder._track)
 
         for tr in removals:
             logger.debug(u"Removing %s", unicode(tr))
@@ -536,40 +536,78 @@ def walk(root):
         :returns: a generator object
         :rtype: :class:`Gio.File`
     """
+    for fil, fileinfo in walk_with_info(root):
+        yield fil
+
+
+def walk_with_info(root):
+    """
+        Walk through a Gio directory like :func:`walk`, yielding
+        each file together with the information gathered while
+        enumerating its directory.
+
+        :param root: a :class:`Gio.File` representing the
+            directory to walk through
+        :returns: a generator object
+        :rtype: tuples of (:class:`Gio.File`, :class:`Gio.FileInfo`);
+            the file info is None for directories, and contains
+            at least ``standard::type`` and ``time::modified`` for
+            regular files
+    """
     queue = deque()
     queue.append(root)
 
     while len(queue) > 0:
         dir = queue.pop()
-        yield dir
+        yield dir, None
         try:
-            for fileinfo in dir.enumerate_children(
-                "standard::type,"
-                "standard::is-symlink,standard::name,"
-                "standard::symlink-target,time::modified",
-                Gio.FileQueryInfoFlags.NONE,
-                None,
-            ):
-                fil = dir.get_child(fileinfo.get_name())
-                # FIXME: recursive symlinks could cause an infinite loop
-                if fileinfo.get_is_symlink():
-                    target = fileinfo.get_symlink_target()
-                    if "://" not in target and not os.path.isabs(target):
-                        fil2 = dir.get_child(target)
-                    else:
-                        fil2 = Gio.File.new_for_uri(target)
-                    # already in the collection, we'll get it anyway
-                    if fil2.has_prefix(root):
-                        continue
-                type = fileinfo.get_file_type()
-                if type == Gio.FileType.DIRECTORY:
+            for fil, fileinfo in list_directory(dir, root):
+                if fileinfo.get_file_type() == Gio.FileType.DIRECTORY:
                     queue.append(fil)
-                elif type == Gio.FileType.REGULAR:
-                    yield fil
+                else:
+                    yield fil, fileinfo
         except GLib.Error:  # why doesnt gio offer more-specific errors?
             logger.exception("Unhandled exception while walking on %s.", dir)
 
 
+def list_directory(dir, root):
+    """
+        Lists the subdirectories and regular files of a Gio directory,
+        skipping symlinks that point into the directory tree being
+        walked.
+
+        :param dir: a :class:`Gio.File` representing the directory
+        :param root: a :class:`Gio.File` representing the root of
+            the directory tree being walked
+        :returns: a generator object
+        :rtype: tuples of (:class:`Gio.File`, :class:`Gio.FileInfo`),
+            the file info contains ``standard::type``,
+            ``standard::name`` and ``time::modified``
+        :raises GLib.Error: if the directory cannot be enumerated
+    """
+    for fileinfo in dir.enumerate_children(
+        "standard::type,"
+        "standard::is-symlink,standard::name,"
+        "standard::symlink-target,time::modified",
+        Gio.FileQueryInfoFlags.NONE,
+        None,
+    ):
+        fil = dir.get_child(fileinfo.get_name())
+        # FIXME: recursive symlinks could cause an infinite loop
+        if fileinfo.get_is_symlink():
+            target = fileinfo.get_symlink_target()
+            if "://" not in target and not os.path.isabs(target):
+                fil2 = dir.get_child(target)
+            else:
+                fil2 = Gio.File.new_for_uri(target)
+            # already in the collection, we'll get it anyway
+            if fil2.has_prefix(root):
+                continue
+        type = fileinfo.get_file_type()
+        if type == Gio.FileType.DIRECTORY or type == Gio.FileType.REGULAR:
+            yield fil, fileinfo
+
+
 def walk_directories(root):
     """
         Walk through a Gio directory, yielding each subdirectory
@@ -32,9 +32,13 @@ as album art.
 
 from gi.repository import GLib
 from gi.repository import Gio
+import glob
 import logging
 import hashlib
 import os
+import Queue
+import threading
+import time
 
 try:
     import cPickle as pickle
@@ -70,19 +74,22 @@ class Cacher(object):
             pass
         self.cache_dir = cache_dir
 
-    def add(self, data):
+    def add(self, data, key=None):
         """
             Adds an entry to the cache.  Returns a key that can be used
             to retrieve the data from the cache.
 
             :param data: The data to store, as a bytestring.
+            :param key: The key to store the data under, defaults to
+                the SHA-256 hash of the data.
         """
         # FIXME: this doesnt handle hash collisions at all. with
         # 2^256 possible keys its unlikely that we'll have a collision,
         # but we should handle it anyway.
-        h = hashlib.sha256()
-        h.update(data)
-        key = h.hexdigest()
+        if key is None:
+            h = hashlib.sha256()
+            h.update(data)
+            key = h.hexdigest()
         path = os.path.join(self.cache_dir, key)
         with open(path, "wb") as fp:
             fp.write(data)
@@ -113,6 +120,383 @@ class Cacher(object):
                 return fp.read()
         return None
 
+    def remove_matching(self, pattern):
+        """
+            Remove the entries whose keys match a pattern.
+
+            :param pattern: A glob pattern, see :mod:`fnmatch`.
+        """
+        for path in glob.glob(os.path.join(self.cache_dir, pattern)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def prune(self, max_size):
+        """
+            Remove the least recently stored entries until the cache
+            takes up no more than max_size bytes.
+        """
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        entries = []
+        total = 0
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        if total <= max_size:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+class _CoverDB(object):
+    """
+        The album key -> db_string mappings of the cover manager
+
+        They are stored in a snapshot file, followed by a journal file
+        of the changes since it was written. The snapshot starts with
+        the version, the mappings after it are only read when they are
+        first needed. Changes are appended to the journal when saved,
+        and merged into the snapshot once the journal has outgrown it.
+
+        Both files start with a generation number, which is increased
+        whenever the snapshot is written, so that a journal left over
+        from an earlier snapshot is never applied to a newer one.
+    """
+
+    #: minimum size of the journal before it is merged into the snapshot
+    COMPACT_SIZE = 65536
+
+    def __init__(self, path, version):
+        """
+            :param path: the location of the snapshot
+            :param version: the version of a new db
+        """
+        self.path = path
+        self.version = version
+        self.__lock = threading.RLock()
+        # the mappings, None until they are read
+        self.__data = None
+        # (location, offset) of the mappings in the snapshot
+        self.__snapshot = None
+        # generation of the snapshot the journal belongs to
+        self.__generation = 0
+        # whether the journal is known to belong to the snapshot and to
+        # end with a complete change, so that changes can be appended
+        self.__journal_checked = False
+        # (key, db_string or None) changes not in the journal yet
+        self.__pending = []
+        # whether the snapshot has to be written on the next save
+        self.__compact = False
+
+        for loc in (path, path + ".old", path + ".new"):
+            try:
+                with open(loc, 'rb') as f:
+                    header = pickle.load(f)
+                    offset = f.tell()
+            except IOError:
+                continue
+            except Exception:
+                logger.warning("Removing damaged %s", loc)
+                try:
+                    os.remove(loc)
+                except OSError:
+                    pass
+                continue
+            if isinstance(header, dict):
+                # written by Exaile 4.0: a single dict including the version
+                self.version = header.pop('version', 1)
+                self.__data = header
+                self.__compact = True
+            else:
+                self.version, self.__generation = header
+                self.__snapshot = (loc, offset)
+                self.__compact = loc != path
+            break
+        else:
+            self.__data = {}
+            self.__read_journal(self.__data)
+            self.__compact = True
+
+    def __load(self):
+        """
+            Returns the mappings, reading them if that has not been
+            done yet
+        """
+        data = self.__data
+        if data is not None:
+            return data
+        with self.__lock:
+            if self.__data is not None:
+                return self.__data
+            loc, offset = self.__snapshot
+            try:
+                with open(loc, 'rb') as f:
+                    f.seek(offset)
+                    data = pickle.load(f)
+            except Exception:
+                logger.exception("Could not read %s", loc)
+                data = {}
+            self.__read_journal(data)
+            for key, value in self.__pending:
+                self.__apply(data, key, value)
+            self.__data = data
+            return data
+
+    def __read_journal(self, data=None):
+        """
+            Applies the changes in the journal to data, or only checks
+            them if data is None. A journal of another snapshot is
+            removed, as is a damaged change at the end from writing it
+            being interrupted.
+        """
+        path = self.path + ".journal"
+        self.__journal_checked = True
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            try:
+                generation = pickle.load(f)
+            except Exception:
+                generation = None
+            if generation is None:
+                position = 0
+            elif generation != self.__generation:
+                f.close()
+                logger.info("Removing outdated %s", path)
+                os.remove(path)
+                return
+            else:
+                while True:
+                    position = f.tell()
+                    try:
+                        key, value = pickle.load(f)
+                    except Exception:
+                        break
+                    if data is not None:
+                        self.__apply(data, key, value)
+        if position < size:
+            logger.warning("Removing damaged end of %s", path)
+            with open(path, 'r+b') as f:
+                f.truncate(position)
+
+    @staticmethod
+    def __apply(data, key, value):
+        if value is None:
+            data.pop(key, None)
+        else:
+            data[key] = value
+
+    def get(self, key, default=None):
+        return self.__load().get(key, default)
+
+    def __contains__(self, key):
+        return key in self.__load()
+
+    def __getitem__(self, key):
+        return self.__load()[key]
+
+    def __setitem__(self, key, value):
+        with self.__lock:
+            if self.__data is not None:
+                self.__data[key] = value
+            self.__pending.append((key, value))
+
+    def __delitem__(self, key):
+        with self.__lock:
+            del self.__load()[key]
+            self.__pending.append((key, None))
+
+    def replace(self, data, version):
+        """
+            Replaces all mappings
+        """
+        with self.__lock:
+            self.__data = dict(data)
+            self.version = version
+            self.__pending = []
+            self.__compact = True
+
+    def save(self):
+        """
+            Appends the changes to the journal, or writes the snapshot
+            if the journal has become too large
+        """
+        path = self.path
+        with self.__lock:
+            if not self.__compact:
+                if not self.__pending:
+                    return
+                if not self.__journal_checked:
+                    self.__read_journal()
+                try:
+                    size = os.path.getsize(path + ".journal")
+                except OSError:
+                    size = 0
+                try:
+                    snapshot_size = os.path.getsize(self.__snapshot[0])
+                except (OSError, TypeError):
+                    snapshot_size = 0
+                self.__compact = size > max(snapshot_size, self.COMPACT_SIZE)
+
+            if not self.__compact:
+                try:
+                    with open(path + ".journal", 'ab') as f:
+                        if size == 0:
+                            pickle.dump(self.__generation, f, common.PICKLE_PROTOCOL)
+                        for change in self.__pending:
+                            pickle.dump(change, f, common.PICKLE_PROTOCOL)
+                except IOError:
+                    logger.exception("Could not save covers")
+                    # the end of the journal may be damaged now
+                    self.__journal_checked = False
+                    return
+                self.__pending = []
+                return
+
+            data = self.__load()
+            generation = self.__generation + 1
+            try:
+                with open(path + ".new", 'wb') as f:
+                    pickle.dump((self.version, generation), f, common.PICKLE_PROTOCOL)
+                    offset = f.tell()
+                    pickle.dump(data, f, common.PICKLE_PROTOCOL)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except IOError:
+                logger.exception("Could not save covers")
+                return
+            try:
+                os.rename(path, path + ".old")
+            except OSError:
+                pass  # if it doesn'texist we don't care
+            os.rename(path + ".new", path)
+            self.__generation = generation
+            # a journal left behind belongs to an earlier generation
+            # and is removed when it is next read
+            self.__journal_checked = False
+            for loc in (path + ".journal", path + ".old"):
+                try:
+                    os.remove(loc)
+                except OSError:
+                    pass
+            self.__snapshot = (path, offset)
+            self.__pending = []
+            self.__compact = False
+
+
+class _SearchJob(object):
+    """
+        A call whose result can be waited for from other threads
+    """
+
+    __slots__ = ['func', 'args', 'kwargs', 'result', 'done', 'running', 'abandoned']
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        #: the return value, None until done or if the call failed
+        self.result = None
+        self.done = threading.Event()
+        # whether a thread of a _SearchPool has started the call
+        self.running = False
+        # whether nothing waits for the call anymore, see _SearchPool
+        self.abandoned = False
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+        except Exception:
+            logger.exception("Cover search failed")
+        finally:
+            self.done.set()
+
+
+class _SearchPool(object):
+    """
+        Runs jobs in at most a fixed number of threads, which are
+        started when they are first needed
+
+        A thread running a job that is abandoned, because it took too
+        long, no longer counts towards that number. It is replaced, and
+        ends once the job returns, so that calls that hang can't keep
+        the other jobs from running.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.__queue = Queue.Queue()
+        self.__threads = 0
+        self.__lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """
+            Queues a call
+
+            :rtype: :class:`_SearchJob`
+        """
+        job = _SearchJob(func, *args, **kwargs)
+        self.__queue.put(job)
+        with self.__lock:
+            self.__start()
+        return job
+
+    def abandon(self, job):
+        """
+            Tells that nothing waits for a job anymore. It is not
+            started if it is still queued.
+        """
+        with self.__lock:
+            if job.done.is_set() or job.abandoned:
+                return
+            job.abandoned = True
+            if job.running:
+                self.__threads -= 1
+                self.__start()
+
+    def __start(self):
+        """
+            Starts a thread if there are less than size, must be called
+            with the lock held
+        """
+        if self.__threads < self.size:
+            self.__threads += 1
+            thread = threading.Thread(target=self.__work, name='CoverSearch')
+            thread.daemon = True
+            thread.start()
+
+    def __work(self):
+        while True:
+            job = self.__queue.get()
+            with self.__lock:
+                if job.abandoned:
+                    continue
+                job.running = True
+            job.run()
+            with self.__lock:
+                if job.abandoned:
+                    # this thread has been replaced
+                    return
+
 
 class CoverManager(providers.ProviderHandler):
     """
@@ -120,6 +504,16 @@ class CoverManager(providers.ProviderHandler):
     """
 
     DB_VERSION = 2
+    #: number of remote methods searched at the same time
+    REMOTE_WORKERS = 4
+    #: seconds to wait for a remote method without a timeout attribute
+    REMOTE_TIMEOUT = 20
+    #: seconds a remote method is not searched again for an album it
+    #: has found no covers for
+    NEGATIVE_TIMEOUT = 600
+    #: bytes of thumbnails kept on disk, the least recently stored ones
+    #: are removed when loading
+    THUMBNAILS_MAX_SIZE = 32 * 1024 * 1024
 
     def __init__(self, location):
         """
@@ -127,10 +521,16 @@ class CoverManager(providers.ProviderHandler):
         """
         providers.ProviderHandler.__init__(self, "covers")
         self.__cache = Cacher(os.path.join(location, 'cache'))
+        self.__thumbnails = Cacher(os.path.join(location, 'thumbnails'))
         self.location = location
         self.methods = {}
         self.order = settings.get_option('covers/preferred_order', [])
-        self.db = {'version': self.DB_VERSION}
+        self.__pool = _SearchPool(self.REMOTE_WORKERS)
+        self.__lock = threading.Lock()
+        # (album key, limit) -> _SearchJob of the remote search in progress
+        self.__searches = {}
+        # (method name, album key, limit) -> (expiry time or None, covers)
+        self.__remote_results = common.LimitedCache(256)
         self.load()
         for method in self.get_providers():
             self.on_provider_added(method)
@@ -171,7 +571,7 @@ class CoverManager(providers.ProviderHandler):
         for name in self.order:
             if name in self.methods:
                 methods.append(self.methods[name])
-        for k, method in self.methods.iteritems():
+        for k, method in self.methods.items():
             if method not in methods:
                 methods.append(method)
         nonfixed = [m for m in methods if not m.fixed]
@@ -255,12 +655,14 @@ class CoverManager(providers.ProviderHandler):
 
         return self.db.get(key)
 
-    @common.synchronized
-    @common.cached(5)
     def find_covers(self, track, limit=-1, local_only=False):
         """
             Find all covers for a track
 
+            Local methods are searched first, in the calling thread.
+            Remote methods are only searched if these did not find
+            enough covers, all of them at once, see :meth:`_find_remote`.
+
             :param track: The track to find covers for
             :param limit: maximum number of covers to return. -1=unlimited.
             :param local_only: If True, will only return results from local
@@ -269,16 +671,100 @@ class CoverManager(providers.ProviderHandler):
         if track is None:
             return
         covers = []
+        remote = []
         for method in self._get_methods(fixed=True):
             if local_only and method.use_cache:
                 continue
+            if not getattr(method, 'local', False):
+                remote.append(method)
+                continue
             new = method.find_covers(track, limit=limit)
             new = ["%s:%s" % (method.name, x) for x in new]
             covers.extend(new)
             if limit != -1 and len(covers) >= limit:
-                break
+                return covers
+
+        if remote:
+            if limit != -1:
+                limit -= len(covers)
+            covers.extend(self._find_remote(remote, track, limit))
         return covers
 
+    def _find_remote(self, methods, track, limit=-1):
+        """
+            Searches remote methods for covers of a track
+
+            The methods are searched in parallel by a pool of threads.
+            Searches for the same album that are in progress are waited
+            for instead of being started again.
+
+            :param methods: the methods in the order of preference
+            :param limit: maximum number of covers to return. -1=unlimited.
+            :returns: the db_strings of the covers found
+        """
+        key = self._get_track_key(track)
+        if key is None:
+            key = track.get_loc_for_io()
+
+        with self.__lock:
+            search = self.__searches.get((key, limit))
+            started = search is None
+            if started:
+                search = self.__searches[(key, limit)] = _SearchJob(
+                    self.__search_remote, methods, track, key, limit
+                )
+
+        if not started:
+            # the search itself waits for no method longer than its
+            # timeout, waiting for it with the same timeout could miss
+            # its results
+            search.done.wait()
+            return list(search.result or [])
+
+        try:
+            search.run()
+        finally:
+            with self.__lock:
+                del self.__searches[(key, limit)]
+        return list(search.result or [])
+
+    def __search_remote(self, methods, track, key, limit):
+        now = time.time()
+        jobs = []
+        for method in methods:
+            with self.__lock:
+                try:
+                    expiry, covers = self.__remote_results[(method.name, key, limit)]
+                except KeyError:
+                    expiry, covers = now, None
+            if expiry is None or expiry > now:
+                jobs.append((method, covers))
+            else:
+                job = self.__pool.submit(method.find_covers, track, limit=limit)
+                jobs.append((method, job))
+
+        found = []
+        for method, job in jobs:
+            if isinstance(job, _SearchJob):
+                timeout = getattr(method, 'timeout', self.REMOTE_TIMEOUT)
+                if not job.done.wait(max(0, now + timeout - time.time())):
+                    logger.info("Cover search of %s timed out", method.name)
+                    self.__pool.abandon(job)
+                    continue
+                if job.result is None:
+                    continue
+                covers = list(job.result)
+                # covers that were not found are searched again later
+                expiry = None if covers else time.time() + self.NEGATIVE_TIMEOUT
+                with self.__lock:
+                    self.__remote_results[(method.name, key, limit)] = (expiry, covers)
+            else:
+                covers = job
+            found.extend("%s:%s" % (method.name, x) for x in covers)
+            if limit != -1 and len(found) >= limit:
+                break
+        return found
+
     def set_cover(self, track, db_string, data=None):
         """
             Sets the cover for a track. This will overwrite any existing
@@ -296,7 +782,10 @@ class CoverManager(providers.ProviderHandler):
             db_string = "cache:%s" % self.__cache.add(data)
         key = self._get_track_key(track)
         if key:
+            old_db_string = self.db.get(key)
             self.db[key] = db_string
+            if old_db_string and old_db_string != db_string:
+                self.__remove_thumbnails(old_db_string)
             self.timeout_save()
             event.log_event('cover_set', self, track)
 
@@ -311,6 +800,7 @@ class CoverManager(providers.ProviderHandler):
         if db_string:
             del self.db[key]
             self.__cache.remove(db_string)
+            self.__remove_thumbnails(db_string)
             self.timeout_save()
             event.log_event('cover_removed', self, track)
 
@@ -370,6 +860,55 @@ class CoverManager(providers.ProviderHandler):
             ret = self.get_default_cover()
         return ret
 
+    @staticmethod
+    def _get_thumbnail_key(db_string, size):
+        """
+            Returns the key of a thumbnail in the thumbnail cache, or
+            None if the cover cannot have a cached thumbnail
+        """
+        source, data = db_string.split(":", 1)
+        # Only cached covers are content-addressed, the data of other
+        # sources can change without their db_string changing
+        if source != "cache":
+            return None
+        return "%s-%dx%d" % (data, size[0], size[1])
+
+    def __remove_thumbnails(self, db_string):
+        """
+            Removes the thumbnails of a cover in all sizes
+        """
+        source, data = db_string.split(":", 1)
+        if source == "cache":
+            self.__thumbnails.remove_matching("%s-*" % data)
+
+    def get_thumbnail_data(self, db_string, size):
+        """
+            Get the image data of a scaled down cover stored with
+            :meth:`set_thumbnail_data`.
+
+            :param db_string: The db_string identifying the cover.
+            :param size: The (width, height) the cover was scaled to fit.
+            :returns: the image data, or None if there is no thumbnail
+        """
+        key = self._get_thumbnail_key(db_string, size)
+        if key is None:
+            return None
+        return self.__thumbnails.get(key)
+
+    def set_thumbnail_data(self, db_string, size, data):
+        """
+            Store the image data of a scaled down cover, so it does not
+            have to be scaled again. Thumbnails are only stored for
+            covers in the cover cache.
+
+            :param db_string: The db_string identifying the cover.
+            :param size: The (width, height) the cover was scaled to fit.
+            :param data: The image data of the thumbnail.
+        """
+        key = self._get_thumbnail_key(db_string, size)
+        if key is not None:
+            self.__thumbnails.add(data, key)
+
     def get_default_cover(self):
         """
             Get the raw image data for the cover to show if there is no
@@ -382,30 +921,16 @@ class CoverManager(providers.ProviderHandler):
         """
             Load the saved db
         """
-        path = os.path.join(self.location, 'covers.db')
-        data = None
-        for loc in [path, path + ".old", path + ".new"]:
-            try:
-                with open(loc, 'rb') as f:
-                    data = pickle.load(f)
-            except IOError:
-                pass
-            except EOFError:
-                try:
-                    os.remove(loc)
-                except Exception:
-                    pass
-            if data:
-                break
-        if data:
-            self.db = data
-        version = self.db.get('version', 1)
-        if version > self.DB_VERSION:
+        self.db = _CoverDB(os.path.join(self.location, 'covers.db'), self.DB_VERSION)
+        if self.db.version > self.DB_VERSION:
             logger.error(
                 "covers.db version (%s) higher than supported (%s); using anyway",
-                version,
+                self.db.version,
                 self.DB_VERSION,
             )
+        # thumbnails of sizes that are no longer shown are not removed
+        # otherwise
+        self.__thumbnails.prune(self.THUMBNAILS_MAX_SIZE)
 
     @common.glib_wait_seconds(60)
     def timeout_save(self):
@@ -415,21 +940,7 @@ class CoverManager(providers.ProviderHandler):
         """
             Save the db
         """
-        path = os.path.join(self.location, 'covers.db')
-        try:
-            with open(path + ".new", 'wb') as f:
-                pickle.dump(self.db, f, common.PICKLE_PROTOCOL)
-        except IOError:
-            return
-        try:
-            os.rename(path, path + ".old")
-        except OSError:
-            pass  # if it doesn'texist we don't care
-        os.rename(path + ".new", path)
-        try:
-            os.remove(path + ".old")
-        except OSError:
-            pass
+        self.db.save()
 
     def on_provider_added(self, provider):
         self.methods[provider.name] = provider
@@ -491,6 +1002,11 @@ class CoverSearchMethod(object):
     #: Priority for fixed-position backends. Lower is earlier, non-fixed
     #  backends will always be 50.
     fixed_priority = 50
+    #: Whether the method only looks at local data. Local methods are
+    #  searched first and one at a time, other methods in parallel.
+    local = False
+    #: Seconds to wait for find_covers of a method that is not local
+    timeout = 20
 
     def find_covers(self, track, limit=-1):
         """
@@ -523,6 +1039,7 @@ class TagCoverFetcher(CoverSearchMethod):
     cover_tags = ["cover", "coverart"]
     fixed = True
     fixed_priority = 30
+    local = True
 
     def find_covers(self, track, limit=-1):
         covers = []
@@ -568,6 +1085,7 @@ class LocalFileCoverFetcher(CoverSearchMethod):
     preferred_names = []
     fixed = True
     fixed_priority = 31
+    local = True
 
     def __init__(self):
         CoverSearchMethod.__init__(self)
@@ -27,13 +27,17 @@
 import logging
 import os
 import random
+import threading
 import time
 
-from xl import xdg, providers, settings
+from xl import common, event, xdg, providers, settings
 from xl.trax import search
 
 logger = logging.getLogger(__name__)
 
+#: Time after which similar artists are queried again, in seconds
+SIMILAR_ARTISTS_MAX_AGE = 604800  # one week
+
 
 class DynamicManager(providers.ProviderHandler):
     """
@@ -47,6 +51,8 @@ class DynamicManager(providers.ProviderHandler):
         self.cachedir = os.path.join(xdg.get_cache_dir(), 'dynamic')
         if not os.path.exists(self.cachedir):
             os.makedirs(self.cachedir)
+        self._cache = None
+        self._cache_lock = threading.Lock()
 
     def find_similar_tracks(self, track, limit=-1, exclude=[]):
         """
@@ -58,33 +64,37 @@ class DynamicManager(providers.ProviderHandler):
                 tracks. If there are more tracks than this
                 found, a random selection of those tracks is
                 returned.
+            @param exclude: tracks that must not be returned
         """
         logger.debug(u"Searching for %s tracks related to %s", limit, track)
         artists = self.find_similar_artists(track)
         if artists == []:
             return []
+        exclude = set(exclude)
         tracks = []
         random.shuffle(artists)
-        i = 0
-        while (limit > len(tracks) or limit == -1) and i < len(artists):
-            artist = artists[i][1].replace('"', '\\\"')
-            i += 1
-            searchres = search.search_tracks_from_string(
-                self.collection, 'artist=="%s"' % artist, case_sensitive=False
-            )
-            choices = [x.track for x in searchres]
-            if choices == []:
-                continue
-            random.shuffle(choices)
-            j = 0
-            while j < len(choices):
-                track = choices[j]
-                if track not in exclude:
-                    tracks.append(track)
-                    break
-                j += 1
+        for rel, artist in artists:
+            if limit != -1 and len(tracks) >= limit:
+                break
+            choices = [
+                tr for tr in self._get_artist_tracks(artist) if tr not in exclude
+            ]
+            if choices:
+                track = random.choice(choices)
+                tracks.append(track)
+                exclude.add(track)
         return tracks
 
+    def _get_artist_tracks(self, artist):
+        """
+            Returns the tracks of an artist in the collection. The search
+            index of the collection answers this without a full scan.
+        """
+        matcher = search.TracksMatcher(
+            'artist=="%s"' % artist.replace('"', '\\"'), case_sensitive=False
+        )
+        return [x.track for x in search.search_tracks(self.collection, [matcher])]
+
     def find_similar_artists(self, track):
         info = self._load_saved_info(track)
         if info == []:
@@ -104,40 +114,90 @@ class DynamicManager(providers.ProviderHandler):
         info.sort(reverse=True)  # TODO: merge artists that are the same
         return info
 
-    def _load_saved_info(self, track):
+    @staticmethod
+    def _get_cache_key(track):
         artist = track.get_tag_raw('artist')
         if not artist:
+            return None
+        return ','.join(artist).encode('utf-8')
+
+    def _get_cache(self):
+        """
+            Returns the shelf that stores the similar artists of each
+            artist, opening it if necessary. Must be called with the
+            cache lock held.
+        """
+        if self._cache is None:
+            self._cache = common.open_shelf(os.path.join(self.cachedir, 'artists.db'))
+            event.add_callback(self.on_quit_application, 'quit_application')
+        return self._cache
+
+    def _load_legacy_info(self, key):
+        """
+            Reads the similar artists from the text file that older
+            versions stored for each artist, and removes the file
+        """
+        filename = os.path.join(self.cachedir, key)
+        if not os.path.isfile(filename):
+            return None
+        info = []
+        try:
+            with open(filename) as f:
+                last_update = float(f.readline())
+                for line in f:
+                    try:
+                        rel, artist = line.strip().split(" ", 1)
+                        info.append((float(rel), artist.decode('utf-8')))
+                    except Exception:
+                        pass
+        except (IOError, ValueError):
+            return None
+        finally:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+        return last_update, info
+
+    def _load_saved_info(self, track):
+        key = self._get_cache_key(track)
+        if key is None:
             return []
-        filename = os.path.join(self.cachedir, ','.join(artist))
-        if not os.path.exists(filename):
-            return []
-        with open(filename) as f:
-            line = f.readline()
-            if line == '':
-                return []
-            last_update = float(line)
-            if 604800 < time.time() - last_update:  # one week
-                info = self._query_sources(track)
-                if info != []:
-                    self._save_info(track, info)
-                    return info
-            info = []
-            for line in f:
-                try:
-                    rel, artist = line.strip().split(" ", 1)
-                    info.append((rel, artist))
-                except Exception:
-                    pass
-        return info
+        with self._cache_lock:
+            cache = self._get_cache()
+            entry = cache.get(key)
+            if entry is None:
+                entry = self._load_legacy_info(key)
+                if entry is None:
+                    return []
+                cache[key] = entry
+        last_update, info = entry
+        if SIMILAR_ARTISTS_MAX_AGE < time.time() - last_update:
+            newinfo = self._query_sources(track)
+            if newinfo != []:
+                self._save_info(track, newinfo)
+                return newinfo
+        return list(info)
 
     def _save_info(self, track, info):
         if info == []:
             return
-        filename = os.path.join(self.cachedir, track.get_tag_raw('artist', join=True))
-        with open(filename, 'w') as f:
-            f.write("%s\n" % time.time())
-            for item in info:
-                f.write("%.2f %s\n" % item)
+        key = self._get_cache_key(track)
+        if key is None:
+            return
+        with self._cache_lock:
+            cache = self._get_cache()
+            cache[key] = (time.time(), info)
+            cache.sync()
+
+    def on_quit_application(self, *args):
+        """
+            Closes the similar artists cache
+        """
+        with self._cache_lock:
+            if self._cache is not None:
+                self._cache.close()
+                self._cache = None
 
     def populate_playlist(self, playlist):
         """
@@ -158,15 +218,22 @@ class DynamicManager(providers.ProviderHandler):
         starttime = time.time()
         tracks = self.find_similar_tracks(curr, needed, playlist)
 
+        def extend():
+            if playlist.current_position != current_pos:
+                return  # we skipped in that 5 seconds, so ignore it
+            playlist.extend(tracks)
+            logger.debug("Added %s tracks.", len(tracks))
+
+        # Wait a little before adding the tracks, without blocking the
+        # calling thread
         remainingtime = 5 - (time.time() - starttime)
 
         if remainingtime > 0:
-            time.sleep(remainingtime)
-
-        if playlist.current_position != current_pos:
-            return  # we skipped in that 5 seconds, so ignore it
-        playlist.extend(tracks)
-        logger.debug("Added %s tracks.", len(tracks))
+            timer = threading.Timer(remainingtime, extend)
+            timer.daemon = True
+            timer.start()
+        else:
+            extend()
 
 
 MANAGER = DynamicManager()
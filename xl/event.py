@@ -37,6 +37,7 @@ Events should be emitted AFTER the given event has taken place. Often the
 most appropriate spot is immediately before a return statement.
 """
 
+from collections import OrderedDict
 from inspect import ismethod
 import logging
 import re
@@ -139,6 +140,32 @@ def add_ui_callback(function, evty=None, obj=None, *args, **kwargs):
     return EVENT_MANAGER.add_callback(function, evty, obj, args, kwargs, ui=True)
 
 
+def add_batch_callback(function, evty=None, obj=None, *args, **kwargs):
+    """
+        Adds a callback that receives events in batches, on the UI
+        thread. Use this instead of :func:`add_ui_callback` for events
+        that are sent in large numbers, such as `track_tags_changed`.
+
+        Events are collected per event type until the main loop is idle,
+        and are then passed to the callback in a single call::
+
+            function(evty, items, *args, **kwargs)
+
+        `items` is a list of (object, data) tuples with one entry for
+        each object that sent the event, in the order the objects first
+        sent it. The data of multiple events of one object is coalesced:
+        sets are merged, any other data is replaced by the data of the
+        latest event.
+
+        The parameters are the same as for :func:`add_callback`, and the
+        callback is removed with :func:`remove_callback`.
+
+        :returns: a convenience function that you can call to remove the callback.
+    """
+    global EVENT_MANAGER
+    return EVENT_MANAGER.add_callback(function, evty, obj, args, kwargs, batch=True)
+
+
 def remove_callback(function, evty=None, obj=None):
     """
         Removes a callback. Can remove both ui and non-ui callbacks.
@@ -173,22 +200,90 @@ class Callback(object):
         Represents a callback
     """
 
-    __slots__ = ['wfunction', 'time', 'args', 'kwargs']
+    __slots__ = ['wfunction', 'time', 'args', 'kwargs', 'batch']
 
-    def __init__(self, function, time, args, kwargs):
+    def __init__(self, function, time, args, kwargs, batch=None):
         """
             @param function: the function to call
             @param time: the time this callback was added
+            @param batch: the _Batch collecting events for the callback,
+                if it receives events in batches
         """
         self.wfunction = _getWeakRef(function)
         self.time = time
         self.args = args
         self.kwargs = kwargs
+        self.batch = batch
 
     def __repr__(self):
         return '<Callback %s>' % self.wfunction()
 
 
+class _Batch(object):
+    """
+        Collects the events of a batched callback until the main loop
+        is idle
+    """
+
+    __slots__ = ['manager', 'callback', 'pending', 'lock', 'removed']
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.callback = None
+        # event type -> OrderedDict of object -> coalesced data
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        # whether the callback has been removed, see remove
+        self.removed = False
+
+    def add(self, event):
+        with self.lock:
+            if self.removed:
+                return
+            schedule = not self.pending
+            items = self.pending.get(event.type)
+            if items is None:
+                items = self.pending[event.type] = OrderedDict()
+            data = event.data
+            old = items.get(event.object, _NONE)
+            if isinstance(old, (set, frozenset)) and isinstance(
+                data, (set, frozenset)
+            ):
+                data = old | data
+            items[event.object] = data
+
+        if schedule:
+            GLib.idle_add(self.flush)
+
+    def remove(self):
+        """
+            Drops the collected events, called when the callback is
+            removed
+        """
+        with self.lock:
+            self.removed = True
+            self.pending = OrderedDict()
+
+    def flush(self):
+        with self.lock:
+            if self.removed:
+                return False
+            pending = self.pending
+            self.pending = OrderedDict()
+
+        cb = self.callback
+        fn = cb.wfunction()
+        if fn is None:
+            return False
+
+        for evty, items in pending.iteritems():
+            try:
+                self.manager._call(cb, fn, evty, items.items())
+            except Exception:
+                logger.exception("Event callback exception caught!")
+        return False
+
+
 class _WeakMethod(object):
     """Represent a weak bound method, i.e. a method doesn't keep alive the
     object that it is bound to. It uses WeakRef which, used on its own,
@@ -265,6 +360,8 @@ class EventManager(object):
 
     def __init__(self, use_logger=False, logger_filter=None, verbose=False):
         # sacrifice space for speed in emit
+        # The callback tuples are replaced instead of modified while the
+        # lock is held, so emit can look them up without locking.
         self.all_callbacks = {}
         self.callbacks = {}
         self.ui_callbacks = {}
@@ -279,6 +376,11 @@ class EventManager(object):
         self.pending_ui = []
         self.pending_ui_lock = threading.Lock()
 
+        #: Whether to count emits and time callbacks, see get_stats
+        self.collect_stats = False
+        self.stats = {}
+        self.stats_start = time.time()
+
     def emit(self, event):
         """
             Emits an Event, calling any registered callbacks.
@@ -291,6 +393,9 @@ class EventManager(object):
         )
         emit_verbose = emit_logmsg and self.use_verbose_logger
 
+        if self.collect_stats:
+            self._get_stats(event.type)[0] += 1
+
         global _UiThread
         is_ui_thread = threading.current_thread() == _UiThread
 
@@ -325,18 +430,13 @@ class EventManager(object):
         # Accumulate in this set to ensure callbacks only get called once
         callbacks = set()
 
-        with self.lock:
-            for tcall in [_NONE, event.type]:
-                tcb = exc_callbacks.get(tcall)
-                if tcb is not None:
-                    for ocall in [_NONE, event.object]:
-                        ocb = tcb.get(ocall)
-                        if ocb is not None:
-                            callbacks.update(ocb)
-
-        # However, do not actually call the callbacks from within the lock
-        # -> Otherwise non-ui threads could accidentally block the UI if
-        #    they decide to run for too long
+        for tcall in [_NONE, event.type]:
+            tcb = exc_callbacks.get(tcall)
+            if tcb is not None:
+                for ocall in [_NONE, event.object]:
+                    ocb = tcb.get(ocall)
+                    if ocb is not None:
+                        callbacks.update(ocb)
 
         for cb in callbacks:
             try:
@@ -347,9 +447,14 @@ class EventManager(object):
                     # your event handler
                     with self.lock:
                         try:
-                            exc_callbacks[event.type][event.object].remove(cb)
-                        except (KeyError, ValueError):
+                            ocb = exc_callbacks[event.type][event.object]
+                            exc_callbacks[event.type][event.object] = tuple(
+                                c for c in ocb if c is not cb
+                            )
+                        except KeyError:
                             pass
+                elif cb.batch is not None:
+                    cb.batch.add(event)
                 else:
                     if emit_verbose:
                         logger.debug(
@@ -357,9 +462,7 @@ class EventManager(object):
                             "%(function)s in response "
                             "to %(event)s." % {'function': fn, 'event': event.type}
                         )
-                    fn.__call__(
-                        event.type, event.object, event.data, *cb.args, **cb.kwargs
-                    )
+                    self._call(cb, fn, event.type, event.object, event.data)
                 fn = None
             except Exception:
                 # something went wrong inside the function we're calling
@@ -373,13 +476,79 @@ class EventManager(object):
                 event.data,
             )
 
+    def _call(self, cb, fn, evty, *args):
+        """
+            Calls the function of a callback, timing it if needed
+        """
+        if not self.collect_stats:
+            fn(evty, *(args + cb.args), **cb.kwargs)
+            return
+
+        start = time.time()
+        try:
+            fn(evty, *(args + cb.args), **cb.kwargs)
+        finally:
+            duration = time.time() - start
+            stats = self._get_stats(evty)
+            stats[1] += 1
+            stats[2] += duration
+            if duration > stats[3]:
+                stats[3] = duration
+
+    def _get_stats(self, evty):
+        try:
+            return self.stats[evty]
+        except KeyError:
+            # emits, callback calls, total and maximum callback time
+            return self.stats.setdefault(evty, [0, 0, 0.0, 0.0])
+
+    def get_stats(self):
+        """
+            Returns statistics about the events sent since
+            :attr:`collect_stats` was enabled or :meth:`reset_stats` was
+            called. The counters are not locked, so they are approximate
+            when events are sent from several threads.
+
+            :returns: a dict of event type -> (emits per second, emits,
+                callback calls, average and maximum callback time in
+                seconds)
+        """
+        elapsed = max(time.time() - self.stats_start, 0.001)
+        result = {}
+        for evty, (emits, calls, total, maximum) in self.stats.items():
+            average = total / calls if calls else 0.0
+            result[evty] = (emits / elapsed, emits, calls, average, maximum)
+        return result
+
+    def reset_stats(self):
+        self.stats = {}
+        self.stats_start = time.time()
+
+    def log_stats(self):
+        """
+            Logs the statistics returned by :meth:`get_stats`, busiest
+            event types first
+        """
+        stats = sorted(self.get_stats().items(), key=lambda i: -i[1][1])
+        for evty, (rate, emits, calls, average, maximum) in stats:
+            logger.info(
+                "Event %s: %d emits (%.1f/s), %d calls, "
+                "%.3f ms average, %.3f ms maximum",
+                evty,
+                emits,
+                rate,
+                calls,
+                average * 1000,
+                maximum * 1000,
+            )
+
     def emit_async(self, event):
         """
             Same as emit(), but does not block.
         """
         GLib.idle_add(self.emit, event)
 
-    def add_callback(self, function, evty, obj, args, kwargs, ui=False):
+    def add_callback(self, function, evty, obj, args, kwargs, ui=False, batch=False):
         """
             Registers a callback.
             You should always specify at least one of event type or object.
@@ -389,12 +558,16 @@ class EventManager(object):
                 to any. [string]
             @param obj: The object to listen to events from. Defaults
                 to any. [string]
+            @param ui: Whether to call the function on the UI thread [bool]
+            @param batch: Whether to pass events to the function in batches,
+                see add_batch_callback [bool]
 
             Returns a convenience function that you can call to
             remove the callback.
         """
 
-        if ui:
+        # batched callbacks collect events from any thread themselves
+        if ui and not batch:
             all_cbs = [self.ui_callbacks, self.all_callbacks]
         else:
             all_cbs = [self.callbacks, self.all_callbacks]
@@ -407,19 +580,19 @@ class EventManager(object):
             obj = _NONE
 
         with self.lock:
-            cb = Callback(function, time.time(), args, kwargs)
+            cb = Callback(
+                function, time.time(), args, kwargs, _Batch(self) if batch else None
+            )
+            if batch:
+                cb.batch.callback = cb
 
             # add the specified categories if needed.
             for cbs in all_cbs:
                 if evty not in cbs:
                     cbs[evty] = weakref.WeakKeyDictionary()
-                try:
-                    callbacks = cbs[evty][obj]
-                except KeyError:
-                    callbacks = cbs[evty][obj] = []
 
                 # add the actual callback
-                callbacks.append(cb)
+                cbs[evty][obj] = cbs[evty].get(obj, ()) + (cb,)
 
         if self.use_logger:
             if (
@@ -450,21 +623,23 @@ class EventManager(object):
 
         with self.lock:
             for cbs in [self.callbacks, self.all_callbacks, self.ui_callbacks]:
-                remove = []
                 try:
-                    callbacks = cbs[evty][obj]
-                    for cb in callbacks:
-                        if cb.wfunction() == function:
-                            remove.append(cb)
+                    callbacks = []
+                    for cb in cbs[evty][obj]:
+                        if cb.wfunction() != function:
+                            callbacks.append(cb)
+                        elif cb.batch is not None:
+                            # don't deliver events collected before
+                            cb.batch.remove()
+                    callbacks = tuple(callbacks)
                 except KeyError:
                     continue
                 except TypeError:
                     continue
 
-                for cb in remove:
-                    callbacks.remove(cb)
-
-                if len(callbacks) == 0:
+                if callbacks:
+                    cbs[evty][obj] = callbacks
+                else:
                     del cbs[evty][obj]
                     if len(cbs[evty]) == 0:
                         del cbs[evty]
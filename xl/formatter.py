@@ -36,7 +36,7 @@ from gi.repository import GObject
 import re
 from string import Template, _TemplateMetaclass
 
-from xl import common, providers, settings, trax
+from xl import common, event, providers, settings, trax
 from xl.common import TimeSpan
 from xl.nls import gettext as _, ngettext
 
@@ -150,6 +150,176 @@ class ParameterTemplate(Template):
         return self.pattern.sub(convert, self.template)
 
 
+class _TemplateField(object):
+    """
+        An identifier of a format string with its parsed parameters
+    """
+
+    __slots__ = [
+        'needle',
+        'identifier',
+        'parameters',
+        'arguments',
+        'prefix',
+        'suffix',
+        'pad',
+        'padstring',
+    ]
+
+    def __init__(self, needle, identifier, parameters):
+        self.needle = needle
+        self.identifier = identifier
+        self.parameters = parameters
+        # the parameters handled here are not passed on to substitutes
+        arguments = dict(parameters)
+        self.prefix = arguments.pop('prefix', '')
+        self.suffix = arguments.pop('suffix', '')
+        self.pad = int(arguments.pop('pad', 0))
+        self.padstring = arguments.pop('padstring', '')
+        self.arguments = arguments
+
+    def decorate(self, substitute):
+        """
+            Applies padding, prefix and suffix to a substitute
+        """
+        if self.pad > 0 and self.padstring:
+            # Decrease pad length by value length
+            pad = max(0, self.pad - len(substitute))
+            # Retrieve the maximum multiplier for the pad string
+            padcount = pad / len(self.padstring) + 1
+            # Generate and clamp pad string
+            padstring = (padcount * self.padstring)[0:pad]
+            substitute = '%s%s' % (padstring, substitute)
+
+        if substitute:
+            substitute = '%s%s%s' % (self.prefix, substitute, self.suffix)
+
+        return substitute
+
+
+class _TemplatePlan(object):
+    """
+        A format string parsed once, so that formatting only needs to
+        look up the substitutes and join the parts
+    """
+
+    __slots__ = ['parts', 'fields']
+
+    def __init__(self, template):
+        """
+            :param template: the template to parse
+            :type template: :class:`ParameterTemplate`
+        """
+        delimiter = template.delimiter
+        text = template.template
+        # literal strings, and (needle, text if not substituted) tuples
+        parts = []
+        fields = {}
+        literal = []
+        end = 0
+
+        for match in template.pattern.finditer(text):
+            literal.append(text[end : match.start()])
+            end = match.end()
+            groups = match.groupdict()
+            identifier = groups['braced'] or groups['named']
+
+            # Escaped and invalid delimiters are kept as they are
+            if identifier is None:
+                literal.append(delimiter)
+                continue
+
+            if groups['named'] is not None:
+                needle = identifier
+                fallback = delimiter + identifier
+            else:
+                needle = identifier
+                if groups['parameters'] is not None:
+                    needle = ':'.join((identifier, groups['parameters']))
+                fallback = delimiter + '{' + needle + '}'
+
+            # Required to make multiple occurences of the same
+            # identifier with different parameters work
+            if needle not in fields:
+                fields[needle] = _TemplateField(
+                    needle, identifier, self.parse_parameters(groups['parameters'])
+                )
+
+            parts.append(''.join(literal))
+            literal = []
+            parts.append((needle, fallback))
+
+        literal.append(text[end:])
+        parts.append(''.join(literal))
+        self.parts = [part for part in parts if part]
+        self.fields = fields.values()
+
+    @staticmethod
+    def parse_parameters(parameters):
+        """
+            Parses the parameters of a braced identifier into a dictionary
+        """
+        if parameters is None:
+            return {}
+
+        # Split parameters on unescaped comma
+        parameters = [p.lstrip() for p in re.split(r'(?<!\\),', parameters)]
+        # Split arguments on unescaped equals sign
+        parameters = [(re.split(r'(?<!\\)=', p, 1) + [True])[:2] for p in parameters]
+        # Turn list of lists into a proper dictionary
+        parameters = dict(parameters)
+
+        # Remove now obsolete escapes
+        for p in parameters:
+            argument = parameters[p]
+
+            if not isinstance(argument, bool):
+                argument = argument.replace(r'\,', ',')
+                argument = argument.replace(r'\}', '}')
+                argument = argument.replace(r'\=', '=')
+                parameters[p] = argument
+
+        return parameters
+
+    def render(self, substitutions):
+        """
+            Joins the parts, keeping identifiers without a substitution
+
+            :param substitutions: substitutes by needle
+            :type substitutions: dict
+        """
+        result = []
+        for part in self.parts:
+            if part.__class__ is tuple:
+                needle, fallback = part
+                if needle in substitutions:
+                    # We use this idiom instead of str() because the latter
+                    # will fail if val is a Unicode containing non-ASCII
+                    part = '%s' % (substitutions[needle],)
+                else:
+                    part = fallback
+            result.append(part)
+        return ''.join(result)
+
+
+# template pattern and string -> _TemplatePlan, shared by all formatters
+_PLANS = {}
+_MAX_PLANS = 256
+
+
+def _get_plan(template):
+    """
+        Returns the parsed plan of a template
+    """
+    key = (template.pattern, template.template)
+    plan = _PLANS.get(key)
+    if plan is None:
+        if len(_PLANS) >= _MAX_PLANS:
+            _PLANS.clear()
+        plan = _PLANS[key] = _TemplatePlan(template)
+    return plan
+
+
 class Formatter(GObject.GObject):
     """
         A generic text formatter based on a format string
@@ -223,51 +393,10 @@ class Formatter(GObject.GObject):
             :returns: the extractions
             :rtype: dict
         """
-        matches = self._template.pattern.finditer(self._template.template)
-        extractions = {}
-
-        # Extract list of identifiers and parameters from the format string
-        for match in matches:
-            groups = match.groupdict()
-
-            # We only care about braced and named, not escaped and invalid
-            identifier = groups['braced'] or groups['named']
-
-            if identifier is None:
-                continue
-
-            identifier_parts = [identifier]
-            parameters = {}
-
-            if groups['parameters'] is not None:
-                # Split parameters on unescaped comma
-                parameters = [
-                    p.lstrip() for p in re.split(r'(?<!\\),', groups['parameters'])
-                ]
-                # Split arguments on unescaped equals sign
-                parameters = [
-                    (re.split(r'(?<!\\)=', p, 1) + [True])[:2] for p in parameters
-                ]
-                # Turn list of lists into a proper dictionary
-                parameters = dict(parameters)
-
-                # Remove now obsolete escapes
-                for p in parameters:
-                    argument = parameters[p]
-
-                    if not isinstance(argument, bool):
-                        argument = argument.replace(r'\,', ',')
-                        argument = argument.replace(r'\}', '}')
-                        argument = argument.replace(r'\=', '=')
-                        parameters[p] = argument
-
-                identifier_parts += [groups['parameters']]
-
-            # Required to make multiple occurences of the same
-            # identifier with different parameters work
-            extractions[':'.join(identifier_parts)] = (identifier, parameters)
-
-        return extractions
+        return {
+            field.needle: (field.identifier, dict(field.parameters))
+            for field in _get_plan(self._template).fields
+        }
 
     def format(self, *args):
         """
@@ -277,43 +406,24 @@ class Formatter(GObject.GObject):
             :returns: the formatted text
             :rtype: string
         """
-        extractions = self.extract()
+        plan = _get_plan(self._template)
         substitutions = {}
 
-        for needle, (identifier, parameters) in extractions.iteritems():
+        for field in plan.fields:
             substitute = None
 
-            if needle in self._substitutions:
-                substitute = self._substitutions[needle]
-            elif identifier in self._substitutions:
-                substitute = self._substitutions[identifier]
+            if field.needle in self._substitutions:
+                substitute = self._substitutions[field.needle]
+            elif field.identifier in self._substitutions:
+                substitute = self._substitutions[field.identifier]
 
             if substitute is not None:
-                prefix = parameters.pop('prefix', '')
-                suffix = parameters.pop('suffix', '')
-                pad = int(parameters.pop('pad', 0))
-                padstring = parameters.pop('padstring', '')
-
                 if callable(substitute):
-                    substitute = substitute(*args, **parameters)
+                    substitute = substitute(*args, **field.arguments)
 
-                if pad > 0 and padstring:
-                    # Decrease pad length by value length
-                    pad = max(0, pad - len(substitute))
-                    # Retrieve the maximum multiplier for the pad string
-                    padcount = pad / len(padstring) + 1
-                    # Generate pad string
-                    padstring = padcount * padstring
-                    # Clamp pad string
-                    padstring = padstring[0:pad]
-                    substitute = '%s%s' % (padstring, substitute)
+                substitutions[field.needle] = field.decorate(substitute)
 
-                if substitute:
-                    substitute = '%s%s%s' % (prefix, substitute, suffix)
-
-                substitutions[needle] = substitute
-
-        return self._template.safe_substitute(substitutions)
+        return plan.render(substitutions)
 
 
 class ProgressTextFormatter(Formatter):
@@ -355,8 +465,7 @@ class ProgressTextFormatter(Formatter):
         playlist = self._player.queue.current_playlist
 
         if playlist and playlist.current_position >= 0:
-            tracks = playlist[playlist.current_position :]
-            total_remaining_time = sum(t.get_tag_raw('__length') or 0 for t in tracks)
+            total_remaining_time = playlist.get_duration(playlist.current_position)
             total_remaining_time -= current_time
 
         self._substitutions['current_time'] = LengthTagFormatter.format_value(
@@ -378,6 +487,54 @@ class TrackFormatter(Formatter):
         A formatter for track data
     """
 
+    def __init__(self, format):
+        """
+            :param format: the initial format, see the documentation
+                of :class:`string.Template` for details
+            :type format: string
+        """
+        Formatter.__init__(self, format)
+        # (plan, providers serial, [(field, provider)])
+        self.__fields = None
+
+    def __get_fields(self):
+        """
+            Returns the fields of the format together with their
+            tag-formatting providers, which are looked up again
+            when the format or the registered providers change
+        """
+        plan = _get_plan(self._template)
+        cached = self.__fields
+        if cached is None or cached[0] is not plan or cached[1] != _providers_serial:
+            fields = [
+                (field, providers.get_provider('tag-formatting', field.identifier))
+                for field in plan.fields
+            ]
+            cached = self.__fields = (plan, _providers_serial, fields)
+        return cached[0], cached[2]
+
+    def __format(self, track, markup_escape, plan, fields):
+        if not isinstance(track, trax.Track):
+            raise TypeError(
+                'First argument to format() needs ' 'to be of type xl.trax.Track'
+            )
+
+        substitutions = {}
+
+        for field, provider in fields:
+            if provider is None:
+                substitute = track.get_tag_display(field.identifier)
+            else:
+                substitute = provider.format(track, field.parameters)
+
+            if markup_escape:
+                substitute = GLib.markup_escape_text(substitute).decode('utf-8')
+
+            if substitute is not None:
+                substitutions[field.needle] = field.decorate(substitute)
+
+        return plan.render(substitutions)
+
     def format(self, track, markup_escape=False):
         """
             Returns a string for places where
@@ -391,28 +548,34 @@ class TrackFormatter(Formatter):
             :returns: the formatted text
             :rtype: string
         """
-        if not isinstance(track, trax.Track):
-            raise TypeError(
-                'First argument to format() needs ' 'to be of type xl.trax.Track'
-            )
+        plan, fields = self.__get_fields()
+        return self.__format(track, markup_escape, plan, fields)
 
-        extractions = self.extract()
-        self._substitutions = {}
+    def format_many(self, tracks, markup_escape=False):
+        """
+            Returns the strings for a number of tracks, see :meth:`format`
 
-        for identifier, (tag, parameters) in extractions.iteritems():
-            provider = providers.get_provider('tag-formatting', tag)
+            :param tracks: the tracks to take data from
+            :type tracks: iterable of :class:`xl.trax.Track`
+            :returns: the formatted texts in the order of the tracks
+            :rtype: list of strings
+        """
+        plan, fields = self.__get_fields()
+        format = self.__format
+        return [format(track, markup_escape, plan, fields) for track in tracks]
 
-            if provider is None:
-                substitute = track.get_tag_display(tag)
-            else:
-                substitute = provider.format(track, parameters)
 
-            if markup_escape:
-                substitute = GLib.markup_escape_text(substitute).decode('utf-8')
+# bumped when tag-formatting providers change, see TrackFormatter
+_providers_serial = 0
 
-            self._substitutions[identifier] = substitute
 
-        return Formatter.format(self)
+def _on_providers_changed(type, manager, data):
+    global _providers_serial
+    _providers_serial += 1
+
+
+event.add_callback(_on_providers_changed, 'tag-formatting_provider_added')
+event.add_callback(_on_providers_changed, 'tag-formatting_provider_removed')
 
 
 class TagFormatter(object):
@@ -397,6 +397,13 @@ def create_argument_parser():
         default=False,
         help=_("Enable full debugging of" " xl.event. Generates LOTS of output"),
     )
+    group.add_argument(
+        "--eventstats",
+        dest="EventStats",
+        action="store_true",
+        default=False,
+        help=_("Log how often each event was sent and how long its callbacks took"),
+    )
     group.add_argument(
         "--threaddebug",
         dest="DebugThreads",
@@ -417,6 +424,13 @@ def create_argument_parser():
         default=False,
         help=_("Reduce level of output"),
     )
+    group.add_argument(
+        "--startup-profile",
+        dest="StartupProfile",
+        action="store_true",
+        default=False,
+        help=_("Log the time spent in each phase of the startup"),
+    )
     group.add_argument(
         '--startgui', dest='StartGui', action='store_true', default=False
     )
@@ -551,6 +565,9 @@ class Exaile(object):
             if self.options.DebugEventFull:
                 event.EVENT_MANAGER.use_verbose_logger = True
 
+            if self.options.EventStats:
+                event.EVENT_MANAGER.collect_stats = True
+
             # initial mainloop setup. The actual loop is started later,
             # if necessary
             self.mainloop_init()
@@ -647,110 +664,151 @@ class Exaile(object):
 
         firstrun = settings.get_option("general/first_run", True)
 
-        # Migrate old rating options
-        from xl.migrations.settings import rating
+        from xl import event
 
-        rating.migrate()
+        # The collection and the saved playlists are loaded in threads,
+        # while plugins and the player are set up here. Everything else
+        # waits for what it needs, see StartupScheduler.
+        def migrate_settings():
+            # Migrate old rating options
+            from xl.migrations.settings import rating
 
-        # Migrate builtin OSD to plugin
-        from xl.migrations.settings import osd
+            rating.migrate()
 
-        osd.migrate()
+            # Migrate builtin OSD to plugin
+            from xl.migrations.settings import osd
 
-        # Migrate engines
-        from xl.migrations.settings import engine
+            osd.migrate()
 
-        engine.migrate()
+            # Migrate engines
+            from xl.migrations.settings import engine
 
-        # TODO: enable audio plugins separately from normal
-        #       plugins? What about plugins that use the player?
+            engine.migrate()
 
-        # Gstreamer doesn't initialize itself automatically, and fails
-        # miserably when you try to inherit from something and GST hasn't
-        # been initialized yet. So this is here.
-        from gi.repository import Gst
+        def init_gstreamer():
+            # TODO: enable audio plugins separately from normal
+            #       plugins? What about plugins that use the player?
 
-        Gst.init(None)
+            # Gstreamer doesn't initialize itself automatically, and fails
+            # miserably when you try to inherit from something and GST hasn't
+            # been initialized yet. So this is here.
+            from gi.repository import Gst
 
-        # Initialize plugin manager
-        from xl import plugins
+            Gst.init(None)
 
-        self.plugins = plugins.PluginsManager(self)
+        def load_plugins():
+            # Initialize plugin manager
+            from xl import plugins
 
-        if not self.options.SafeMode:
-            logger.info("Loading plugins...")
-            self.plugins.load_enabled()
-        else:
-            logger.info("Safe mode enabled, not loading plugins.")
+            self.plugins = plugins.PluginsManager(self)
 
-        # Initialize the collection
-        logger.info("Loading collection...")
-        from xl import collection
+            if not self.options.SafeMode:
+                logger.info("Loading plugins...")
+                self.plugins.load_enabled()
+            else:
+                logger.info("Safe mode enabled, not loading plugins.")
 
-        try:
-            self.collection = collection.Collection(
-                "Collection", location=os.path.join(xdg.get_data_dir(), 'music.db')
+        def load_collection():
+            # Initialize the collection
+            logger.info("Loading collection...")
+            from xl import collection
+
+            try:
+                self.collection = collection.Collection(
+                    "Collection", location=os.path.join(xdg.get_data_dir(), 'music.db')
+                )
+            except common.VersionError:
+                logger.exception("VersionError loading collection")
+                sys.exit(1)
+
+        def load_tag_writer():
+            # Write the tags that were still being written when Exaile
+            # quit. Tracks are looked up in the collection.
+            from xl.trax import tagwriter
+
+            tagwriter.WRITER.load_from_location(
+                os.path.join(xdg.get_data_dir(), 'tagwriter.queue')
             )
-        except common.VersionError:
-            logger.exception("VersionError loading collection")
-            sys.exit(1)
 
-        # Migrate covers.db. This can only be done after the collection is loaded.
-        import xl.migrations.database.covers_1to2 as mig
+        def migrate_covers():
+            # Migrate covers.db. This can only be done after the collection
+            # is loaded.
+            import xl.migrations.database.covers_1to2 as mig
 
-        mig.migrate()
+            mig.migrate()
 
-        from xl import event
+        def load_player():
+            # Set up the player and playback queue
+            from xl import player
 
-        # Set up the player and playback queue
-        from xl import player
+            event.log_event("player_loaded", player.PLAYER, None)
 
-        event.log_event("player_loaded", player.PLAYER, None)
+        def load_playlists():
+            # Initalize playlist manager
+            from xl import playlist
 
-        # Initalize playlist manager
-        from xl import playlist
+            self.playlists = playlist.PlaylistManager()
+            self.smart_playlists = playlist.SmartPlaylistManager(
+                'smart_playlists', collection=self.collection
+            )
+            if firstrun:
+                self._add_default_playlists()
+            event.log_event("playlists_loaded", self, None)
 
-        self.playlists = playlist.PlaylistManager()
-        self.smart_playlists = playlist.SmartPlaylistManager(
-            'smart_playlists', collection=self.collection
-        )
-        if firstrun:
-            self._add_default_playlists()
-        event.log_event("playlists_loaded", self, None)
+            # Initialize dynamic playlist support
+            from xl import dynamic
 
-        # Initialize dynamic playlist support
-        from xl import dynamic
+            dynamic.MANAGER.collection = self.collection
 
-        dynamic.MANAGER.collection = self.collection
+        def preload_saved_tabs():
+            # Read the playlists the interface restores as tabs
+            from xl import playlist
 
-        # Initalize device manager
-        logger.info("Loading devices...")
-        from xl import devices
+            playlist.PlaylistManager('saved_tabs').preload_playlists()
 
-        self.devices = devices.DeviceManager()
-        event.log_event("device_manager_ready", self, None)
+        def load_devices():
+            # Initalize device manager
+            logger.info("Loading devices...")
+            from xl import devices
+
+            self.devices = devices.DeviceManager()
+            event.log_event("device_manager_ready", self, None)
 
         # Initialize dynamic device discovery interface
         # -> if initialized and connected, then the object is not None
 
         self.udisks2 = None
 
-        if self.options.Hal:
+        def connect_system_bus():
+            # Connecting to the system bus may block. dbus keeps the
+            # connection, so connect_hal doesn't wait for it again.
+            import dbus
+
+            try:
+                dbus.SystemBus()
+            except Exception:
+                logger.debug("Could not connect to the system bus", exc_info=True)
+
+        def connect_hal():
+            # UDisks2 registers signal handlers and adds devices through
+            # providers, which is only done on the main thread
             from xl import hal
 
             udisks2 = hal.UDisks2(self.devices)
             if udisks2.connect():
                 self.udisks2 = udisks2
 
-        # Radio Manager
-        from xl import radio
+        def load_radio():
+            # Radio Manager
+            from xl import playlist, radio
 
-        self.stations = playlist.PlaylistManager('radio_stations')
-        self.radio = radio.RadioManager()
+            self.stations = playlist.PlaylistManager('radio_stations')
+            self.radio = radio.RadioManager()
 
         self.gui = None
-        # Setup GUI
-        if self.options.StartGui:
+
+        def load_gui():
+            # Setup GUI
             logger.info("Loading interface...")
 
             import xlgui
@@ -762,34 +820,79 @@ class Exaile(object):
             if splash is not None:
                 splash.destroy()
 
-        if firstrun:
-            settings.set_option("general/first_run", False)
+        def finish_loading():
+            if firstrun:
+                settings.set_option("general/first_run", False)
 
-        self.loading = False
-        Exaile._exaile = self
-        event.log_event("exaile_loaded", self, None)
+            self.loading = False
+            Exaile._exaile = self
+            event.log_event("exaile_loaded", self, None)
 
-        restore = True
+            restore = True
 
-        if self.gui:
-            # Find out if the user just passed in a list of songs
-            # TODO: find a better place to put this
+            if self.gui:
+                # Find out if the user just passed in a list of songs
+                # TODO: find a better place to put this
+
+                songs = [
+                    Gio.File.new_for_path(arg).get_uri() for arg in self.options.locs
+                ]
+                if len(songs) > 0:
+                    restore = False
+                    self.gui.open_uri(songs[0], play=True)
+                    for arg in songs[1:]:
+                        self.gui.open_uri(arg)
 
-            songs = [Gio.File.new_for_path(arg).get_uri() for arg in self.options.locs]
-            if len(songs) > 0:
-                restore = False
-                self.gui.open_uri(songs[0], play=True)
-                for arg in songs[1:]:
-                    self.gui.open_uri(arg)
+            if restore:
+                from xl import player
 
+                player.QUEUE._restore_player_state(
+                    os.path.join(xdg.get_data_dir(), 'player.state')
+                )
+
+        def rescan_collection():
             # kick off autoscan of libraries
             # -> don't do it in command line mode, since that isn't expected
             self.gui.rescan_collection_with_progress(True)
 
-        if restore:
-            player.QUEUE._restore_player_state(
-                os.path.join(xdg.get_data_dir(), 'player.state')
+        from xl.startup import StartupScheduler
+
+        scheduler = StartupScheduler()
+        scheduler.add('collection', load_collection, threaded=True)
+        scheduler.add('settings-migration', migrate_settings)
+        scheduler.add('gstreamer', init_gstreamer)
+        scheduler.add('plugins', load_plugins, ['settings-migration', 'gstreamer'])
+        scheduler.add('player', load_player, ['plugins'])
+        scheduler.add('covers-migration', migrate_covers, ['collection'])
+        scheduler.add('tag-writer', load_tag_writer, ['collection'])
+        scheduler.add('playlists', load_playlists, ['player', 'covers-migration'])
+        scheduler.add('devices', load_devices, ['playlists'])
+        scheduler.add('radio', load_radio, ['devices'])
+        loaded_deps = ['radio']
+        if self.options.Hal:
+            scheduler.add('system-bus', connect_system_bus, threaded=True)
+            scheduler.add('hal', connect_hal, ['devices', 'system-bus'])
+            loaded_deps.append('hal')
+        if self.options.StartGui:
+            scheduler.add(
+                'saved-tabs', preload_saved_tabs, ['covers-migration'], threaded=True
             )
+            scheduler.add('gui', load_gui, ['radio', 'saved-tabs'])
+            loaded_deps.append('gui')
+        scheduler.add('loaded', finish_loading, loaded_deps)
+        if self.options.StartGui:
+            scheduler.add('collection-scan', rescan_collection, deferred=True)
+
+        scheduler.run()
+
+        def report_startup():
+            if self.options.StartupProfile:
+                scheduler.log_timings()
+
+        if self.options.StartGui:
+            scheduler.run_deferred(GLib.idle_add, report_startup)
+        else:
+            scheduler.run_deferred(callback=report_startup)
 
         # pylint: enable-msg=W0201
 
@@ -937,6 +1040,9 @@ class Exaile(object):
         # below.
         event.log_event("quit_application", self, None)
 
+        if self.options.EventStats:
+            event.EVENT_MANAGER.log_stats()
+
         logger.info("Saving state...")
         self.plugins.save_enabled()
 
@@ -948,6 +1054,7 @@ class Exaile(object):
         covers.MANAGER.save()
 
         self.collection.save_to_location()
+        self.collection.save_snapshot()
 
         # Save order of custom playlists
         self.playlists.save_order()
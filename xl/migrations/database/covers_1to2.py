@@ -65,14 +65,14 @@ def migrate():
     """Migrate covers.db version 1 to 2 (Exaile 4.0)."""
 
     man = xl.covers.MANAGER
-    if man.db.get('version', 1) != 1:
+    if man.db.version != 1:
         return
     logger.info("Upgrading covers.db to version 2")
 
     valid_cachefiles = set()
 
     old_db = man.db
-    new_db = {'version': 2}
+    new_db = {}
     for coll in xl.collection.COLLECTIONS:
         for tr in coll.tracks.itervalues():
             key = old_get_track_key(tr._track)
@@ -82,7 +82,7 @@ def migrate():
                 new_db[new_key] = value
                 if value.startswith('cache:'):
                     valid_cachefiles.add(value[6:])
-    man.db = new_db
+    man.db.replace(new_db, 2)
     man.save()
 
     cachedir = os.path.join(man.location, 'cache')
@@ -31,13 +31,19 @@ in playlists as well as methods to import and export from various file formats.
 
 from gi.repository import Gio
 
+from bisect import bisect_left, insort
 import cgi
 from collections import deque, namedtuple
 from datetime import datetime, timedelta
+from itertools import islice
 import logging
+import multiprocessing
 import os
+import Queue
 import random
 import re
+import struct
+import threading
 import time
 import urlparse
 import urllib
@@ -178,10 +184,118 @@ def export_playlist(playlist, path, options=None):
         raise InvalidPlaylistTypeError(_('Invalid playlist type.'))
 
 
+# number of playlist entries resolved to tracks at once while importing
+IMPORT_BATCH = 512
+
+
+def _join_track_uri(playlist_uri, track_path):
+    """
+        Resolves a track path relative to the URI of its playlist
+    """
+    # Track path will not be changed if it already is a fully qualified URL
+    return urlparse.urljoin(playlist_uri, track_path.replace('\\', '/'))
+
+
+def _get_collection_tracks(locs):
+    """
+        Looks up locations in all collections at once
+
+        :returns: a list with the track of each location, or None if
+            the location is in no collection
+    """
+    from xl import collection
+
+    tracks = [None] * len(locs)
+    for coll in list(collection.COLLECTIONS):
+        missing = [i for i, track in enumerate(tracks) if track is None]
+        if not missing:
+            break
+        found = coll.get_tracks_by_locs([locs[i] for i in missing])
+        for i, track in zip(missing, found):
+            tracks[i] = track
+    return tracks
+
+
+def _set_missing_tags(track, tags):
+    """
+        Sets the tags stored in a playlist that a track does not have
+    """
+    missing = {
+        tag: value
+        for tag, value in tags.iteritems()
+        if value is not None and track.get_tag_raw(tag) is None
+    }
+    if missing:
+        try:
+            track.set_tags(**missing)
+        except Exception as e:
+            raise UnknownPlaylistTrackError("%s: %s" % (track.get_loc_for_io(), e))
+
+
+def _read_chunks(stream, size=65536):
+    """
+        Yields the content of a :class:`GioFileInputStream` in chunks
+    """
+    while True:
+        data = stream.read(size)
+        if not data:
+            return
+        yield data
+
+
+class _ImportScanner(object):
+    """
+        Reads the tags of imported tracks in a pool of background
+        threads, so the imported playlist can be used in the meantime.
+        Tags stored in the playlist are kept where the file has none.
+    """
+
+    def __init__(self):
+        workers = settings.get_option(
+            'collection/scan_threads', min(multiprocessing.cpu_count(), 8)
+        )
+        self.workers = max(1, workers)
+        self._jobs = Queue.Queue()
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name='PlaylistImportScanner-%d' % i
+            )
+            thread.daemon = True
+            thread.start()
+
+    def add(self, track, tags):
+        self._jobs.put((track, tags))
+
+    def close(self):
+        """
+            Lets the threads exit once all added tracks are read
+        """
+        for i in range(self.workers):
+            self._jobs.put(None)
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            track, tags = job
+            try:
+                track.read_tags()
+                _set_missing_tags(track, tags)
+            except Exception:
+                logger.exception("Error reading tags for %s", track.get_loc_for_io())
+
+
 class FormatConverter(object):
     """
         Base class for all converters allowing to
         import from and export to a specific format
+
+        Converters implement importing by :meth:`read_entries`, which
+        reads the file as a stream. The entries are resolved to tracks in
+        batches, looking them up in the collections first. Tracks that
+        are in no collection are created without reading their tags,
+        the tags are read in the background after the import.
     """
 
     title = _('Playlist')
@@ -213,7 +327,68 @@ class FormatConverter(object):
             :returns: the playlist
             :rtype: :class:`Playlist`
         """
-        pass
+        playlist = Playlist(name=self.name_from_path(path))
+        self.import_entries(path, playlist, self.read_entries(path, playlist))
+        return playlist
+
+    def read_entries(self, path, playlist):
+        """
+            Reads the entries of a playlist file, which may also set the
+            name of the playlist
+
+            :param path: the source path
+            :type path: string
+            :param playlist: the playlist being imported
+            :type playlist: :class:`Playlist`
+            :returns: an iterator of (track path, tags) tuples, where tags
+                is a dict of the tags the playlist stores for the track
+        """
+        raise NotImplementedError
+
+    def import_entries(self, path, playlist, entries):
+        """
+            Appends the tracks of playlist entries to a playlist
+
+            :param path: the source path
+            :type path: string
+            :param playlist: the playlist to append to
+            :type playlist: :class:`Playlist`
+            :param entries: an iterable of entries as returned by
+                :meth:`read_entries`
+        """
+        playlist_uri = Gio.File.new_for_uri(path).get_uri()
+        entries = iter(entries)
+        scanner = None
+
+        try:
+            while True:
+                batch = list(islice(entries, IMPORT_BATCH))
+                if not batch:
+                    break
+
+                locs = [_join_track_uri(playlist_uri, loc) for loc, tags in batch]
+                tracks = _get_collection_tracks(locs)
+
+                for i, (loc, tags) in enumerate(batch):
+                    track = tracks[i]
+                    if track is None:
+                        track = trax.Track(
+                            self.get_track_import_path(path, loc), scan=False
+                        )
+                        tracks[i] = track
+                        _set_missing_tags(track, tags)
+                        # read the tags later if the track is new
+                        if track.is_local() and track.get_tag_raw('__modified') is None:
+                            if scanner is None:
+                                scanner = _ImportScanner()
+                            scanner.add(track, tags)
+                    else:
+                        _set_missing_tags(track, tags)
+
+                playlist.extend(tracks)
+        finally:
+            if scanner is not None:
+                scanner.close()
 
     def name_from_path(self, path):
         """
@@ -244,8 +419,7 @@ class FormatConverter(object):
             :type track_path: string
         """
         playlist_uri = Gio.File.new_for_uri(playlist_path).get_uri()
-        # Track path will not be changed if it already is a fully qualified URL
-        track_uri = urlparse.urljoin(playlist_uri, track_path.replace('\\', '/'))
+        track_uri = _join_track_uri(playlist_uri, track_path)
 
         logging.debug('Importing track: %s' % track_uri)
 
@@ -380,25 +554,22 @@ class M3UConverter(FormatConverter):
                     )
                 )
 
-    def import_from_file(self, path):
+    def read_entries(self, path, playlist):
         """
-            Import a playlist from a given path
+            Reads the entries of a playlist file
 
             :param path: the source path
             :type path: string
-            :returns: the playlist
-            :rtype: :class:`Playlist`
+            :param playlist: the playlist being imported
+            :type playlist: :class:`Playlist`
+            :returns: an iterator of (track path, tags) tuples
         """
-        playlist = Playlist(name=self.name_from_path(path))
         extinf = {}
-        lineno = 0
 
         logger.debug('Importing M3U playlist: %s', path)
 
         with GioFileInputStream(Gio.File.new_for_uri(path)) as stream:
             for line in stream:
-                lineno += 1
-
                 line = line.strip()
 
                 if not line:
@@ -426,25 +597,9 @@ class M3UConverter(FormatConverter):
                 elif line.startswith('#'):
                     continue
                 else:
-                    track = trax.Track(self.get_track_import_path(path, line))
-
-                    if extinf:
-                        for tag, value in extinf.iteritems():
-                            if track.get_tag_raw(tag) is None:
-                                try:
-                                    track.set_tag_raw(tag, value)
-                                except Exception as e:
-                                    # Python 3: raise UnknownPlaylistTrackError() from e
-                                    # Python 2: .. no good solution
-                                    raise UnknownPlaylistTrackError(
-                                        "line %s: %s" % (lineno, e)
-                                    )
-
-                    playlist.append(track)
+                    yield line, extinf
                     extinf = {}
 
-        return playlist
-
 
 providers.register('playlist-format-converter', M3UConverter())
 
@@ -498,14 +653,15 @@ class PLSConverter(FormatConverter):
         with GioFileOutputStream(Gio.File.new_for_uri(path)) as stream:
             pls_playlist.write(stream)
 
-    def import_from_file(self, path):
+    def read_entries(self, path, playlist):
         """
-            Import a playlist from a given path
+            Reads the entries of a playlist file
 
             :param path: the source path
             :type path: string
-            :returns: the playlist
-            :rtype: :class:`Playlist`
+            :param playlist: the playlist being imported
+            :type playlist: :class:`Playlist`
+            :returns: an iterator of (track path, tags) tuples
         """
         from ConfigParser import (
             RawConfigParser,
@@ -523,8 +679,6 @@ class PLSConverter(FormatConverter):
                 pls_playlist.readfp(stream)
         except MissingSectionHeaderError:
             # Most likely version 1, thus only a list of URIs
-            playlist = Playlist(self.name_from_path(path))
-
             with GioFileInputStream(gfile) as stream:
                 for line in stream:
 
@@ -533,16 +687,10 @@ class PLSConverter(FormatConverter):
                     if not line:
                         continue
 
-                    track = trax.Track(self.get_track_import_path(path, line))
-
-                    if track.get_tag_raw('title') is None:
-                        track.set_tag_raw(
-                            'title', common.sanitize_url(self.name_from_path(line))
-                        )
-
-                    playlist.append(track)
+                    title = common.sanitize_url(self.name_from_path(line))
+                    yield line, {'title': title}
 
-            return playlist
+            return
 
         if not pls_playlist.has_section('playlist'):
             raise InvalidPlaylistTypeError(_('Invalid format for %s.') % self.title)
@@ -563,7 +711,7 @@ class PLSConverter(FormatConverter):
             raise InvalidPlaylistTypeError(_('Invalid format for %s.') % self.title)
 
         # PLS playlists store no name, thus retrieve from path
-        playlist = Playlist(common.sanitize_url(self.name_from_path(path)))
+        playlist.name = common.sanitize_url(self.name_from_path(path))
         numberofentries = pls_playlist.getint('playlist', 'numberofentries')
 
         for position in xrange(1, numberofentries + 1):
@@ -572,7 +720,6 @@ class PLSConverter(FormatConverter):
             except NoOptionError:
                 continue
 
-            track = trax.Track(self.get_track_import_path(path, uri))
             title = artist = None
             length = 0
 
@@ -593,18 +740,11 @@ class PLSConverter(FormatConverter):
             except NoOptionError:
                 pass
 
-            if track.get_tag_raw('title') is None and title:
-                track.set_tag_raw('title', title)
-
-            if track.get_tag_raw('artist') is None and artist:
-                track.set_tag_raw('artist', artist)
-
-            if track.get_tag_raw('__length') is None:
-                track.set_tag_raw('__length', max(0, length))
-
-            playlist.append(track)
-
-        return playlist
+            yield uri, {
+                'title': title or None,
+                'artist': artist or None,
+                '__length': max(0, length),
+            }
 
 
 providers.register('playlist-format-converter', PLSConverter())
@@ -664,48 +804,40 @@ class ASXConverter(FormatConverter):
 
             stream.write('</asx>')
 
-    def import_from_file(self, path):
+    def read_entries(self, path, playlist):
         """
-            Import a playlist from a given path
+            Reads the entries of a playlist file
 
             :param path: the source path
             :type path: string
-            :returns: the playlist
-            :rtype: :class:`Playlist`
+            :param playlist: the playlist being imported
+            :type playlist: :class:`Playlist`
+            :returns: an iterator of (track path, tags) tuples
         """
         from xml.etree.cElementTree import XMLParser
 
-        playlist = Playlist(self.name_from_path(path))
-
         logger.debug('Importing ASX playlist: %s', path)
 
-        with GioFileInputStream(Gio.File.new_for_uri(path)) as stream:
-            parser = XMLParser(target=self.ASXPlaylistParser())
-            parser.feed(stream.read())
+        target = self.ASXPlaylistParser()
+        parser = XMLParser(target=target)
 
+        with GioFileInputStream(Gio.File.new_for_uri(path)) as stream:
             try:
+                for data in _read_chunks(stream):
+                    parser.feed(data)
+                    for trackdata in target.pop_tracks():
+                        yield trackdata['uri'], trackdata['tags']
                 playlistdata = parser.close()
-            except Exception:
-                pass
-            else:
-                if playlistdata['name']:
-                    playlist.name = playlistdata['name']
-
-                for trackdata in playlistdata['tracks']:
-                    track = trax.Track(
-                        self.get_track_import_path(path, trackdata['uri'])
-                    )
-
-                    ntags = {}
-                    for tag, value in trackdata['tags'].iteritems():
-                        if not track.get_tag_raw(tag) and value:
-                            ntags[tag] = value
-                    if ntags:
-                        track.set_tags(**ntags)
+            except SyntaxError:
+                # keep the tracks read before the error
+                logger.warning('Invalid ASX playlist: %s', path)
+                return
 
-                    playlist.append(track)
+        for trackdata in playlistdata['tracks']:
+            yield trackdata['uri'], trackdata['tags']
 
-        return playlist
+        if playlistdata['name']:
+            playlist.name = playlistdata['name']
 
     class ASXPlaylistParser(object):
         """
@@ -776,6 +908,17 @@ class ASXConverter(FormatConverter):
                     self._trackuri = None
                     self._trackdata.clear()
 
+        def pop_tracks(self):
+            """
+                Returns the data of the tracks read since
+                the last call, and forgets them
+
+                :rtype: list
+            """
+            tracks = self._playlistdata['tracks']
+            self._playlistdata['tracks'] = []
+            return tracks
+
         def close(self):
             """
                 Returns the playlist data including
@@ -849,47 +992,288 @@ class XSPFConverter(FormatConverter):
             stream.write('  </trackList>\n')
             stream.write('</playlist>\n')
 
-    def import_from_file(self, path):
+    def read_entries(self, path, playlist):
         """
-            Import a playlist from a given path
+            Reads the entries of a playlist file
 
             :param path: the source path
             :type path: string
-            :returns: the playlist
-            :rtype: :class:`Playlist`
+            :param playlist: the playlist being imported
+            :type playlist: :class:`Playlist`
+            :returns: an iterator of (track path, tags) tuples
         """
         # TODO: support content resolution
         import xml.etree.cElementTree as ETree
 
-        playlist = Playlist(name=self.name_from_path(path))
-
         logger.debug('Importing XSPF playlist: %s', path)
 
+        ns = "{http://xspf.org/ns/0/}"
+        tracklist = None
+        depth = 0
+
         with GioFileInputStream(Gio.File.new_for_uri(path)) as stream:
-            tree = ETree.ElementTree(file=stream)
-            ns = "{http://xspf.org/ns/0/}"
-            nodes = tree.find("%strackList" % ns).findall("%strack" % ns)
-            titlenode = tree.find("%stitle" % ns)
+            # Parse incrementally and drop every track once it has been
+            # read, so that large playlists are not kept in memory
+            for evty, elem in ETree.iterparse(stream, ('start', 'end')):
+                if evty == 'start':
+                    depth += 1
+                    if depth == 2 and elem.tag == "%strackList" % ns:
+                        tracklist = elem
+                    continue
 
-            if titlenode is not None:
-                playlist.name = titlenode.text.strip()
+                depth -= 1
+                if depth == 1 and elem.tag == "%stitle" % ns:
+                    if elem.text:
+                        playlist.name = elem.text.strip()
+                elif depth == 2 and elem.tag == "%strack" % ns:
+                    location = elem.find("%slocation" % ns)
+                    if location is not None and location.text:
+                        tags = {}
+                        for element, tag in self.tags.iteritems():
+                            node = elem.find("%s%s" % (ns, element))
+                            if node is not None and node.text:
+                                tags[tag] = node.text.strip()
+                        yield location.text.strip(), tags
+                    if tracklist is not None:
+                        tracklist.clear()
 
-            for n in nodes:
-                location = n.find("%slocation" % ns).text.strip()
-                track = trax.Track(self.get_track_import_path(path, location))
-                for element, tag in self.tags.iteritems():
-                    try:
-                        track.set_tag_raw(
-                            tag, n.find("%s%s" % (ns, element)).text.strip()
-                        )
-                    except Exception:
-                        pass
-                playlist.append(track)
 
-        return playlist
+providers.register('playlist-format-converter', XSPFConverter())
 
 
-providers.register('playlist-format-converter', XSPFConverter())
+class _LazyShuffle(object):
+    """
+        Random order of a number of items, generated one item at a time
+        by running the Fisher-Yates shuffle on demand
+    """
+
+    __slots__ = ['items', 'index']
+
+    def __init__(self, items=()):
+        self.items = list(items)
+        # items before this index have been used up
+        self.index = 0
+
+    def add(self, items):
+        """
+            Adds items to the part of the order that is not used up
+        """
+        self.items.extend(items)
+
+    def next(self, used):
+        """
+            Returns a random item that is not used up yet. Returning an
+            item does not use it up, the next call returns a new random
+            item unless this one is used up by then.
+
+            :param used: a function that determines whether an item is
+                used up
+            :returns: the item, or None if all items are used up
+        """
+        items = self.items
+        while self.index < len(items):
+            i = self.index
+            j = random.randrange(i, len(items))
+            items[i], items[j] = items[j], items[i]
+            if not used(items[i]):
+                return items[i]
+            self.index += 1
+        return None
+
+
+class _DurationIndex(object):
+    """
+        Prefix sums of the lengths of a sequence of tracks in a Fenwick
+        tree, answering the total length of the first n tracks in
+        O(log n). Tracks can be appended and removed from the end.
+    """
+
+    __slots__ = ['lengths', 'unknown']
+
+    def __init__(self):
+        # 1-based trees of the summed lengths, and of the number of
+        # tracks whose length is not known
+        self.lengths = [0.0]
+        self.unknown = [0]
+
+    def __len__(self):
+        return len(self.lengths) - 1
+
+    def truncate(self, count):
+        """
+            Removes all but the first count tracks
+        """
+        del self.lengths[count + 1 :]
+        del self.unknown[count + 1 :]
+
+    def append(self, length):
+        """
+            Appends a track of the given length, None if not known
+        """
+        lengths, unknown = self.lengths, self.unknown
+        i = len(lengths)
+        if length is None:
+            length, missing = 0.0, 1
+        else:
+            missing = 0
+        # the node of position i covers the positions after
+        # i - lowbit(i), which are summed up by its child nodes
+        first = i - (i & -i)
+        j = i - 1
+        while j > first:
+            length += lengths[j]
+            missing += unknown[j]
+            j -= j & -j
+        lengths.append(length)
+        unknown.append(missing)
+
+    def prefix(self, count):
+        """
+            Returns the summed lengths of the first count tracks, and
+            the number of these tracks whose length is not known
+        """
+        lengths, unknown = self.lengths, self.unknown
+        total, missing = 0.0, 0
+        while count > 0:
+            total += lengths[count]
+            missing += unknown[count]
+            count -= count & -count
+        return total, missing
+
+
+# Saved playlist files
+#
+# A saved playlist is a sequence of records, each a kind byte and the
+# uint32 length of its payload (all integers little-endian)::
+#
+#     header (magic, version)
+#     'T' record: the tracks of the playlist
+#     'A' record: the attributes of the playlist
+#     journal: 'I' (insert), 'D' (delete) and 'A' records
+#
+# Edits are appended to the journal when the playlist is saved again,
+# the file is rewritten once the journal outgrows the rest of it.
+# Tracks are referenced by their location. Tags are only stored for
+# tracks that are not local, as these cannot be read again.
+PLAYLIST_MAGIC = 'EXPLAYLS'
+PLAYLIST_VERSION = 1
+
+# minimum size of the journal before a saved playlist is rewritten
+JOURNAL_COMPACT_SIZE = 65536
+# maximum number of unsaved edits kept for the journal
+JOURNAL_MAX_EDITS = 256
+
+_SAVED_TAGS = ('artist', 'album', 'tracknumber', 'title', 'genre', 'date')
+_PLAYLIST_HEADER = struct.Struct('<8sI')
+_RECORD = struct.Struct('<cI')
+_UINT = struct.Struct('<I')
+_UINT2 = struct.Struct('<II')
+
+
+def _pack_record(kind, payload):
+    return _RECORD.pack(kind, len(payload)) + payload
+
+
+def _pack_entries(tracks):
+    """
+        Packs tracks to a count, a table of string lengths and the
+        strings: the location and the tags of each track
+    """
+    lengths = []
+    strings = []
+    for track in tracks:
+        loc = track.get_loc_for_io()
+        if isinstance(loc, unicode):
+            loc = loc.encode('utf-8')
+        tags = []
+        if not track.is_local():
+            for tag in _SAVED_TAGS:
+                value = track.get_tag_raw(tag)
+                if value is not None:
+                    # FIXME: This should join multiple values.
+                    value = value[0]
+                    if isinstance(value, str):
+                        value = value.decode('utf-8', 'replace')
+                    tags.extend((tag, unicode(value)))
+        tags = u'\0'.join(tags).encode('utf-8')
+        lengths.extend((len(loc), len(tags)))
+        strings.extend((loc, tags))
+    return (
+        _UINT.pack(len(lengths) // 2)
+        + struct.pack('<%dI' % len(lengths), *lengths)
+        + ''.join(strings)
+    )
+
+
+def _unpack_entries(data, offset=0):
+    """
+        Unpacks (location, tags) entries packed by :func:`_pack_entries`
+    """
+    count = _UINT.unpack_from(data, offset)[0]
+    offset += _UINT.size
+    lengths = struct.unpack_from('<%dI' % (count * 2), data, offset)
+    offset += count * 2 * _UINT.size
+    entries = []
+    for i in xrange(0, count * 2, 2):
+        loc = data[offset : offset + lengths[i]]
+        offset += lengths[i]
+        tags = None
+        if lengths[i + 1]:
+            tags = data[offset : offset + lengths[i + 1]].decode('utf-8')
+            tags = tags.split(u'\0')
+            tags = dict(zip(tags[::2], tags[1::2]))
+            offset += lengths[i + 1]
+        entries.append((loc, tags))
+    return entries
+
+
+def _unpack_attributes(data, items):
+    for line in data.split('\n'):
+        try:
+            item, strn = line.split('=', 1)
+        except ValueError:
+            continue  # Skip erroneous lines
+        items[item] = settings.MANAGER._str_to_val(strn)
+
+
+def _read_saved_playlist(f, read_tracks=True):
+    """
+        Reads a saved playlist, after its magic
+
+        :returns: (entries, attributes, end, base): the entries are
+            (location, tags) tuples, end is the end of the last complete
+            record and base the end of the tracks record
+    """
+    version = _UINT.unpack(f.read(_UINT.size))[0]
+    if version > PLAYLIST_VERSION:
+        raise IOError("Cannot load playlist, unknown format")
+    size = os.fstat(f.fileno()).st_size
+    end = base = _PLAYLIST_HEADER.size
+    entries = []
+    items = {}
+    while end + _RECORD.size <= size:
+        kind, length = _RECORD.unpack(f.read(_RECORD.size))
+        if end + _RECORD.size + length > size:
+            break  # cut off while appending to the journal
+        if kind == 'A':
+            _unpack_attributes(f.read(length), items)
+        elif not read_tracks:
+            f.seek(length, 1)
+        elif kind == 'T':
+            entries = _unpack_entries(f.read(length))
+        elif kind == 'I':
+            data = f.read(length)
+            position = _UINT.unpack_from(data)[0]
+            entries[position:position] = _unpack_entries(data, _UINT.size)
+        elif kind == 'D':
+            start, stop = _UINT2.unpack(f.read(length))
+            del entries[start:stop]
+        else:
+            raise IOError("Cannot load playlist, unknown record %r" % kind)
+        end += _RECORD.size + length
+        if kind == 'T':
+            base = end
+    return entries, items, end, base
 
 
 class Playlist(object):
@@ -931,6 +1315,7 @@ class Playlist(object):
         'repeat_mode',
         'dynamic_mode',
         'current_position',
+        'shuffle_history_positions',
         'name',
     ]
     __playlist_format_version = [2, 0]
@@ -944,10 +1329,13 @@ class Playlist(object):
             :type initial_tracks: list of :class:`xl.trax.Track`
         """
         self.__tracks = MetadataList()
+        # track -> number of times it is contained
+        self.__track_counts = {}
         for track in initial_tracks:
             if not isinstance(track, trax.Track):
                 raise ValueError("Need trax.Track object, got %r" % type(track))
             self.__tracks.append(track)
+        self.__count_tracks(self.__tracks, 1)
         self.__shuffle_mode = self.shuffle_modes[0]
         self.__repeat_mode = self.repeat_modes[0]
         self.__dynamic_mode = self.dynamic_modes[0]
@@ -964,6 +1352,22 @@ class Playlist(object):
         self.__spat_position = -1
         self.__shuffle_history_counter = 1  # start positive so we can
         # just do an if directly on the value
+        # Random order of the positions for track shuffle, created when
+        # it is needed
+        self.__shuffle_order = None
+        # Album -> sorted (discnumber, tracknumber, position) of its
+        # tracks, and the random order of the albums for album shuffle
+        self.__album_groups = None
+        self.__album_order = None
+        # Edits since the playlist was saved, appended to the file on
+        # the next save, or None if the file has to be rewritten
+        self.__journal = None
+        # (location, size, base) of the file the journal belongs to
+        self.__journal_file = None
+        # Lengths of the tracks for get_duration, created when it is
+        # needed. Tracks from this position on are not in it yet.
+        self.__durations = None
+        self.__durations_valid = 0
         event.add_callback(self.on_playback_track_start, "playback_track_start")
 
     ### playlist-specific API ###
@@ -1042,7 +1446,8 @@ class Playlist(object):
         """
         self.__next_data = None
         oldposition = self.spat_position
-        self.__tracks.set_meta_key(position, "playlist_spat_position", True)
+        if position != -1:
+            self.__tracks.set_meta_key(position, "playlist_spat_position", True)
         self.__spat_position = position
         if oldposition != -1:
             try:
@@ -1068,6 +1473,61 @@ class Playlist(object):
 
     current = property(get_current)
 
+    def get_duration(self, start=0, end=None, allow_unknown=True):
+        """
+            Retrieves the summed length of the tracks from start up to,
+            but not including, end
+
+            :param start: the position of the first track
+            :type start: int
+            :param end: the position after the last track, the end of
+                the playlist if None
+            :type end: int
+            :param allow_unknown: whether tracks whose length is not
+                known count as 0, otherwise None is returned if there
+                are any of these
+            :type allow_unknown: bool
+            :returns: the length in seconds
+            :rtype: float or None
+        """
+        count = len(self.__tracks)
+        if end is None or end > count:
+            end = count
+        start = max(0, start)
+        if start >= end:
+            return 0.0
+
+        durations = self.__durations
+        if durations is None:
+            durations = self.__durations = _DurationIndex()
+            event.add_callback(self.__on_track_tags_changed, 'track_tags_changed')
+        if self.__durations_valid < count or len(durations) != count:
+            durations.truncate(self.__durations_valid)
+            for track in self.__tracks[len(durations) :]:
+                length = track.get_tag_raw('__length')
+                durations.append(None if length is None else float(length))
+            self.__durations_valid = count
+
+        total, unknown = durations.prefix(end)
+        if start > 0:
+            before, unknown_before = durations.prefix(start)
+            total -= before
+            unknown -= unknown_before
+        if unknown and not allow_unknown:
+            return None
+        return total
+
+    def __durations_changed(self, start):
+        """
+            Drops the lengths of the tracks from start on, they are
+            read again by the next call of get_duration
+        """
+        self.__durations_valid = min(self.__durations_valid, start)
+
+    def __on_track_tags_changed(self, type, track, tags):
+        if '__length' in tags and track in self.__track_counts:
+            self.__durations_changed(self.__tracks.index(track))
+
     def get_shuffle_history(self):
         """
             Retrieves the history of played
@@ -1092,6 +1552,97 @@ class Playlist(object):
                 self.__tracks.del_meta_key(i, "playlist_shuffle_history")
             except Exception:
                 pass
+        self.__shuffle_order = None
+        self.__album_order = None
+
+    def get_shuffle_history_positions(self):
+        """
+            Retrieves the positions of the tracks played
+            in a shuffle run, in the order they were played
+
+            :rtype: list of int
+        """
+        get_meta_key = self.__tracks.get_meta_key
+        history = [
+            (get_meta_key(i, 'playlist_shuffle_history'), i) for i in xrange(len(self))
+        ]
+        return [i for counter, i in sorted(history) if counter]
+
+    def set_shuffle_history_positions(self, positions):
+        """
+            Replaces the history of played tracks from
+            a shuffle run
+
+            :param positions: the positions of the played
+                tracks, in the order they were played
+            :type positions: list of int
+        """
+        self.clear_shuffle_history()
+        for position in positions:
+            if 0 <= position < len(self):
+                self.__tracks.set_meta_key(
+                    position, "playlist_shuffle_history", self.__shuffle_history_counter
+                )
+                self.__shuffle_history_counter += 1
+
+    #: The positions of the tracks played in a shuffle run (list of int)
+    shuffle_history_positions = property(
+        get_shuffle_history_positions, set_shuffle_history_positions
+    )
+
+    def __is_shuffle_history(self, position):
+        return self.__tracks.get_meta_key(position, "playlist_shuffle_history")
+
+    def __get_album_groups(self):
+        """
+            Returns the tracks of the playlist grouped by album
+        """
+        if self.__album_groups is None:
+            self.__album_groups = {}
+            self.__album_order = None
+            self.__add_album_tracks(0, self.__tracks)
+        if self.__album_order is None:
+            self.__album_order = _LazyShuffle(a for a in self.__album_groups if a)
+        return self.__album_groups
+
+    def __add_album_tracks(self, start, tracks):
+        """
+            Adds tracks at consecutive positions to the album groups
+        """
+        groups = self.__album_groups
+        new_albums = []
+        for position, track in enumerate(tracks, start):
+            album = tuple(track.get_tag_raw('album') or ())
+            group = groups.get(album)
+            if group is None:
+                group = groups[album] = []
+                new_albums.append(album)
+            entry = (
+                track.get_tag_sort('discnumber'),
+                track.get_tag_sort('tracknumber'),
+                position,
+            )
+            insort(group, entry)
+        if self.__album_order is not None:
+            self.__album_order.add(a for a in new_albums if a)
+
+    def __shuffle_tracks_changed(self, start, count, appended):
+        """
+            Keeps the shuffle orders current after a change
+
+            :param start: the position of the first added track
+            :param count: the number of added tracks
+            :param appended: whether tracks were only added at the end
+        """
+        if not appended:
+            self.__shuffle_order = None
+            self.__album_groups = None
+            self.__album_order = None
+            return
+        if self.__shuffle_order is not None:
+            self.__shuffle_order.add(xrange(start, start + count))
+        if self.__album_groups is not None:
+            self.__add_album_tracks(start, self.__tracks[start : start + count])
 
     @common.threaded
     def __fetch_dynamic_tracks(self):
@@ -1103,60 +1654,48 @@ class Playlist(object):
             on random_mode
         """
         if mode == "album":
-            # TODO: we really need proper album-level operations in
-            # xl.trax for this
-            try:
-                # Try and get the next track on the album
-                # NB If the user starts the playlist from the middle
-                # of the album some tracks of the album remain off the
-                # tracks_history, and the album can be selected again
-                # randomly from its first track
-                if current_position == -1:
-                    raise IndexError
-                curr = self[current_position]
-                t = [
-                    x
-                    for i, x in enumerate(self)
-                    if x.get_tag_raw('album') == curr.get_tag_raw('album')
-                    and i > current_position
-                ]
-                t = trax.sort_tracks(['discnumber', 'tracknumber'], t)
-                return self.__tracks.index(t[0]), t[0]
-
-            except IndexError:  # Pick a new album
-                hist = set(self.get_shuffle_history())
-                albums = set()
-                for i, x in enumerate(self):
-                    if (i, x) in hist:
+            groups = self.__get_album_groups()
+            # Try and get the next track on the album
+            # NB If the user starts the playlist from the middle
+            # of the album some tracks of the album remain off the
+            # tracks_history, and the album can be selected again
+            # randomly from its first track
+            if current_position != -1:
+                album = tuple(self[current_position].get_tag_raw('album') or ())
+                for entry in groups.get(album, ()):
+                    position = entry[2]
+                    if position <= current_position:
                         continue
-                    alb = x.get_tag_raw('album')
-                    if alb:
-                        albums.add(tuple(alb))
-                if not albums:
-                    return -1, None
-                album = list(random.choice(list(albums)))
-                t = [x for x in self if x.get_tag_raw('album') == album]
-                t = trax.sort_tracks(['tracknumber'], t)
-                return self.__tracks.index(t[0]), t[0]
+                    if tuple(self[position].get_tag_raw('album') or ()) != album:
+                        # tags have changed since the albums were grouped
+                        self.__album_groups = None
+                        return self.__next_random_track(current_position, mode)
+                    return position, self.__tracks[position]
+
+            # Pick a new album
+            def played(album):
+                return all(
+                    self.__is_shuffle_history(entry[2]) for entry in groups[album]
+                )
+
+            album = self.__album_order.next(played)
+            if album is None:
+                return -1, None
+            position = groups[album][0][2]
+            return position, self.__tracks[position]
         elif mode == 'random':
             try:
-                return random.choice(
-                    [(i, self.__tracks[i]) for i, tr in enumerate(self.__tracks)]
-                )
-            except IndexError:
+                position = random.randrange(len(self.__tracks))
+            except ValueError:
                 return -1, None
+            return position, self.__tracks[position]
         else:
-            hist = {i for i, tr in self.get_shuffle_history()}
-            try:
-                return random.choice(
-                    [
-                        (i, self.__tracks[i])
-                        for i, tr in enumerate(self.__tracks)
-                        if i not in hist
-                    ]
-                )
-            except IndexError:  # no more tracks
+            if self.__shuffle_order is None:
+                self.__shuffle_order = _LazyShuffle(xrange(len(self.__tracks)))
+            position = self.__shuffle_order.next(self.__is_shuffle_history)
+            if position is None:  # no more tracks
                 return -1, None
+            return position, self.__tracks[position]
 
     def __get_next(self, current_position):
 
@@ -1272,6 +1811,9 @@ class Playlist(object):
             if shuffle_hist:
                 self.current_position = prev_index
                 self.__tracks.del_meta_key(prev_index, 'playlist_shuffle_history')
+                # the track can be picked again
+                self.__shuffle_order = None
+                self.__album_order = None
         else:
             position = self.current_position - 1
             if position < 0:
@@ -1426,9 +1968,6 @@ class Playlist(object):
         l.metadata = [x[1] for x in data]
         self[:] = l
 
-    # TODO[0.4?]: drop our custom disk playlist format in favor of an
-    # extended XSPF playlist (using xml namespaces?).
-
     # TODO: add timeout saving support. 5-10 seconds after last change,
     # perhaps?
 
@@ -1436,72 +1975,129 @@ class Playlist(object):
         """
             Writes the content of the playlist to a given location
 
+            If the playlist was saved to or loaded from the location
+            before, only the changes since then are appended to the
+            file, until it is time to rewrite it.
+
             :param location: the location to save to
             :type location: string
         """
-        if os.path.exists(location):
-            f = open(location + ".new", "w")
-        else:
-            f = open(location, "w")
-        for track in self.__tracks:
-            buffer = track.get_loc_for_io()
-            # write track metadata
-            meta = {}
-            items = ('artist', 'album', 'tracknumber', 'title', 'genre', 'date')
-            for item in items:
-                value = track.get_tag_raw(item)
-                if value is not None:
-                    # FIXME: This should join multiple values.
-                    v = value[0]
-                    if isinstance(v, unicode):
-                        v = v.encode('utf-8')
-                    meta[item] = v
-            buffer += '\t%s\n' % urllib.urlencode(meta)
-            try:
-                f.write(buffer.encode('utf-8'))
-            except UnicodeDecodeError:
-                continue
-
-        f.write("EOF\n")
+        attributes = []
         for item in self.save_attrs:
             val = getattr(self, item)
             try:
                 strn = settings.MANAGER._val_to_str(val)
             except ValueError:
                 strn = ""
-
-            f.write("%s=%s\n" % (item, strn))
-        f.close()
-        if os.path.exists(location + ".new"):
-            os.remove(location)
-            os.rename(location + ".new", location)
+            attributes.append("%s=%s" % (item, strn))
+        attributes = _pack_record('A', '\n'.join(attributes))
+
+        if not self.__append_journal(location, attributes):
+            tracks = _pack_record('T', _pack_entries(self.__tracks))
+            header = _PLAYLIST_HEADER.pack(PLAYLIST_MAGIC, PLAYLIST_VERSION)
+            if os.path.exists(location):
+                f = open(location + ".new", "wb")
+            else:
+                f = open(location, "wb")
+            with f:
+                f.write(header)
+                f.write(tracks)
+                f.write(attributes)
+            if os.path.exists(location + ".new"):
+                os.remove(location)
+                os.rename(location + ".new", location)
+            base = len(header) + len(tracks)
+            self.__journal_file = (location, base + len(attributes), base)
+        self.__journal = []
         self.__needs_save = self.__dirty = False
 
-    def load_from_location(self, location):
+    def __append_journal(self, location, attributes):
         """
-            Loads the content of the playlist from a given location
+            Appends the edits since the last save to the journal of the
+            saved playlist
 
-            :param location: the location to load from
+            :returns: False if the file has to be rewritten instead
+        """
+        if self.__journal is None or self.__journal_file is None:
+            return False
+        path, size, base = self.__journal_file
+        # the file may have been replaced since
+        try:
+            if path != location or os.path.getsize(location) != size:
+                return False
+        except OSError:
+            return False
+
+        records = []
+        for edit in self.__journal:
+            if edit[0] == 'D':
+                records.append(_pack_record('D', _UINT2.pack(*edit[1:])))
+            else:
+                payload = _UINT.pack(edit[1]) + _pack_entries(edit[2])
+                records.append(_pack_record('I', payload))
+        records.append(attributes)
+        data = ''.join(records)
+        if size + len(data) - base > max(base, JOURNAL_COMPACT_SIZE):
+            return False
+
+        with open(location, "ab") as f:
+            f.write(data)
+        self.__journal_file = (location, size + len(data), base)
+        return True
+
+    @classmethod
+    def read_attributes(cls, location):
+        """
+            Reads the attributes saved in a playlist file, without
+            loading its tracks
+
+            :param location: the location to read from
             :type location: string
+            :returns: a dict of the saved attributes, or None if the
+                file cannot be opened
+        """
+        data = cls.__read_file(location, False)
+        if data is None:
+            return None
+        return data[1]
+
+    @classmethod
+    def __read_file(cls, location, read_tracks=True):
+        """
+            Returns the (location, tags) entries, the attributes and
+            the (size, base) of the journal of a playlist file. Files
+            in the text format of older versions have no journal.
         """
-        # note - this is not guaranteed to fire events when it sets
-        # attributes. It is intended ONLY for initial setup, not for
-        # reloading a playlist inline.
         f = None
         for loc in [location, location + ".new"]:
             try:
-                f = open(loc, 'r')
+                f = open(loc, 'rb')
                 break
             except Exception:
                 pass
         if not f:
-            return
-        locs = []
+            return None
+        with f:
+            if f.read(len(PLAYLIST_MAGIC)) == PLAYLIST_MAGIC:
+                entries, items, size, base = _read_saved_playlist(f, read_tracks)
+                return entries, items, (size, base)
+            f.seek(0)
+            entries, items = cls.__read_text_file(f, read_tracks)
+            return entries, items, None
+
+    @classmethod
+    def __read_text_file(cls, f, read_tracks):
+        entries = []
         while True:
             line = f.readline()
             if line == "EOF\n" or line == "":
                 break
-            locs.append(line.strip())
+            if read_tracks:
+                loc, sep, meta = line.strip().rpartition('\t')
+                if sep:
+                    entries.append((loc, meta))
+                else:
+                    entries.append((meta, None))
         items = {}
         while True:
             line = f.readline()
@@ -1520,37 +2116,49 @@ class Playlist(object):
         if ver[0] == 1:
             if items.get("repeat_mode") == "playlist":
                 items['repeat_mode'] = "all"
-        elif ver[0] > self.__playlist_format_version[0]:
+        elif ver[0] > cls.__playlist_format_version[0]:
             raise IOError("Cannot load playlist, unknown format")
-        elif ver > self.__playlist_format_version:
+        elif ver > cls.__playlist_format_version:
             logger.warning(
                 "Playlist created on a newer Exaile version, some attributes may not be handled."
             )
-        f.close()
+        return entries, items
 
-        trs = []
+    def load_from_location(self, location):
+        """
+            Loads the content of the playlist from a given location
 
-        for loc in locs:
-            meta = None
-            if loc.find('\t') > -1:
-                splitted = loc.split('\t')
-                loc = "\t".join(splitted[:-1])
-                meta = splitted[-1]
+            :param location: the location to load from
+            :type location: string
+        """
+        # note - this is not guaranteed to fire events when it sets
+        # attributes. It is intended ONLY for initial setup, not for
+        # reloading a playlist inline.
+        data = self.__read_file(location)
+        if data is None:
+            return
+        entries, items, journal = data
 
-            track = None
-            track = trax.Track(uri=loc)
+        trs = _get_collection_tracks([loc for loc, meta in entries])
+        for i, (loc, meta) in enumerate(entries):
+            track = trs[i]
+            if track is None:
+                track = trs[i] = trax.Track(uri=loc)
 
             # readd meta
-            if not track:
-                continue
             if not track.is_local() and meta is not None:
-                meta = cgi.parse_qs(meta)
+                if isinstance(meta, basestring):
+                    meta = cgi.parse_qs(meta)
+                    meta = {k: v[0].decode('utf-8') for k, v in meta.iteritems()}
                 for k, v in meta.iteritems():
-                    track.set_tag_raw(k, v[0].decode('utf-8'), notify_changed=False)
-
-            trs.append(track)
+                    track.set_tag_raw(k, v, notify_changed=False)
 
         self.__tracks[:] = trs
+        self.__track_counts = {}
+        self.__count_tracks(trs, 1)
+        self.__shuffle_tracks_changed(0, 0, False)
+        self.__durations_changed(0)
+        self.on_tracks_changed()
 
         for item, val in items.iteritems():
             if item in self.save_attrs:
@@ -1563,6 +2171,12 @@ class Playlist(object):
                         val,
                     )
 
+        if journal is None:
+            self.__journal = self.__journal_file = None
+        else:
+            self.__journal = []
+            self.__journal_file = (location,) + journal
+
     def reverse(self):
         # reverses current view
         pass
@@ -1575,7 +2189,7 @@ class Playlist(object):
         return len(self.__tracks)
 
     def __contains__(self, track):
-        return track in self.__tracks
+        return track in self.__track_counts
 
     def __tuple_from_slice(self, i):
         """
@@ -1586,6 +2200,16 @@ class Playlist(object):
             step = 1
         return (start, end, step)
 
+    def __normalize_index(self, i):
+        """
+            Turns a possibly negative index into a position
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("Playlist index out of range")
+        return i
+
     def __adjust_current_pos(self, oldpos, removed, added):
         newpos = oldpos
         for i, tr in removed:
@@ -1596,46 +2220,113 @@ class Playlist(object):
                 newpos += 1
         self.current_position = newpos
 
+    def __log_edit(self, *edit):
+        """
+            Records an edit for the journal of the saved playlist
+        """
+        if self.__journal is None:
+            return
+        if len(self.__journal) >= JOURNAL_MAX_EDITS:
+            self.__journal = None
+        else:
+            self.__journal.append(edit)
+
+    def __count_tracks(self, tracks, delta):
+        """
+            Updates the number of times each track is contained
+        """
+        counts = self.__track_counts
+        for track in tracks:
+            count = counts.get(track, 0) + delta
+            if count > 0:
+                counts[track] = count
+            else:
+                del counts[track]
+
+    def __update_positions(self, move, added, metadata):
+        """
+            Updates the current and SPAT positions after a change,
+            without having to search the whole playlist for them
+
+            :param move: a function mapping the position of an entry
+                before the change to its position afterwards, or to -1
+                if the entry was removed
+            :param added: the positions of the added entries
+            :param metadata: the metadata of the added entries
+        """
+        positions = {
+            "playlist_current_position": move(self.__current_position),
+            "playlist_spat_position": move(self.__spat_position),
+        }
+        # Added entries may carry a position along, e.g. when sorting
+        for position, meta in zip(added, metadata):
+            if not meta:
+                continue
+            for key, oldposition in positions.iteritems():
+                if meta.get(key) and (oldposition == -1 or position < oldposition):
+                    positions[key] = position
+        self.__current_position = positions["playlist_current_position"]
+        self.__spat_position = positions["playlist_spat_position"]
+
     def __getitem__(self, i):
         return self.__tracks.__getitem__(i)
 
     def __setitem__(self, i, value):
-        oldtracks = self.__getitem__(i)
-        removed = MetadataList()
-        added = MetadataList()
-        oldpos = self.current_position
+        if not isinstance(i, slice):
+            if not isinstance(value, trax.Track):
+                raise ValueError("Need trax.Track object, got %r" % type(value))
+            i = self.__normalize_index(i)
+            i = slice(i, i + 1)
+            value = [value]
 
-        if isinstance(i, slice):
-            for x in value:
-                if not isinstance(x, trax.Track):
-                    raise ValueError("Need trax.Track object, got %r" % type(x))
+        for x in value:
+            if not isinstance(x, trax.Track):
+                raise ValueError("Need trax.Track object, got %r" % type(x))
 
-            (start, end, step) = self.__tuple_from_slice(i)
+        oldtracks = self.__getitem__(i)
+        oldpos = self.current_position
+        (start, end, step) = self.__tuple_from_slice(i)
 
-            if isinstance(value, MetadataList):
-                metadata = value.metadata
-            else:
-                metadata = [None] * len(value)
-
-            if step != 1:
-                if len(value) != len(oldtracks):
-                    raise ValueError("Extended slice assignment must match sizes.")
-            self.__tracks.__setitem__(i, value)
-            removed = MetadataList(
-                zip(range(start, end, step), oldtracks), oldtracks.metadata
+        if isinstance(value, MetadataList):
+            metadata = value.metadata
+        else:
+            metadata = [None] * len(value)
+
+        if step != 1:
+            if len(value) != len(oldtracks):
+                raise ValueError("Extended slice assignment must match sizes.")
+        self.__tracks.__setitem__(i, value)
+        removed = MetadataList(
+            zip(range(start, end, step), oldtracks), oldtracks.metadata
+        )
+        if step == 1:
+            end = start + len(removed)
+            size = len(value) - len(removed)
+            move = lambda pos: (
+                pos if pos < start else -1 if pos < end else pos + size
             )
-            if step == 1:
-                end = start + len(value)
-
-            added = MetadataList(zip(range(start, end, step), value), metadata)
+            positions = range(start, start + len(value))
+            if removed:
+                self.__log_edit('D', start, end)
+            if value:
+                self.__log_edit('I', start, list(value))
         else:
-            if not isinstance(value, trax.Track):
-                raise ValueError("Need trax.Track object, got %r" % type(value))
-            self.__tracks[i] = value
-            removed = [(i, oldtracks)]
-            added = [(i, value)]
-
-        self.on_tracks_changed()
+            replaced = set(range(start, end, step))
+            move = lambda pos: -1 if pos in replaced else pos
+            positions = range(start, end, step)
+            for position, track in zip(positions, value):
+                self.__log_edit('D', position, position + 1)
+                self.__log_edit('I', position, [track])
+
+        added = MetadataList(zip(positions, value), metadata)
+
+        self.__count_tracks(oldtracks, -1)
+        self.__count_tracks(value, 1)
+        self.__update_positions(move, positions, metadata)
+        self.__durations_changed(min(positions) if positions else start)
+        self.__shuffle_tracks_changed(
+            start, len(value), not removed and start == len(self) - len(value)
+        )
 
         if removed:
             event.log_event('playlist_tracks_removed', self, removed)
@@ -1648,19 +2339,64 @@ class Playlist(object):
     def __delitem__(self, i):
         if isinstance(i, slice):
             (start, end, step) = self.__tuple_from_slice(i)
-        oldtracks = self.__getitem__(i)
+            positions = range(start, end, step)
+            if step < 0:
+                positions.reverse()
+        else:
+            positions = [self.__normalize_index(i)]
+        self.__remove_positions(positions)
+
+    def remove_positions(self, positions):
+        """
+            Removes the tracks at a number of positions, emitting
+            a single playlist_tracks_removed event
+
+            :param positions: the positions of the tracks to remove
+            :type positions: iterable of int
+        """
+        self.__remove_positions(positions)
+
+    def __remove_positions(self, positions):
+        positions = sorted(set(positions))
+        if not positions:
+            return
+        if positions[0] < 0 or positions[-1] >= len(self):
+            raise IndexError("Playlist index out of range")
+
         oldpos = self.current_position
-        self.__tracks.__delitem__(i)
-        removed = MetadataList()
+        tracks = self.__tracks
+        removed = MetadataList(
+            [(pos, tracks[pos]) for pos in positions],
+            [tracks.metadata[pos] for pos in positions],
+        )
 
-        if isinstance(i, slice):
-            removed = MetadataList(
-                zip(xrange(start, end, step), oldtracks), oldtracks.metadata
-            )
+        start, end = positions[0], positions[-1] + 1
+        if len(positions) == end - start:
+            del tracks[start:end]
+            self.__log_edit('D', start, end)
         else:
-            removed = [(i, oldtracks)]
+            stop = None
+            for index in reversed(xrange(len(positions))):
+                pos = positions[index]
+                del tracks[pos]
+                # journal runs of adjacent positions as one deletion
+                if stop is None:
+                    stop = pos + 1
+                if index == 0 or positions[index - 1] != pos - 1:
+                    self.__log_edit('D', pos, stop)
+                    stop = None
+
+        def move(pos):
+            index = bisect_left(positions, pos)
+            if index < len(positions) and positions[index] == pos:
+                return -1
+            return pos - index
+
+        self.__count_tracks((track for pos, track in removed), -1)
+        self.__update_positions(move, [], [])
+        self.__durations_changed(start)
+        self.__shuffle_tracks_changed(0, 0, False)
 
-        self.on_tracks_changed()
         event.log_event('playlist_tracks_removed', self, removed)
         self.__adjust_current_pos(oldpos, removed, [])
         self.__needs_save = self.__dirty = True
@@ -1691,7 +2427,7 @@ class Playlist(object):
             :returns: the count
             :rtype: int
         """
-        return self.__tracks.count(other)
+        return self.__track_counts.get(other, 0)
 
     def index(self, item, start=0, end=None):
         """
@@ -1700,6 +2436,8 @@ class Playlist(object):
             :returns: the index
             :rtype: int
         """
+        if item not in self.__track_counts:
+            raise ValueError("%r is not in playlist" % item)
         if end is None:
             return self.__tracks.index(item, start)
         else:
@@ -1725,6 +2463,11 @@ class Playlist(object):
                 self.__fetch_dynamic_tracks()
 
     def on_tracks_changed(self, *args):
+        """
+            Finds the current and SPAT positions by searching the
+            whole playlist. Changes made through the list API keep
+            them up to date without this.
+        """
         for idx in xrange(len(self.__tracks)):
             if self.__tracks.get_meta_key(idx, "playlist_current_position"):
                 self.__current_position = idx
@@ -2082,6 +2825,10 @@ class PlaylistManager(object):
         Manages saving and loading of playlists
     """
 
+    # (playlist class, path) -> playlist loaded by preload_playlists
+    __preloaded = {}
+    __preloaded_lock = threading.Lock()
+
     def __init__(self, playlist_dir=u'playlists', playlist_class=Playlist):
         """
             Initializes the playlist manager
@@ -2100,6 +2847,20 @@ class PlaylistManager(object):
     def _create_playlist(self, name):
         return self.playlist_class(name=name)
 
+    def _read_playlist_name(self, path, name):
+        """
+            Returns the name of a saved playlist, reading only its
+            attributes when the playlist class allows it
+        """
+        if issubclass(self.playlist_class, Playlist):
+            attrs = self.playlist_class.read_attributes(path)
+            if attrs is None:
+                return name
+            return attrs.get('name', name)
+        pl = self._create_playlist(name)
+        pl.load_from_location(path)
+        return pl.name
+
     def has_playlist_name(self, playlist_name):
         """
             Returns true if the manager has a playlist with the same name
@@ -2163,14 +2924,13 @@ class PlaylistManager(object):
             # check against hidden files since some editors put
             # temporary stuff in the same dir.
             if f != os.path.basename(self.order_file) and not f.startswith("."):
-                pl = self._create_playlist(f)
                 path = os.path.join(self.playlist_dir, f)
                 try:
-                    pl.load_from_location(path)
+                    name = self._read_playlist_name(path, f)
                 except Exception:
                     logger.exception("Failed loading playlist: %r", path)
                 else:
-                    existing.append(pl.name)
+                    existing.append(name)
 
         # if order_file exists then use it
         if os.path.isfile(self.order_file):
@@ -2186,14 +2946,36 @@ class PlaylistManager(object):
             @param name: the name of the playlist you wish to retrieve
         """
         if name in self.playlists:
-            pl = self._create_playlist(name)
-            pl.load_from_location(
-                os.path.join(self.playlist_dir, encode_filename(name))
-            )
+            path = os.path.join(self.playlist_dir, encode_filename(name))
+            with self.__preloaded_lock:
+                pl = self.__preloaded.pop((self.playlist_class, path), None)
+            if pl is None:
+                pl = self._create_playlist(name)
+                pl.load_from_location(path)
             return pl
         else:
             raise ValueError("No such playlist '%s'" % name)
 
+    def preload_playlists(self):
+        """
+            Loads all playlists of this manager ahead of time. The next
+            :meth:`get_playlist` call for each of them, from any manager
+            of the same directory, returns the loaded playlist instead of
+            reading it again.
+
+            Intended to load playlists in a background thread at startup.
+        """
+        for name in self.list_playlists():
+            path = os.path.join(self.playlist_dir, encode_filename(name))
+            pl = self._create_playlist(name)
+            try:
+                pl.load_from_location(path)
+            except Exception:
+                logger.exception("Failed preloading playlist: %r", path)
+                continue
+            with self.__preloaded_lock:
+                self.__preloaded[(self.playlist_class, path)] = pl
+
     def list_playlists(self):
         """
             Returns all the contained playlist names
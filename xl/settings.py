@@ -28,15 +28,19 @@
     Central storage of application and user settings
 """
 
+from ast import literal_eval
 from ConfigParser import RawConfigParser, NoSectionError, NoOptionError
 import logging
 import os
 import sys
+import time
+
+from gi.repository import GLib
 
 logger = logging.getLogger(__name__)
 
 from xl import event, xdg
-from xl.common import VersionError, glib_wait, glib_wait_seconds
+from xl.common import VersionError, glib_wait_seconds
 from xl.nls import gettext as _
 
 TYPE_MAPPING = {
@@ -51,6 +55,21 @@ TYPE_MAPPING = {
 
 MANAGER = None
 
+# cached for options that are not set
+_MISSING = object()
+
+
+def _copy_value(value):
+    """
+        Copies the lists and dictionaries of a value, so that changing
+        the value returned by get_option does not change the cache
+    """
+    if isinstance(value, list):
+        return [_copy_value(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _copy_value(v) for k, v in value.iteritems()}
+    return value
+
 
 class SettingsManager(RawConfigParser):
     """
@@ -60,6 +79,12 @@ class SettingsManager(RawConfigParser):
     settings = None
     __version__ = 1
 
+    #: time (in ms) without changes after which changes are saved
+    SAVE_DELAY = 500
+    #: time (in ms) after which changes are saved even if there are
+    #: further changes
+    SAVE_MAX_DELAY = 10000
+
     def __init__(self, location=None, default_location=None):
         """
             Sets up the settings manager. Expects a location
@@ -77,6 +102,12 @@ class SettingsManager(RawConfigParser):
         self.location = location
         self._saving = False
         self._dirty = False
+        # option -> parsed value, or _MISSING
+        self._cache = {}
+        self._save_id = None
+        # times at which the pending save is due at the earliest, and
+        # at the latest
+        self._save_due = self._save_deadline = 0
 
         if default_location is not None:
             try:
@@ -143,15 +174,22 @@ class SettingsManager(RawConfigParser):
         section, key = "/".join(splitvals[:-1]), splitvals[-1]
 
         try:
-            self.set(section, key, value)
-        except NoSectionError:
-            self.add_section(section)
-            self.set(section, key, value)
+            changed = self.get(section, key) != value
+        except (NoSectionError, NoOptionError):
+            changed = True
 
-        self._dirty = True
+        if changed:
+            try:
+                self.set(section, key, value)
+            except NoSectionError:
+                self.add_section(section)
+                self.set(section, key, value)
+
+            self._cache.pop(option, None)
+            self._dirty = True
 
-        if save:
-            self.delayed_save()
+            if save:
+                self.delayed_save()
 
         section = section.replace('/', '_')
 
@@ -170,17 +208,22 @@ class SettingsManager(RawConfigParser):
             :returns: the option value or *default*
             :rtype: any
         """
-        splitvals = option.split('/')
-        section, key = "/".join(splitvals[:-1]), splitvals[-1]
-
         try:
-            value = self.get(section, key)
-            value = self._str_to_val(value)
-        except NoSectionError:
-            value = default
-        except NoOptionError:
-            value = default
+            value = self._cache[option]
+        except KeyError:
+            splitvals = option.split('/')
+            section, key = "/".join(splitvals[:-1]), splitvals[-1]
 
+            try:
+                value = self._str_to_val(self.get(section, key))
+            except (NoSectionError, NoOptionError):
+                value = _MISSING
+            self._cache[option] = value
+
+        if value is _MISSING:
+            return default
+        if isinstance(value, (list, dict)):
+            return _copy_value(value)
         return value
 
     def has_option(self, option):
@@ -209,6 +252,7 @@ class SettingsManager(RawConfigParser):
         splitvals = option.split('/')
         section, key = "/".join(splitvals[:-1]), splitvals[-1]
 
+        self._cache.pop(option, None)
         RawConfigParser.remove_option(self, section, key)
 
     def _set_direct(self, option, value):
@@ -230,6 +274,7 @@ class SettingsManager(RawConfigParser):
             self.add_section(section)
             self.set(section, key, value)
 
+        self._cache.pop(option, None)
         event.log_event('option_set', self, option)
 
     def _val_to_str(self, value):
@@ -265,7 +310,11 @@ class SettingsManager(RawConfigParser):
 
         # Lists and dictionaries are special case
         if kind in ('L', 'D'):
-            return eval(value)
+            try:
+                return literal_eval(value)
+            except Exception:
+                logger.exception("Failed decoding value %r of kind %r", value, kind)
+                return TYPE_MAPPING[kind]()
 
         if kind in TYPE_MAPPING.keys():
             if kind == 'B':
@@ -284,10 +333,33 @@ class SettingsManager(RawConfigParser):
         else:
             raise ValueError(_("An Unknown type of setting was found!"))
 
-    @glib_wait(500)
     def delayed_save(self):
-        '''Save options after a delay, waiting for multiple saves to accumulate'''
-        self.save()
+        """
+            Saves the settings once they have not been changed for
+            SAVE_DELAY, or SAVE_MAX_DELAY after the first change at the
+            latest, so that many changes in a row are saved at once
+        """
+        if self.location is None:
+            return
+        now = time.time()
+        self._save_due = now + self.SAVE_DELAY / 1000.0
+        if self._save_id is None:
+            self._save_deadline = now + self.SAVE_MAX_DELAY / 1000.0
+            self._save_id = GLib.timeout_add(self.SAVE_DELAY, self.__delayed_save)
+
+    def __delayed_save(self):
+        # Rather than replacing the timeout on every change, it is
+        # moved on when it runs before the changes have settled
+        now = time.time()
+        due = min(self._save_due, self._save_deadline)
+        if due > now:
+            self._save_id = GLib.timeout_add(
+                int((due - now) * 1000) + 1, self.__delayed_save
+            )
+        else:
+            self._save_id = None
+            self.save()
+        return False
 
     def save(self):
         """
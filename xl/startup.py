@@ -0,0 +1,229 @@
+# Copyright (C) 2008-2010 Adam Olsen
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+    Dependency ordered scheduling of the startup phases
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['StartupScheduler']
+
+
+class _Phase(object):
+    __slots__ = ['name', 'func', 'depends', 'threaded', 'deferred', 'done', 'error']
+
+    def __init__(self, name, func, depends, threaded, deferred):
+        self.name = name
+        self.func = func
+        self.depends = depends
+        self.threaded = threaded
+        self.deferred = deferred
+        self.done = False
+        self.error = None
+
+
+class StartupScheduler(object):
+    """
+        Runs startup phases in the order of their declared dependencies.
+
+        Phases run on the thread calling :meth:`run`, in the order they
+        were added, as soon as their dependencies are done. Threaded
+        phases start in their own thread instead, so they run
+        concurrently with every phase that doesn't depend on them.
+        Deferred phases are left out of :meth:`run` and are run by
+        :meth:`run_deferred`.
+
+        The time spent in each phase is recorded in :attr:`timings`.
+    """
+
+    def __init__(self):
+        self.__phases = []
+        self.__names = {}
+        self.__cond = threading.Condition()
+        self.__start = None
+        #: (name, thread name, start, duration) of the finished phases,
+        #: in seconds since the scheduler started running
+        self.timings = []
+
+    def add(self, name, func, depends=(), threaded=False, deferred=False):
+        """
+            Adds a phase
+
+            :param name: the unique name of the phase
+            :param func: the callable running the phase
+            :param depends: names of the phases that have to be done
+                before this phase starts. They must already be added.
+            :param threaded: whether to run the phase in its own thread
+            :param deferred: whether to run the phase in
+                :meth:`run_deferred`
+        """
+        if name in self.__names:
+            raise ValueError("Startup phase %r already exists" % name)
+        for dep in depends:
+            phase = self.__names.get(dep)
+            if phase is None:
+                raise ValueError(
+                    "Startup phase %r depends on unknown %r" % (name, dep)
+                )
+            if phase.deferred and not deferred:
+                raise ValueError(
+                    "Startup phase %r cannot depend on deferred %r" % (name, dep)
+                )
+        if deferred and threaded:
+            raise ValueError("Deferred startup phases cannot be threaded")
+        phase = _Phase(name, func, tuple(depends), threaded, deferred)
+        self.__phases.append(phase)
+        self.__names[name] = phase
+
+    def __now(self):
+        if self.__start is None:
+            self.__start = time.time()
+        return time.time() - self.__start
+
+    def __finish(self, phase, start, error=None):
+        duration = self.__now() - start
+        with self.__cond:
+            phase.done = True
+            phase.error = error
+            self.timings.append(
+                (phase.name, threading.current_thread().name, start, duration)
+            )
+            self.__cond.notify_all()
+
+    def __run_threaded(self, phase):
+        start = self.__now()
+        try:
+            phase.func()
+        except BaseException as e:
+            if isinstance(e, Exception):
+                logger.exception("Startup phase %s failed", phase.name)
+            self.__finish(phase, start, e)
+        else:
+            self.__finish(phase, start)
+
+    def __run_phase(self, phase):
+        start = self.__now()
+        phase.func()
+        self.__finish(phase, start)
+
+    def __is_ready(self, phase):
+        return all(self.__names[dep].done for dep in phase.depends)
+
+    def run(self):
+        """
+            Runs all phases that are not deferred, and waits until they
+            are done.
+
+            An exception raised by a phase is raised again here, once
+            the phase is done.
+        """
+        self.__now()
+        pending = [p for p in self.__phases if not p.deferred]
+        running = []
+
+        with self.__cond:
+            while pending or running:
+                for phase in running:
+                    if phase.error is not None:
+                        raise phase.error
+                running = [p for p in running if not p.done]
+
+                current = None
+                for phase in [p for p in pending if self.__is_ready(p)]:
+                    if phase.threaded:
+                        pending.remove(phase)
+                        running.append(phase)
+                        thread = threading.Thread(
+                            target=self.__run_threaded,
+                            args=(phase,),
+                            name='startup-%s' % phase.name,
+                        )
+                        thread.daemon = True
+                        thread.start()
+                    elif current is None:
+                        current = phase
+
+                if current is not None:
+                    pending.remove(current)
+                    self.__cond.release()
+                    try:
+                        self.__run_phase(current)
+                    finally:
+                        self.__cond.acquire()
+                elif pending or running:
+                    # only threaded phases can make progress now
+                    self.__cond.wait()
+
+    def run_deferred(self, idle_add=None, callback=None):
+        """
+            Runs the deferred phases, in the order they were added
+
+            :param idle_add: if given, each phase is run by a separate
+                callback scheduled with this function, such as
+                :func:`GLib.idle_add`
+            :param callback: called without arguments once all deferred
+                phases are done
+        """
+        phases = [p for p in self.__phases if p.deferred and not p.done]
+
+        def run_next():
+            while phases:
+                self.__run_phase(phases.pop(0))
+                if idle_add is not None:
+                    break
+            if phases:
+                idle_add(run_next)
+            elif callback is not None:
+                callback()
+            return False
+
+        if idle_add is None:
+            run_next()
+        else:
+            idle_add(run_next)
+
+    def log_timings(self):
+        """
+            Logs the recorded time of each phase
+        """
+        total = max([t[2] + t[3] for t in self.timings] or [0])
+        logger.info("Startup took %.1f ms", total * 1000)
+        for name, thread, start, duration in self.timings:
+            logger.info(
+                "Startup phase %-18s %8.1f ms, started at %8.1f ms [%s]",
+                name,
+                duration * 1000,
+                start * 1000,
+                thread,
+            )
+
+
+# vim: et sts=4 sw=4
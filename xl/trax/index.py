@@ -0,0 +1,347 @@
+# Copyright (C) 2008-2010 Adam Olsen
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+    Inverted tag index used to speed up searches in a TrackDB
+"""
+
+from bisect import bisect_left, bisect_right
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['TrackSearchIndex']
+
+# Tags whose search value is derived from other tags, see
+# Track.get_tag_search
+_DERIVED_TAGS = {'artist': ('albumartist',), '__loc': ('__basename',)}
+
+# _ExactMatcher tolerance for internal (numeric) tags
+_EXACT_TOLERANCE = 0.0001
+
+
+def _lower(value):
+    if isinstance(value, basestring):
+        return value.lower()
+    return value
+
+
+def _search_values(track, tag):
+    """
+        Returns the normalized values of a tag, as seen by the matchers
+        in :mod:`xl.trax.search`
+    """
+    values = track.get_tag_search(tag, format=False)
+    if values == '__null__':
+        values = None
+    if not isinstance(values, list):
+        values = [values]
+    return tuple(_lower(v) for v in values)
+
+
+class _TagIndex(object):
+    """
+        Index of the values of a single tag
+    """
+
+    __slots__ = ['values', 'tokens', 'track_values', '_numeric']
+
+    def __init__(self):
+        # normalized value -> set of tracks
+        self.values = {}
+        # whitespace separated word -> set of tracks
+        self.tokens = {}
+        # track -> normalized values, so the index can be updated
+        self.track_values = {}
+        # (floats, values) sorted for range lookups, None if stale
+        self._numeric = None
+
+    def add(self, track, values):
+        self.track_values[track] = values
+        for value in values:
+            self.values.setdefault(value, set()).add(track)
+            if isinstance(value, basestring):
+                for token in value.split():
+                    self.tokens.setdefault(token, set()).add(track)
+        self._numeric = None
+
+    def remove(self, track):
+        values = self.track_values.pop(track, ())
+        for value in values:
+            self._discard(self.values, value, track)
+            if isinstance(value, basestring):
+                for token in value.split():
+                    self._discard(self.tokens, token, track)
+        self._numeric = None
+
+    @staticmethod
+    def _discard(mapping, key, track):
+        tracks = mapping.get(key)
+        if tracks is not None:
+            tracks.discard(track)
+            if not tracks:
+                del mapping[key]
+
+    def numeric(self):
+        """
+            Returns the float-convertible values of this tag as two
+            parallel lists sorted by their float value
+        """
+        if self._numeric is None:
+            items = []
+            for value in self.values:
+                if value is None:
+                    continue
+                try:
+                    fvalue = float(value)
+                except (TypeError, ValueError):
+                    continue
+                if fvalue != fvalue:  # NaN never compares true
+                    continue
+                items.append((fvalue, value))
+            items.sort()
+            self._numeric = ([i[0] for i in items], [i[1] for i in items])
+        return self._numeric
+
+    def union(self, values):
+        result = set()
+        for value in values:
+            tracks = self.values.get(value)
+            if tracks:
+                result.update(tracks)
+        return result
+
+
+class TrackSearchIndex(object):
+    """
+        Inverted index mapping tag values and word tokens to the tracks
+        that contain them.
+
+        Tags are indexed on first lookup and are kept current afterwards
+        through :meth:`add_tracks`, :meth:`remove_tracks` and
+        :meth:`update_track`.
+
+        Lookups return a set of candidate tracks that is guaranteed to
+        contain every track the corresponding matcher would accept, so
+        the matcher must still be applied to the result. A lookup returns
+        None when the index cannot narrow down the search.
+    """
+
+    def __init__(self, tracks=()):
+        self._lock = threading.RLock()
+        self._tracks = set(tracks)
+        self._source = None
+        self._tags = {}
+        self._unindexable = set()
+
+    def __contains__(self, track):
+        with self._lock:
+            return track in self._get_tracks()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._get_tracks())
+
+    def set_tracks(self, tracks):
+        """
+            Replaces the indexed tracks, dropping all tag indexes
+
+            :param tracks: an iterable of tracks, or a callable returning
+                one. A callable is only called once the index is used, so
+                tracks can be created lazily.
+        """
+        with self._lock:
+            if callable(tracks):
+                self._tracks = None
+                self._source = tracks
+            else:
+                self._tracks = set(tracks)
+                self._source = None
+            self._tags = {}
+            self._unindexable = set()
+
+    def _get_tracks(self):
+        """
+            Must be called with the lock held
+        """
+        if self._tracks is None:
+            self._tracks = set(self._source())
+            self._source = None
+        return self._tracks
+
+    def add_tracks(self, tracks):
+        with self._lock:
+            # a pending source already reflects the change
+            if self._tracks is None:
+                return
+            for track in tracks:
+                if track in self._tracks:
+                    continue
+                self._tracks.add(track)
+                for tag in self._tags.keys():
+                    self._index(tag, track)
+
+    def remove_tracks(self, tracks):
+        with self._lock:
+            # a pending source already reflects the change
+            if self._tracks is None:
+                return
+            for track in tracks:
+                if track not in self._tracks:
+                    continue
+                self._tracks.discard(track)
+                for tagindex in self._tags.itervalues():
+                    tagindex.remove(track)
+
+    def update_track(self, track, tags):
+        """
+            Updates the index after tags of a track have changed
+
+            :param track: the changed :class:`xl.trax.Track`
+            :param tags: the names of the tags that have changed
+        """
+        with self._lock:
+            # nothing is indexed before the tracks are known
+            if self._tracks is None or track not in self._tracks:
+                return
+            affected = set(tags)
+            for tag in tags:
+                affected.update(_DERIVED_TAGS.get(tag, ()))
+            for tag in affected:
+                tagindex = self._tags.get(tag)
+                if tagindex is None:
+                    continue
+                tagindex.remove(track)
+                self._index(tag, track)
+
+    def _index(self, tag, track):
+        try:
+            self._tags[tag].add(track, _search_values(track, tag))
+        except TypeError:
+            # unhashable tag values, don't try to index this tag
+            logger.debug("Cannot index tag %s, values are unhashable", tag)
+            self._unindexable.add(tag)
+            del self._tags[tag]
+
+    def _get_tag(self, tag):
+        """
+            Returns the index of a tag, building it if necessary.
+            Must be called with the lock held.
+        """
+        tagindex = self._tags.get(tag)
+        if tagindex is None:
+            if tag in self._unindexable:
+                return None
+            tagindex = self._tags[tag] = _TagIndex()
+            for track in self._get_tracks():
+                self._index(tag, track)
+                if tag in self._unindexable:
+                    return None
+        return tagindex
+
+    def lookup_exact(self, tag, content):
+        """
+            Candidates for ``tag==content``
+        """
+        with self._lock:
+            tagindex = self._get_tag(tag)
+            if tagindex is None:
+                return None
+            result = tagindex.union([_lower(content)])
+            if tag.startswith('__') and content is not None:
+                try:
+                    fcontent = float(content)
+                except (TypeError, ValueError):
+                    return result
+                floats, values = tagindex.numeric()
+                start = bisect_left(floats, fcontent - _EXACT_TOLERANCE)
+                end = bisect_right(floats, fcontent + _EXACT_TOLERANCE)
+                result.update(tagindex.union(values[start:end]))
+            return result
+
+    def lookup_contains(self, tag, content):
+        """
+            Candidates for ``tag=content``
+        """
+        if not isinstance(content, basestring):
+            return None
+        words = _lower(content).split()
+        if not words:
+            return None
+        with self._lock:
+            tagindex = self._get_tag(tag)
+            if tagindex is None:
+                return None
+            result = None
+            # Every word of the content has to be a substring of a word
+            # in the tag value, so only the vocabulary needs scanning.
+            for word in words:
+                tracks = set()
+                for token, token_tracks in tagindex.tokens.iteritems():
+                    if word in token:
+                        tracks.update(token_tracks)
+                result = tracks if result is None else result & tracks
+                if not result:
+                    break
+            return result
+
+    def lookup_greater(self, tag, content):
+        """
+            Candidates for ``tag>content``
+        """
+        try:
+            fcontent = float(content)
+        except (TypeError, ValueError):
+            return set()
+        with self._lock:
+            tagindex = self._get_tag(tag)
+            if tagindex is None:
+                return None
+            floats, values = tagindex.numeric()
+            return tagindex.union(values[bisect_right(floats, fcontent) :])
+
+    def lookup_less(self, tag, content):
+        """
+            Candidates for ``tag<content``
+        """
+        try:
+            fcontent = float(content)
+        except (TypeError, ValueError):
+            return set()
+        with self._lock:
+            tagindex = self._get_tag(tag)
+            if tagindex is None:
+                return None
+            floats, values = tagindex.numeric()
+            result = tagindex.union(values[: bisect_left(floats, fcontent)])
+            # _LtMatcher treats missing values as 0
+            if 0 < fcontent:
+                result.update(tagindex.union([None]))
+            return result
+
+
+# vim: et sts=4 sw=4
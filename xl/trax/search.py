@@ -32,6 +32,44 @@ from xl.unicode import shave_marks
 __all__ = ['TracksMatcher', 'search_tracks']
 
 
+def _get_candidates(matcher, index):
+    # matchers supplied from elsewhere do not have to support the index
+    candidates = getattr(matcher, 'candidates', None)
+    if candidates is None:
+        return None
+    return candidates(index)
+
+
+def _intersect_candidates(matchers, index):
+    """
+        Candidates matching all of the matchers, None if none of them
+        can be answered from the index
+    """
+    result = None
+    for matcher in matchers:
+        candidates = _get_candidates(matcher, index)
+        if candidates is None:
+            continue
+        result = candidates if result is None else result & candidates
+        if not result:
+            break
+    return result
+
+
+def _union_candidates(matchers, index):
+    """
+        Candidates matching any of the matchers, None if any of them
+        cannot be answered from the index
+    """
+    result = set()
+    for matcher in matchers:
+        candidates = _get_candidates(matcher, index)
+        if candidates is None:
+            return None
+        result |= candidates
+    return result
+
+
 class SearchResultTrack(object):
     """
         Holds a track with search result metadata included.
@@ -52,6 +90,10 @@ class _Matcher(object):
     """
 
     __slots__ = ['tag', 'content', 'lower']
+    # estimated relative cost of a match and fraction of tracks
+    # matching, used to order the conditions of a compiled query
+    cost = 1.0
+    selectivity = 0.5
 
     def __init__(self, tag, content, lower):
         self.tag = tag
@@ -78,12 +120,22 @@ class _Matcher(object):
     def _matches(self, value):
         raise NotImplementedError
 
+    def candidates(self, index):
+        """
+            Returns the tracks from a
+            :class:`xl.trax.index.TrackSearchIndex` that may match this
+            condition, or None if the index cannot tell.
+        """
+        return None
+
 
 class _ExactMatcher(_Matcher):
     """
         Condition for exact matches
     """
 
+    selectivity = 0.05
+
     def _matches(self, value):
         if self.tag.startswith("__"):
             try:
@@ -98,12 +150,17 @@ class _ExactMatcher(_Matcher):
             newcontent = self.content
         return newvalue == newcontent
 
+    def candidates(self, index):
+        return index.lookup_exact(self.tag, self.content)
+
 
 class _InMatcher(_Matcher):
     """
         Condition for inexact (ie. containing) matches
     """
 
+    selectivity = 0.2
+
     def _matches(self, value):
         if not value:
             return False
@@ -112,12 +169,18 @@ class _InMatcher(_Matcher):
         except TypeError:
             return False
 
+    def candidates(self, index):
+        return index.lookup_contains(self.tag, self.content)
+
 
 class _RegexMatcher(_Matcher):
     """
         Condition for regular expression matches
     """
 
+    cost = 4.0
+    selectivity = 0.2
+
     def __init__(self, tag, content, lower):
         _Matcher.__init__(self, tag, content, lower)
         self._re = re.compile(content)
@@ -136,6 +199,8 @@ class _GtMatcher(_Matcher):
         Condition for greater than matches.
     """
 
+    cost = 2.0
+
     def _matches(self, value):
         try:
             value = float(value)
@@ -144,12 +209,17 @@ class _GtMatcher(_Matcher):
             return False
         return value > content
 
+    def candidates(self, index):
+        return index.lookup_greater(self.tag, self.content)
+
 
 class _LtMatcher(_Matcher):
     """
         Condition for less than matches.
     """
 
+    cost = 2.0
+
     def _matches(self, value):
         try:
             if value is None:
@@ -161,6 +231,9 @@ class _LtMatcher(_Matcher):
             return False
         return value < content
 
+    def candidates(self, index):
+        return index.lookup_less(self.tag, self.content)
+
 
 class _NotMetaMatcher(object):
     """
@@ -176,6 +249,9 @@ class _NotMetaMatcher(object):
     def match(self, srtrack):
         return not self.matcher.match(srtrack)
 
+    def candidates(self, index):
+        return None
+
 
 class _OrMetaMatcher(object):
     """
@@ -191,6 +267,9 @@ class _OrMetaMatcher(object):
     def match(self, srtrack):
         return self.left.match(srtrack) or self.right.match(srtrack)
 
+    def candidates(self, index):
+        return _union_candidates([self.left, self.right], index)
+
 
 class _MultiMetaMatcher(object):
     """
@@ -209,6 +288,9 @@ class _MultiMetaMatcher(object):
                 return False
         return True
 
+    def candidates(self, index):
+        return _intersect_candidates(self.matchers, index)
+
 
 class _ManyMultiMetaMatcher(object):
     """
@@ -239,6 +321,294 @@ class _ManyMultiMetaMatcher(object):
                     self.tags.update(ma.tags)
         return matched
 
+    def candidates(self, index):
+        return _union_candidates(self.matchers, index)
+
+
+def _keep_case(value):
+    return value
+
+
+def _lower_case(value):
+    return value.lower()
+
+
+def _tag_values(track, tag, lower):
+    """
+        Returns the values of a tag as seen by :meth:`_Matcher.match`
+    """
+    values = track.get_tag_search(tag, format=False)
+    if values == '__null__':
+        return [None]
+    if not isinstance(values, list):
+        values = [values]
+    if lower is not _keep_case:
+        values = [value if value is None else lower(value) for value in values]
+    return values
+
+
+def _test_in(content, values):
+    for value in values:
+        if value:
+            try:
+                if content in value:
+                    return True
+            except TypeError:
+                pass
+    return False
+
+
+def _test_number(number, content, values):
+    for value in values:
+        try:
+            if abs(float(value) - number) < 0.0001:
+                return True
+        except (TypeError, ValueError):
+            if value == content:
+                return True
+    return False
+
+
+def _test_greater(number, values):
+    for value in values:
+        try:
+            if float(value) > number:
+                return True
+        except (TypeError, ValueError):
+            pass
+    return False
+
+
+def _test_less(number, values):
+    for value in values:
+        try:
+            if (0 if value is None else float(value)) < number:
+                return True
+        except (TypeError, ValueError):
+            pass
+    return False
+
+
+def _test_regex(search, values):
+    for value in values:
+        if value:
+            try:
+                if search(value) is not None:
+                    return True
+            except TypeError:
+                pass
+    return False
+
+
+def _add_matcher_tags(on_tags, matcher):
+    if matcher.tag is not None:
+        if matcher.tag not in on_tags:
+            on_tags.append(matcher.tag)
+    elif hasattr(matcher, 'tags'):
+        for tag in matcher.tags:
+            if tag not in on_tags:
+                on_tags.append(tag)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _QueryPlan(object):
+    """
+        Compiles matchers into the source of a single function, which
+        matches a :class:`SearchResultTrack` against all of them.
+
+        The values of each tag are read once per track, and the
+        conditions of each conjunction are evaluated in the order of
+        their estimated cost and selectivity, so that the cheapest and
+        most selective ones reject tracks first.
+    """
+
+    def __init__(self, matchers):
+        self.namespace = {
+            '_tag_values': _tag_values,
+            '_test_in': _test_in,
+            '_test_number': _test_number,
+            '_test_greater': _test_greater,
+            '_test_less': _test_less,
+            '_test_regex': _test_regex,
+            '_add_matcher_tags': _add_matcher_tags,
+        }
+        # (tag, lower) -> name of the variable holding its values
+        self.values = {}
+        self.lines = ['def match(srtrack):', '    track = srtrack.track']
+
+        for matcher in self.__order(matchers):
+            expr = self.__expression(matcher)
+            self.lines.append('    if not %s:' % expr)
+            self.lines.append('        return False')
+
+        # only matching tracks get their matched tags, in the order of
+        # the matchers
+        self.lines.append('    on_tags = srtrack.on_tags')
+        for matcher in matchers:
+            self.__add_tags(matcher)
+        self.lines.append('    return True')
+
+        self.source = '\n'.join(self.lines) + '\n'
+        code = compile(self.source, '<search query>', 'exec')
+        exec(code, self.namespace)
+        self.match = self.namespace['match']
+
+    def __constant(self, value):
+        name = '_c%d' % len(self.namespace)
+        self.namespace[name] = value
+        return name
+
+    def __fetch(self, tag, lower):
+        """
+            Returns the name of the variable holding the values of a
+            tag, reading them right before the current condition if
+            no earlier condition did
+        """
+        name = self.values.get((tag, lower))
+        if name is None:
+            name = self.values[(tag, lower)] = '_v%d' % len(self.values)
+            self.lines.append(
+                '    %s = _tag_values(track, %s, %s)'
+                % (name, self.__constant(tag), self.__constant(lower))
+            )
+        return name
+
+    @staticmethod
+    def _estimate(matcher):
+        """
+            Returns the estimated (cost, selectivity) of a matcher
+        """
+        mtype = type(matcher)
+        if mtype is _NotMetaMatcher:
+            cost, selectivity = _QueryPlan._estimate(matcher.matcher)
+            return cost, 1 - selectivity
+        elif mtype in (_OrMetaMatcher, _ManyMultiMetaMatcher):
+            if mtype is _OrMetaMatcher:
+                submatchers = [matcher.left, matcher.right]
+            else:
+                submatchers = matcher.matchers
+            cost, missed = 0, 1.0
+            for submatcher in submatchers:
+                subcost, selectivity = _QueryPlan._estimate(submatcher)
+                cost += subcost
+                missed *= 1 - selectivity
+            return cost, 1 - missed
+        elif mtype is _MultiMetaMatcher:
+            cost, selectivity = 0, 1.0
+            for submatcher in matcher.matchers:
+                subcost, subselectivity = _QueryPlan._estimate(submatcher)
+                cost += subcost
+                selectivity *= subselectivity
+            return cost, selectivity
+        return (
+            getattr(matcher, 'cost', _Matcher.cost),
+            getattr(matcher, 'selectivity', _Matcher.selectivity),
+        )
+
+    def __order(self, matchers):
+        """
+            Orders the conditions of a conjunction by their expected
+            cost per rejected track
+        """
+
+        def rank(matcher):
+            cost, selectivity = self._estimate(matcher)
+            return cost / max(1 - selectivity, 0.001)
+
+        return sorted(matchers, key=rank)
+
+    def __expression(self, matcher):
+        """
+            Returns the expression evaluating a matcher
+        """
+        mtype = type(matcher)
+        if mtype is _NotMetaMatcher:
+            return '(not %s)' % self.__expression(matcher.matcher)
+        elif mtype is _OrMetaMatcher:
+            return '(%s or %s)' % (
+                self.__expression(matcher.left),
+                self.__expression(matcher.right),
+            )
+        elif mtype is _MultiMetaMatcher:
+            if not matcher.matchers:
+                return 'True'
+            return '(%s)' % ' and '.join(
+                self.__expression(m) for m in self.__order(matcher.matchers)
+            )
+        elif mtype is _ManyMultiMetaMatcher and all(
+            isinstance(m, _Matcher) for m in matcher.matchers
+        ):
+            exprs = [self.__expression(m) for m in matcher.matchers if m.tag]
+            if not exprs:
+                return 'False'
+            return '(%s)' % ' or '.join(exprs)
+        elif mtype in (_ExactMatcher, _InMatcher, _GtMatcher, _LtMatcher):
+            return self.__leaf_expression(matcher)
+        elif mtype is _RegexMatcher:
+            return '_test_regex(%s, %s)' % (
+                self.__constant(matcher._re.search),
+                self.__fetch(matcher.tag, matcher.lower),
+            )
+        # matchers supplied from elsewhere
+        return '%s(srtrack)' % self.__constant(matcher.match)
+
+    def __leaf_expression(self, matcher):
+        mtype = type(matcher)
+        values = self.__fetch(matcher.tag, matcher.lower)
+        content = self.__constant(matcher.content)
+        if mtype is _InMatcher:
+            return '_test_in(%s, %s)' % (content, values)
+        if mtype is _ExactMatcher:
+            number = None
+            if matcher.tag.startswith('__'):
+                number = _to_float(matcher.content)
+            if number is None:
+                return '(%s in %s)' % (content, values)
+            return '_test_number(%s, %s, %s)' % (
+                self.__constant(number),
+                content,
+                values,
+            )
+        number = _to_float(matcher.content)
+        if number is None:
+            return 'False'
+        if mtype is _GtMatcher:
+            return '_test_greater(%s, %s)' % (self.__constant(number), values)
+        return '_test_less(%s, %s)' % (self.__constant(number), values)
+
+    def __add_tags(self, matcher):
+        """
+            Adds the code adding the tags matched by a matcher to
+            the on_tags of a track
+        """
+        mtype = type(matcher)
+        if isinstance(matcher, _Matcher):
+            if matcher.tag is not None:
+                tag = self.__constant(matcher.tag)
+                self.lines.append('    if %s not in on_tags:' % tag)
+                self.lines.append('        on_tags.append(%s)' % tag)
+        elif mtype is _ManyMultiMetaMatcher and all(
+            isinstance(m, _Matcher) for m in matcher.matchers
+        ):
+            for submatcher in matcher.matchers:
+                if submatcher.tag:
+                    tag = self.__constant(submatcher.tag)
+                    self.lines.append(
+                        '    if %s not in on_tags and %s:'
+                        % (tag, self.__expression(submatcher))
+                    )
+                    self.lines.append('        on_tags.append(%s)' % tag)
+        elif mtype not in (_NotMetaMatcher, _OrMetaMatcher, _MultiMetaMatcher):
+            self.lines.append(
+                '    _add_matcher_tags(on_tags, %s)' % self.__constant(matcher)
+            )
+
 
 class TracksMatcher(object):
     """
@@ -246,7 +616,12 @@ class TracksMatcher(object):
         a given track matches those criteria.
     """
 
-    __slots__ = ['matchers', 'case_sensitive', 'keyword_tags']
+    __slots__ = ['matchers', 'case_sensitive', 'keyword_tags', '_plan']
+
+    # (search string, case sensitivity, keyword tags) -> (matchers, plan)
+    # of recently parsed queries
+    __plans = {}
+    __max_plans = 128
 
     def __init__(self, search_string, case_sensitive=True, keyword_tags=None):
         """
@@ -258,11 +633,21 @@ class TracksMatcher(object):
         """
         self.case_sensitive = case_sensitive
         self.keyword_tags = keyword_tags or []
-        search_string = shave_marks(search_string)
-        tokens = self.__tokenize_query(search_string)
-        tokens = self.__red(tokens)
-        tokens = self.__optimize_tokens(tokens)
-        self.matchers = self.__tokens_to_matchers(tokens)
+        key = (search_string, case_sensitive, tuple(self.keyword_tags))
+        cached = self.__plans.get(key)
+        if cached is None:
+            search_string = shave_marks(search_string)
+            tokens = self.__tokenize_query(search_string)
+            tokens = self.__red(tokens)
+            tokens = self.__optimize_tokens(tokens)
+            matchers = self.__tokens_to_matchers(tokens)
+            cached = (matchers, _QueryPlan(matchers).match)
+            if len(self.__plans) >= self.__max_plans:
+                self.__plans.clear()
+            self.__plans[key] = cached
+        # the matchers are shared, but the list may be changed
+        self.matchers = list(cached[0])
+        self._plan = cached[1]
 
     def append_matcher(self, matcher, or_match=False):
         '''Here so you can use playlist matchers. Probably needs better impl'''
@@ -270,6 +655,7 @@ class TracksMatcher(object):
             self.matchers.append(matcher)
         else:
             self.matchers[-1] = _OrMetaMatcher(self.matchers[-1], matcher)
+        self._plan = None
 
     def prepend_matcher(self, matcher, or_match=False):
         '''Here so you can use playlist matchers. Probably needs better impl'''
@@ -277,25 +663,56 @@ class TracksMatcher(object):
             self.matchers.insert(0, matcher)
         else:
             self.matchers[0] = _OrMetaMatcher(matcher, self.matchers[0])
+        self._plan = None
 
     def match(self, srtrack):
         """
             Determine whether a given SearchResultTrack's internal
             Track object matches this search condition.
+
+            The tags matched by the conditions are added to the
+            on_tags of a matching track.
+        """
+        plan = self._plan
+        if plan is None:
+            plan = self._plan = _QueryPlan(self.matchers).match
+        return plan(srtrack)
+
+    def candidates(self, index):
         """
+            Returns the tracks from a
+            :class:`xl.trax.index.TrackSearchIndex` that may match all
+            conditions, or None if the index cannot narrow them down.
+        """
+        return _intersect_candidates(self.matchers, index)
+
+    def get_keywords(self):
+        """
+            Returns the keywords of a search that consists of nothing but
+            plain keywords, so that it can be matched against the text
+            returned by :func:`get_keyword_text`.
+
+            :returns: a list of (content, internal content) tuples, the
+                content being compared to regular tags and the internal
+                content to internal tags, either may be None. None if
+                the search contains anything other than plain keywords.
+        """
+        if not self.matchers or not self.keyword_tags:
+            return None
+        keywords = []
         for ma in self.matchers:
-            if not ma.match(srtrack):
-                break
-            if ma.tag is not None:
-                if ma.tag not in srtrack.on_tags:
-                    srtrack.on_tags.append(ma.tag)
-            elif hasattr(ma, 'tags'):
-                for t in ma.tags:
-                    if t not in srtrack.on_tags:
-                        srtrack.on_tags.append(t)
-        else:
-            return True
-        return False
+            if type(ma) is not _ManyMultiMetaMatcher:
+                return None
+            content = internal = None
+            for submatcher in ma.matchers:
+                if not submatcher.content or u'\0' in submatcher.content:
+                    return None
+                if submatcher.tag.startswith('__'):
+                    internal = submatcher.content
+                else:
+                    content = submatcher.content
+            keywords.append((content, internal))
+        return keywords
 
     def __tokens_to_matchers(self, tokens, matchers=None):
         """
@@ -339,9 +756,9 @@ class TracksMatcher(object):
         # normal token
         else:
             if not self.case_sensitive:
-                lower = lambda x: x.lower()
+                lower = _lower_case
             else:
-                lower = lambda x: x
+                lower = _keep_case
 
             # TODO: this stuff is kinda repetitive, can we consolidate
             # it? Maybe move some of this into the matcher classes?
@@ -503,6 +920,8 @@ class TracksInList(object):
 
     __slots__ = ['_tracks', 'tag']
     tag = None
+    cost = 0.5
+    selectivity = 0.1
 
     def __init__(self, tracks):
         if isinstance(tracks, dict):
@@ -513,24 +932,97 @@ class TracksInList(object):
     def match(self, track):
         return track.track in self._tracks
 
+    def candidates(self, index):
+        return set(self._tracks)
+
 
 class TracksNotInList(TracksInList):
     '''
         Matches tracks not in a list/dict/set
     '''
 
+    selectivity = 0.9
+
     def match(self, track):
         return track.track not in self._tracks
 
+    def candidates(self, index):
+        return None
+
+
+def get_keyword_text(track, keyword_tags, case_sensitive=True):
+    """
+        Returns the values of the keyword tags of a track as they are
+        seen by the matchers, joined into one string for regular and one
+        for internal tags.
+
+        :returns: a tuple of (text, internal text)
+    """
+    texts = ([], [])
+    for tag in keyword_tags:
+        values = track.get_tag_search(tag, format=False)
+        if values == '__null__':
+            continue
+        if not isinstance(values, list):
+            values = [values]
+        if not case_sensitive:
+            values = [v.lower() for v in values]
+        texts[tag.startswith('__')].extend(values)
+    return u'\0'.join(texts[0]), u'\0'.join(texts[1])
+
+
+def match_keyword_text(keywords, text):
+    """
+        Determines whether the text returned by :func:`get_keyword_text`
+        matches all keywords returned by :meth:`TracksMatcher.get_keywords`.
+        The result is the same as that of :meth:`TracksMatcher.match`.
+    """
+    for content, internal in keywords:
+        if not (
+            (content is not None and content in text[0])
+            or (internal is not None and internal in text[1])
+        ):
+            return False
+    return True
+
+
+def keywords_narrowed(old, new):
+    """
+        Determines whether every track matching the keywords *new* also
+        matches the keywords *old*, both as returned by
+        :meth:`TracksMatcher.get_keywords` for the same keyword tags.
+        This is the case when every old keyword is a part of a new one,
+        e.g. when more characters have been typed into a search.
+    """
+    for content, internal in old:
+        for newcontent, newinternal in new:
+            if (content is None or content in (newcontent or u'')) and (
+                internal is None or internal in (newinternal or u'')
+            ):
+                break
+        else:
+            return False
+    return True
+
 
 def search_tracks(trackiter, trackmatchers):
     """
         Search a set of tracks for those that match specified conditions.
 
+        If *trackiter* provides a ``get_search_candidates`` method (like
+        :class:`xl.trax.TrackDB` does), only the tracks it returns are
+        checked against the matchers.
+
         :param trackiter: An iterable object returning Track objects
         :param trackmatchers: A list of TrackMatcher objects
     """
-    for srtr in trackiter:
+    get_candidates = getattr(trackiter, 'get_search_candidates', None)
+    if get_candidates is not None:
+        candidates = get_candidates(trackmatchers)
+        if candidates is not None:
+            trackiter = candidates
+
+    for count, srtr in enumerate(trackiter):
         if not isinstance(srtr, SearchResultTrack):
             srtr = SearchResultTrack(srtr)
         for tma in trackmatchers:
@@ -544,8 +1036,10 @@ def search_tracks(trackiter, trackmatchers):
         # thread running the search can end up blocking other threads.
         # Calling out to time.sleep forces a release of the GIL and
         # allows other threads to run. Benchmarks show this has no
-        # noticable effect on search speed.
-        time.sleep(0)
+        # noticable effect on search speed, as long as it isn't done
+        # for every single track.
+        if count % 128 == 0:
+            time.sleep(0)
 
 
 def search_tracks_from_string(
@@ -0,0 +1,347 @@
+# Copyright (C) 2008-2010 Adam Olsen
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+    Columnar snapshots of the tracks in a TrackDB
+
+    A snapshot stores every distinct string and tag value once, and one
+    column of value ids per tag. It is designed to be memory-mapped, so
+    loading a snapshot only reads the track locations; the tags of a
+    track are only decoded when they are requested.
+
+    File layout (all integers little-endian)::
+
+        header
+        string offsets (string_count + 1 x uint32), string data
+        value offsets (value_count + 1 x uint32), value records
+        tag names (tag_count x uint32 string ids)
+        keys (track_count x uint64)
+        tag columns (tag_count x track_count x uint32 value ids + 1)
+        pickled extra data
+"""
+
+import cPickle
+import mmap
+import os
+import struct
+import sys
+
+from xl import common
+
+__all__ = ['SnapshotError', 'TrackSnapshot', 'write_snapshot']
+
+MAGIC = 'EXTRXSNP'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sIQIIIIQQQQQ')
+_UINT = struct.Struct('<I')
+_UINT2 = struct.Struct('<II')
+_FLOAT = struct.Struct('<d')
+_INT = struct.Struct('<q')
+
+
+class SnapshotError(Exception):
+    """
+        Raised when a snapshot cannot be read
+    """
+
+    pass
+
+
+class _Interner(object):
+    """
+        Assigns consecutive ids to distinct items
+    """
+
+    __slots__ = ['ids', 'items']
+
+    def __init__(self):
+        self.ids = {}
+        self.items = []
+
+    def __call__(self, item):
+        try:
+            return self.ids[item]
+        except KeyError:
+            itemid = self.ids[item] = len(self.items)
+            self.items.append(item)
+            return itemid
+
+
+class _Encoder(object):
+    """
+        Encodes tag values to records referencing interned strings
+    """
+
+    def __init__(self):
+        self.strings = _Interner()
+        self.values = _Interner()
+
+    def value_id(self, value):
+        return self.values(self.encode(value))
+
+    def encode(self, value):
+        vtype = type(value)
+        if value is None:
+            return 'N'
+        elif vtype is unicode:
+            return 'U' + _UINT.pack(self.strings(value.encode('utf-8')))
+        elif vtype is str:
+            return 'B' + _UINT.pack(self.strings(value))
+        elif vtype is float:
+            return 'F' + _FLOAT.pack(value)
+        elif vtype in (int, long) and -(2 ** 63) <= value < 2 ** 63:
+            return 'I' + _INT.pack(value)
+        elif vtype is list:
+            ids = [self.value_id(v) for v in value]
+            return 'L' + struct.pack('<%dI' % len(ids), *ids)
+        return 'P' + cPickle.dumps(value, common.PICKLE_PROTOCOL)
+
+
+def _pack_table(items):
+    """
+        Packs a list of byte strings into an offset table and a blob
+    """
+    offsets = [0]
+    for item in items:
+        offsets.append(offsets[-1] + len(item))
+    return struct.pack('<%dI' % len(offsets), *offsets) + ''.join(items)
+
+
+def write_snapshot(path, serial, entries):
+    """
+        Writes a snapshot atomically
+
+        :param path: the file to write
+        :param serial: the serial number of the TrackDB contents
+        :param entries: a list of (tags, key, attrs) tuples, where tags is
+            the pickled state of a track as returned by ``Track._pickles``
+    """
+    encoder = _Encoder()
+    count = len(entries)
+    tags = sorted({tag for entry in entries for tag in entry[0]})
+    columns = {tag: [0] * count for tag in tags}
+    keys = []
+    attrs = {}
+
+    for row, (state, key, extra) in enumerate(entries):
+        for tag, value in state.iteritems():
+            columns[tag][row] = encoder.value_id(value) + 1
+        keys.append(key)
+        if extra:
+            attrs[row] = extra
+
+    tag_ids = [encoder.strings(tag) for tag in tags]
+
+    strings = _pack_table(encoder.strings.items)
+    values = _pack_table(encoder.values.items)
+    names = struct.pack('<%dI' % len(tag_ids), *tag_ids)
+    keydata = struct.pack('<%dQ' % count, *keys)
+    extra = cPickle.dumps({'attrs': attrs}, common.PICKLE_PROTOCOL)
+
+    strings_off = _HEADER.size
+    values_off = strings_off + len(strings)
+    names_off = values_off + len(values)
+    keys_off = names_off + len(names)
+    columns_off = keys_off + len(keydata)
+    extra_off = columns_off + 4 * count * len(tags)
+
+    header = _HEADER.pack(
+        MAGIC,
+        VERSION,
+        serial,
+        count,
+        len(tags),
+        len(encoder.strings.items),
+        len(encoder.values.items),
+        strings_off,
+        values_off,
+        names_off,
+        columns_off,
+        extra_off,
+    )
+
+    tmp = path + '.new'
+    with open(tmp, 'wb') as fp:
+        fp.write(header)
+        fp.write(strings)
+        fp.write(values)
+        fp.write(names)
+        fp.write(keydata)
+        for tag in tags:
+            fp.write(struct.pack('<%dI' % count, *columns[tag]))
+        fp.write(extra)
+        fp.flush()
+        os.fsync(fp.fileno())
+    common.replace_file(tmp, path)
+
+
+class TrackSnapshot(object):
+    """
+        Read access to a snapshot written by :func:`write_snapshot`.
+
+        On platforms that allow replacing mapped files the snapshot is
+        memory-mapped, elsewhere it is read into memory.
+
+        :raises SnapshotError: if the file is not a readable snapshot
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fp:
+            if sys.platform == 'win32':
+                self._buf = fp.read()
+            else:
+                try:
+                    self._buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                except (ValueError, EnvironmentError) as e:
+                    raise SnapshotError("Cannot map %s: %s" % (path, e))
+
+        if len(self._buf) < _HEADER.size:
+            raise SnapshotError("%s is truncated" % path)
+
+        (
+            magic,
+            version,
+            self.serial,
+            self.count,
+            tag_count,
+            string_count,
+            value_count,
+            self._strings_off,
+            self._values_off,
+            names_off,
+            self._columns_off,
+            self._extra_off,
+        ) = _HEADER.unpack_from(self._buf)
+
+        if magic != MAGIC:
+            raise SnapshotError("%s is not a track snapshot" % path)
+        if version != VERSION:
+            raise SnapshotError(
+                "%s has unsupported snapshot version %s" % (path, version)
+            )
+        if self._extra_off > len(self._buf):
+            raise SnapshotError("%s is truncated" % path)
+
+        self._strings_data = self._strings_off + 4 * (string_count + 1)
+        self._values_data = self._values_off + 4 * (value_count + 1)
+        self._keys_off = names_off + 4 * tag_count
+        self._string_cache = {}
+        self._value_cache = {}
+        self._extra = None
+
+        ids = struct.unpack_from('<%dI' % tag_count, self._buf, names_off)
+        self.tags = [self._string(i) for i in ids]
+
+    def close(self):
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+
+    def _string(self, sid):
+        try:
+            return self._string_cache[sid]
+        except KeyError:
+            start, end = _UINT2.unpack_from(self._buf, self._strings_off + 4 * sid)
+            string = self._buf[self._strings_data + start : self._strings_data + end]
+            self._string_cache[sid] = string
+            return string
+
+    def _value(self, vid):
+        try:
+            return self._value_cache[vid]
+        except KeyError:
+            pass
+        start, end = _UINT2.unpack_from(self._buf, self._values_off + 4 * vid)
+        record = self._buf[self._values_data + start : self._values_data + end]
+        kind = record[0]
+        if kind == 'N':
+            value = None
+        elif kind == 'U':
+            value = self._string(_UINT.unpack_from(record, 1)[0]).decode('utf-8')
+        elif kind == 'B':
+            value = self._string(_UINT.unpack_from(record, 1)[0])
+        elif kind == 'F':
+            value = _FLOAT.unpack_from(record, 1)[0]
+        elif kind == 'I':
+            value = _INT.unpack_from(record, 1)[0]
+        elif kind == 'L':
+            ids = struct.unpack_from('<%dI' % ((len(record) - 1) // 4), record, 1)
+            value = [self._value(i) for i in ids]
+        elif kind == 'P':
+            value = cPickle.loads(record[1:])
+        else:
+            raise SnapshotError("Invalid value record in %s" % self.path)
+        self._value_cache[vid] = value
+        return value
+
+    def _column(self, tagnum):
+        return struct.unpack_from(
+            '<%dI' % self.count, self._buf, self._columns_off + 4 * self.count * tagnum
+        )
+
+    def get_locations(self):
+        """
+            Returns the location of every track, in row order
+        """
+        try:
+            column = self._column(self.tags.index('__loc'))
+        except ValueError:
+            return [None] * self.count
+        return [self._value(v - 1) if v else None for v in column]
+
+    def get_keys(self):
+        """
+            Returns the TrackDB key of every track, in row order
+        """
+        return struct.unpack_from('<%dQ' % self.count, self._buf, self._keys_off)
+
+    def get_attrs(self, row):
+        """
+            Returns the extra TrackHolder attributes of a track
+        """
+        if self._extra is None:
+            self._extra = cPickle.loads(self._buf[self._extra_off :])
+        return dict(self._extra['attrs'].get(row, {}))
+
+    def get_state(self, row):
+        """
+            Returns the tags of a track, suitable for ``Track(_unpickles=...)``
+
+            .. note:: Values are shared between calls, callers must not
+                modify them
+        """
+        state = {}
+        base = self._columns_off + 4 * row
+        stride = 4 * self.count
+        for tagnum, tag in enumerate(self.tags):
+            vid = _UINT.unpack_from(self._buf, base + stride * tagnum)[0]
+            if vid:
+                state[tag] = self._value(vid - 1)
+        return state
+
+
+# vim: et sts=4 sw=4
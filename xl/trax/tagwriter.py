@@ -0,0 +1,377 @@
+# Copyright (C) 2008-2010 Adam Olsen
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+    Writes the tags of tracks to their files in the background
+"""
+
+from __future__ import absolute_import
+
+from collections import OrderedDict, deque
+import errno
+import logging
+import os
+import threading
+import time
+import urlparse
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from gi.repository import Gio
+
+from xl import common
+from xl.trax.track import Track, get_file_mtime
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['TagWriteBatch', 'TagWriter', 'WRITER']
+
+# errors that may be gone when writing again a little later
+_TRANSIENT_ERRORS = (errno.EAGAIN, errno.EBUSY, errno.EINTR, errno.ETIMEDOUT)
+
+
+def _get_device(track):
+    """
+        Returns a key for the device holding the file of a track, so
+        that files on the same device are written one at a time
+    """
+    path = track.local_file_name()
+    if path is not None:
+        try:
+            return os.stat(os.path.dirname(path)).st_dev
+        except OSError:
+            return None
+    return urlparse.urlsplit(track.get_loc_for_io())[:2]
+
+
+class TagWriteBatch(common.ProgressThread):
+    """
+        Writes the tags of a number of tracks, see
+        :meth:`TagWriter.write_tracks`.
+
+        Starting the thread queues the writes. Progress is reported
+        while they are written, and done is emitted once all of them
+        are finished or the batch is stopped.
+    """
+
+    def __init__(self, writer, jobs):
+        common.ProgressThread.__init__(self)
+        self.writer = writer
+        #: (track, tags, key) to write, key is None until the job is
+        #: saved by the writer
+        self.jobs = jobs
+        #: locations of the files that could not be written
+        self.errors = []
+        self.finished = 0
+        self.cancelled = False
+        self.__cond = threading.Condition()
+
+    def stop(self):
+        """
+            Stops the batch. Files that are being written are finished.
+        """
+        with self.__cond:
+            self.cancelled = True
+            self.__cond.notify_all()
+        self.writer._cancel(self)
+        common.ProgressThread.stop(self)
+
+    def run(self):
+        total = len(self.jobs)
+        self.writer._add(self)
+        with self.__cond:
+            while self.finished < total and not self.cancelled:
+                self.__cond.wait()
+                self.emit('progress-update', self.finished * 100 // total)
+            if self.cancelled:
+                return
+        self.emit('done')
+
+    def _job_done(self, track, success):
+        with self.__cond:
+            if not success:
+                self.errors.append(track.get_loc_for_io())
+            self.finished += 1
+            self.__cond.notify_all()
+
+
+class TagWriter(object):
+    """
+        Writes tags in one thread per device, retrying on transient
+        errors. The tags still to be written are saved with their
+        locations, so that writes interrupted by quitting are done on
+        the next start.
+
+        The modification times of the written files are set on the
+        tracks in batches, so the collection does not read them again
+        on its next scan.
+    """
+
+    def __init__(self, retries=3, retry_delay=0.5, mtime_batch=64):
+        """
+            :param retries: how often a write failing with a transient
+                error is tried again
+            :param retry_delay: seconds to wait before the first retry,
+                doubled for every further retry
+            :param mtime_batch: number of written tracks whose
+                modification times are set at once
+        """
+        self.location = None
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.mtime_batch = mtime_batch
+        self.__lock = threading.Lock()
+        # device -> deque of (batch, track, tags, key) to write
+        self.__queues = {}
+        # number of jobs queued or being written
+        self.__unfinished = 0
+        # the file the pending jobs are saved to, opened for appending
+        self.__journal = None
+        self.__next_key = 0
+        self.__mtimes = []
+
+    def write_tracks(self, tracks):
+        """
+            Creates a batch writing the current tags of tracks to their
+            files. Start it, or pass it to a progress monitor.
+
+            :param tracks: the tracks to write
+            :type tracks: list of :class:`xl.trax.Track`
+            :rtype: :class:`TagWriteBatch`
+        """
+        # the tags are taken now, later changes are written by later
+        # batches
+        jobs = [(track, track._pickles(), None) for track in tracks]
+        return TagWriteBatch(self, jobs)
+
+    def load_from_location(self, location):
+        """
+            Sets the file the pending writes are saved to, and writes
+            the tracks that were pending when it was last saved
+
+            The file holds a pickled (key, tags) for every queued job,
+            and a (key, None) once it is written or cancelled.
+
+            :returns: the batch writing the pending tracks, or None
+        """
+        self.location = location
+        pending = OrderedDict()
+        try:
+            with open(location, 'rb') as f:
+                while True:
+                    try:
+                        key, tags = pickle.load(f)
+                    except Exception:
+                        # the end, or a job that was being saved on quitting
+                        break
+                    if tags is None:
+                        pending.pop(key, None)
+                    else:
+                        pending[key] = tags
+        except IOError:
+            return None
+
+        with self.__lock:
+            self.__close(remove=not pending)
+            if not pending:
+                return None
+            self.__next_key = max(self.__next_key, max(pending) + 1)
+            # start a new file, so that jobs are never appended to a
+            # damaged one
+            try:
+                with open(location + '.new', 'wb') as f:
+                    for record in pending.iteritems():
+                        pickle.dump(record, f, common.PICKLE_PROTOCOL)
+                if os.path.exists(location):
+                    os.remove(location)
+                os.rename(location + '.new', location)
+            except (IOError, OSError):
+                logger.exception("Could not save pending tag writes")
+
+        logger.info("Writing tags of %d files left from the last session", len(pending))
+        jobs = []
+        for key, tags in pending.iteritems():
+            track = Track(tags['__loc'])
+            # the collection may not have been saved since the tags were
+            # changed, and won't read them again once they are written
+            track.set_tags(
+                **{tag: value for tag, value in tags.iteritems() if tag[:2] != '__'}
+            )
+            jobs.append((track, tags, key))
+        batch = TagWriteBatch(self, jobs)
+        batch.start()
+        return batch
+
+    def _add(self, batch):
+        with self.__lock:
+            records = []
+            for i, (track, tags, key) in enumerate(batch.jobs):
+                if key is None:
+                    key = self.__next_key
+                    self.__next_key += 1
+                    batch.jobs[i] = (track, tags, key)
+                    records.append((key, tags))
+                device = _get_device(track)
+                queue = self.__queues.get(device)
+                if queue is None:
+                    queue = self.__queues[device] = deque()
+                    thread = threading.Thread(
+                        target=self.__work, args=(device, queue), name='TagWriter'
+                    )
+                    thread.daemon = True
+                    thread.start()
+                queue.append((batch, track, tags, key))
+            self.__unfinished += len(batch.jobs)
+            self.__save(records)
+
+    def _cancel(self, batch):
+        with self.__lock:
+            records = []
+            for queue in self.__queues.itervalues():
+                jobs = []
+                for job in queue:
+                    if job[0] is batch:
+                        records.append((job[3], None))
+                    else:
+                        jobs.append(job)
+                queue.clear()
+                queue.extend(jobs)
+            self.__finish(records)
+
+    def __save(self, records):
+        """
+            Appends records of jobs to the file of pending jobs, must
+            be called with the lock held
+        """
+        if self.location is None or not records:
+            return
+        try:
+            if self.__journal is None:
+                self.__journal = open(self.location, 'ab')
+            for record in records:
+                pickle.dump(record, self.__journal, common.PICKLE_PROTOCOL)
+            self.__journal.flush()
+        except (IOError, OSError):
+            logger.exception("Could not save pending tag writes")
+
+    def __finish(self, records):
+        """
+            Saves that jobs are done, and removes the file of pending
+            jobs once none are left. Must be called with the lock held.
+        """
+        self.__unfinished -= len(records)
+        if self.__unfinished:
+            self.__save(records)
+        else:
+            self.__close(remove=True)
+
+    def __close(self, remove=False):
+        """
+            Closes the file of pending jobs, must be called with the
+            lock held
+
+            :param remove: whether to remove the file
+        """
+        if self.__journal is not None:
+            self.__journal.close()
+            self.__journal = None
+        if remove and self.location is not None:
+            try:
+                os.remove(self.location)
+            except OSError:
+                pass
+
+    def __work(self, device, queue):
+        while True:
+            with self.__lock:
+                if not queue:
+                    del self.__queues[device]
+                    mtimes = self.__take_mtimes(0)
+                    break
+                job = queue.popleft()
+            batch, track, tags, key = job
+            success = self.__write(track, tags)
+            with self.__lock:
+                self.__finish([(key, None)])
+                mtimes = self.__take_mtimes(self.mtime_batch)
+            self.__set_mtimes(mtimes)
+            batch._job_done(track, success)
+        self.__set_mtimes(mtimes)
+
+    def __take_mtimes(self, count):
+        """
+            Returns the collected modification times if there are at
+            least count of them, must be called with the lock held
+        """
+        if len(self.__mtimes) < count:
+            return []
+        mtimes, self.__mtimes = self.__mtimes, []
+        return mtimes
+
+    def __write(self, track, tags):
+        """
+            Writes the tags of a track, returns whether it succeeded
+        """
+        loc = track.get_loc_for_io()
+        for attempt in range(self.retries + 1):
+            try:
+                if not track._write_tags(tags):
+                    return False
+                break
+            except EnvironmentError as e:
+                if e.errno not in _TRANSIENT_ERRORS or attempt == self.retries:
+                    logger.warning("Could not write tags to %s", loc, exc_info=True)
+                    return False
+                time.sleep(self.retry_delay * 2 ** attempt)
+            except Exception:
+                logger.exception("Unknown exception: Could not write tags to %s", loc)
+                return False
+
+        try:
+            mtime = get_file_mtime(
+                Gio.File.new_for_uri(loc).query_info(
+                    "time::modified", Gio.FileQueryInfoFlags.NONE, None
+                )
+            )
+        except Exception:
+            return True
+        with self.__lock:
+            self.__mtimes.append((track, mtime))
+        return True
+
+    def __set_mtimes(self, mtimes):
+        for track, mtime in mtimes:
+            track.set_tags(notify_changed=False, __modified=mtime)
+
+
+#: The tag writer used by Exaile
+WRITER = TagWriter()
+
+
+# vim: et sts=4 sw=4
@@ -25,9 +25,11 @@
 # do so. If you do not wish to do so, delete this exception statement
 # from your version.
 
+from collections import OrderedDict
 from copy import deepcopy
 import logging
 import re
+import threading
 import time
 import unicodedata
 import weakref
@@ -71,58 +73,175 @@ _no_set_raw = {'__basename', '__loc'} | disk_tags
 _unset = object()
 
 
+def get_file_mtime(fileinfo):
+    """
+        Returns the modification time of a file as stored in the
+        ``__modified`` tag
+
+        :param fileinfo: a :class:`Gio.FileInfo` containing
+            ``time::modified``
+    """
+    mtime = fileinfo.get_modification_time()
+    return mtime.tv_sec + (mtime.tv_usec / 100000.0)
+
+
+def read_format_tags(f, loc, mtime):
+    """
+        Reads the tags of a file without modifying any Track, so it
+        can safely be called from worker threads.
+
+        :param f: the Format object for the file, as returned by
+            :func:`xl.metadata.get_format`
+        :param loc: the uri of the file
+        :param mtime: the modification time, see :func:`get_file_mtime`
+        :returns: the tags, suitable for :meth:`Track._set_read_tags`
+    """
+    ntags = f.read_all()
+    ntags['__modified'] = mtime
+
+    # TODO: this probably breaks on non-local files
+    ntags['__basedir'] = Gio.File.new_for_uri(loc).get_parent().get_path()
+    return ntags
+
+
+def _estimate_size(value):
+    """
+        Roughly estimates the memory used by the tags of a mutagen object
+    """
+    if isinstance(value, basestring):
+        return len(value)
+    if hasattr(value, 'items'):
+        return sum(_estimate_size(k) + _estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_size(v) for v in value)
+    # embedded pictures (ID3 APIC, FLAC Picture) keep their data here
+    data = getattr(value, 'data', None)
+    if isinstance(data, basestring):
+        return len(data)
+    text = getattr(value, 'text', None)
+    if text is not None:
+        return _estimate_size(text)
+    return 64
+
+
 class _MetadataCacher(object):
     """
         Cache metadata Format objects to speed up get_tag_disk
+
+        Entries are kept in least recently used order and dropped when
+        they have not been used for timeout seconds, or when the
+        estimated size of all entries exceeds maxsize. The cache can be
+        used from any thread; expired entries are dropped by a timer
+        thread, so this doesn't depend on the main loop.
     """
 
-    def __init__(self, timeout=10, maxentries=20):
+    # estimated size of a Format object without its tags
+    BASE_SIZE = 4096
+
+    def __init__(self, timeout=10, maxsize=32 * 1024 * 1024):
         """
             :param timeout: time (in s) until the cached obj gets removed.
-            :param maxentries: maximum number of format objs to cache
+            :param maxsize: estimated size (in bytes) of the format objs
+                to cache at most
         """
-        self._cache = []
+        # trackobj -> [formatobj, size, last use], least recently used first
+        self._cache = OrderedDict()
+        self._size = 0
         self.timeout = timeout
-        self.maxentries = maxentries
-        self._cleanup_id = None
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._timer = None
 
     def __cleanup(self):
-        if self._cleanup_id:
-            GLib.source_remove(self._cleanup_id)
-            self._cleanup_id = None
+        """
+            Drops expired entries and schedules the next cleanup, must
+            be called with the lock held
+        """
         current = time.time()
         thresh = current - self.timeout
-        for item in self._cache[:]:
-            if item[2] < thresh:
-                self._cache.remove(item)
+        for trackobj, item in self._cache.items():
+            if item[2] >= thresh:
+                break
+            self.__drop(trackobj)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
         if self._cache:
-            next_expiry = min(i[2] for i in self._cache)
-            timeout = int((next_expiry + self.timeout) - current)
-            self._cleanup_id = GLib.timeout_add_seconds(timeout, self.__cleanup)
-
-    def add(self, trackobj, formatobj):
-        for item in self._cache:
-            if item[0] == trackobj:
-                return
-        item = [trackobj, formatobj, time.time()]
-        self._cache.append(item)
-        if len(self._cache) > self.maxentries:
-            least = min((i[2], i) for i in self._cache)[1]
-            self._cache.remove(least)
-        if not self._cleanup_id:
-            self._cleanup_id = GLib.timeout_add_seconds(self.timeout, self.__cleanup)
+            oldest = next(self._cache.itervalues())[2]
+            self._timer = threading.Timer(
+                max(oldest + self.timeout - current, 0), self.__expire
+            )
+            self._timer.daemon = True
+            self._timer.start()
+
+    def __expire(self):
+        with self._lock:
+            self._timer = None
+            self.__cleanup()
+
+    def __drop(self, trackobj):
+        item = self._cache.pop(trackobj)
+        self._size -= item[1]
+
+    def __size(self, formatobj):
+        try:
+            raw = formatobj._get_raw()
+            size = _estimate_size(getattr(raw, 'tags', None) or raw)
+            size += _estimate_size(getattr(raw, 'pictures', []))
+        except Exception:
+            size = 0
+        return self.BASE_SIZE + size
+
+    def add(self, trackobj, formatobj, replace=False):
+        """
+            Caches the format obj of a track
+
+            :param replace: whether to replace a format obj that is
+                already cached for the track, otherwise it is kept
+            :returns: the cached format obj
+        """
+        with self._lock:
+            item = self._cache.get(trackobj)
+            if item is not None:
+                if not replace:
+                    return item[0]
+                self.__drop(trackobj)
+            size = self.__size(formatobj)
+            self._cache[trackobj] = [formatobj, size, time.time()]
+            self._size += size
+            # the newest entry is kept even if it is too large by itself
+            while self._size > self.maxsize and len(self._cache) > 1:
+                self.__drop(next(iter(self._cache)))
+            if self._timer is None:
+                self.__cleanup()
+            return formatobj
 
     def remove(self, trackobj):
-        for item in self._cache:
-            if item[0] == trackobj:
-                self._cache.remove(item)
-                break
+        """
+            Drops the format obj of a track, for example because its
+            file was written
+        """
+        with self._lock:
+            if trackobj in self._cache:
+                self.__drop(trackobj)
+
+    def clear(self):
+        """
+            Drops all cached format objs
+        """
+        with self._lock:
+            self._cache.clear()
+            self._size = 0
+            self.__cleanup()
 
     def get(self, trackobj):
-        for item in self._cache:
-            if item[0] == trackobj:
-                item[2] = time.time()
-                return item[1]
+        with self._lock:
+            item = self._cache.pop(trackobj, None)
+            if item is None:
+                return None
+            item[2] = time.time()
+            self._cache[trackobj] = item
+            return item[0]
 
 
 _CACHER = _MetadataCacher()
@@ -134,9 +253,27 @@ class Track(object):
     """
 
     # save a little memory this way
-    __slots__ = ["__tags", "_scan_valid", "_dirty", "__weakref__", "_init"]
+    __slots__ = [
+        "__tags",
+        "_scan_valid",
+        "_dirty",
+        "__weakref__",
+        "_init",
+        "_sort_keys",
+    ]
     # this is used to enforce the one-track-per-uri rule
     __tracksdict = weakref.WeakValueDictionary()
+
+    # TrackDBs that can supply saved tags for tracks that haven't been
+    # created yet (see TrackDB.load_from_location)
+    __state_sources = weakref.WeakSet()
+    # TrackDBs that are told when a track has changed, so that they
+    # only need to save the changed tracks
+    __dirty_listeners = weakref.WeakSet()
+    # uri -> (track, Event set once it is set up, thread setting it up)
+    # of the tracks being set up by __new__
+    __setups = {}
+    __new_lock = threading.Lock()
     # store a copy of the settings values here - much faster (0.25 cpu
     # seconds) (see _the_cuts_cb)
     __the_cuts = settings.get_option('collection/strip_list', [])
@@ -175,43 +312,93 @@ class Track(object):
 
         if uri is not None:
             uri = Gio.File.new_for_uri(uri).get_uri()
-            try:
-                tr = cls.__tracksdict[uri]
-                tr._init = False
+            # tracks may be created from several threads during startup.
+            # A track is set up by the first thread asking for it, the
+            # others asking for the same uri wait until it is done.
+            while True:
+                with cls.__new_lock:
+                    setup = cls.__setups.get(uri)
+                    if setup is None:
+                        tr = cls.__tracksdict.get(uri)
+                        if tr is None:
+                            tr = object.__new__(cls)
+                            setup = (tr, threading.Event(), threading.current_thread())
+                            cls.__setups[uri] = setup
+                            break
+                        tr._init = False
+                        break
+                tr, ready, thread = setup
+                if thread is threading.current_thread():
+                    # asked for again while setting it up
+                    return tr
+                ready.wait()
+
+            if setup is not None:
+                return cls.__setup_new(tr, setup[1], uri, unpickles, args, kwargs)
+
+            # if the track *does* happen to be pickled in more than one
+            # place, then we need to preserve any internal tags that aren't
+            # persisted to disk.
+            #
+            # See https://bugs.launchpad.net/exaile/+bug/1054637
+            if unpickles is None:
+                if len(args) > 2:
+                    unpickles = args[2]
+                else:
+                    unpickles = kwargs.get("_unpickles")
 
-                # if the track *does* happen to be pickled in more than one
-                # place, then we need to preserve any internal tags that aren't
-                # persisted to disk.
-                #
-                # See https://bugs.launchpad.net/exaile/+bug/1054637
-                if unpickles is None:
-                    if len(args) > 2:
-                        unpickles = args[2]
-                    else:
-                        unpickles = kwargs.get("_unpickles")
-
-                if unpickles is not None:
-                    tags = tr.list_tags()
-                    to_set = {
-                        tag: values
-                        for tag, values in unpickles.iteritems()
-                        if tag.startswith('__') and tag not in tags
-                    }
-                    if to_set:
-                        tr.set_tags(**to_set)
+            if unpickles is not None:
+                tags = tr.list_tags()
+                to_set = {
+                    tag: values
+                    for tag, values in unpickles.iteritems()
+                    if tag.startswith('__') and tag not in tags
+                }
+                if to_set:
+                    tr.set_tags(**to_set)
 
-            except KeyError:
-                tr = object.__new__(cls)
-                cls.__tracksdict[uri] = tr
-                tr._init = True
             return tr
         else:
-            # this should always fail in __init__, and will never be
+            # this should always fail in __setup, and will never be
             # called in well-formed code.
             tr = object.__new__(cls)
-            tr._init = True
+            tr.__setup(*args, **kwargs)
             return tr
 
+    @classmethod
+    def __setup_new(cls, tr, ready, uri, unpickles, args, kwargs):
+        """
+            Sets up a new track for __new__, then makes it available to
+            the threads waiting for it
+        """
+        success = False
+        try:
+            # use the tags saved in a TrackDB instead of scanning
+            state = None
+            if unpickles is None:
+                for source in list(cls.__state_sources):
+                    state = source._get_unloaded_track_state(uri)
+                    if state is not None:
+                        break
+            if state is not None:
+                tr.__setup(_unpickles=state)
+                tr._init = False
+                source._set_loaded_track(uri, tr)
+            else:
+                tr.__setup(*args, **kwargs)
+                tr._init = True
+            success = True
+        finally:
+            with cls.__new_lock:
+                del cls.__setups[uri]
+                if success:
+                    cls.__tracksdict[uri] = tr
+                else:
+                    # don't leave a half set up track to other callers
+                    cls.__tracksdict.pop(uri, None)
+            ready.set()
+        return tr
+
     def __init__(self, uri=None, scan=True, _unpickles=None):
         """
             :param uri: the location, as either a uri or a file path.
@@ -222,12 +409,17 @@ class Track(object):
             :param _unpickles: used internally to restore from a pickled
                 state. not for normal use.
         """
-        # don't re-init if its a reused track. see __new__
-        if self._init is False:
-            return
+        # the track has been set up by __new__ already, see __setup
 
+    def __setup(self, uri=None, scan=True, _unpickles=None):
+        """
+            Sets up a new track, called by __new__. See __init__ for
+            the parameters.
+        """
         self.__tags = {}
         self._scan_valid = None  # whether our last tag read attempt worked
+        # cached get_tag_sort values, see get_tag_sort
+        self._sort_keys = None
 
         # This is not used by write_tags, this is used by the collection to
         # indicate that the tags haven't been written to the collection
@@ -270,6 +462,7 @@ class Track(object):
         self.__unregister()
         gloc = Gio.File.new_for_commandline_arg(loc)
         self.__tags['__loc'] = gloc.get_uri()
+        self._sort_keys = None
         self.__register()
         if notify_changed:
             event.log_event('track_tags_changed', self, {'__loc'})
@@ -351,18 +544,7 @@ class Track(object):
             `xl.metadata` otherwise.
         """
         try:
-            f = metadata.get_format(self.get_loc_for_io())
-            if f is None:
-                return False  # not a supported type
-            f.write_tags(self.__tags)
-
-            # now that we've written the tags to disk, remove any tags that the
-            # user asked to be deleted
-            to_remove = [k for k, v in self.__tags.iteritems() if v is None]
-            for rm in to_remove:
-                self.__tags.pop(rm)
-
-            return f
+            return self._write_tags(self.__tags)
         except IOError:
             # error writing to the file, probably
             logger.warning("Could not write tags to file", exc_info=True)
@@ -371,12 +553,39 @@ class Track(object):
             logger.exception("Unknown exception: Could not write tags to file")
             return False
 
-    def read_tags(self, force=True, notify_changed=True):
+    def _write_tags(self, tags):
+        """
+            Writes tags to the file for this Track, raising any error.
+            Internal API, see :meth:`write_tags`.
+
+            :param tags: the tags to write, the tags of this Track or
+                a copy of them
+        """
+        f = metadata.get_format(self.get_loc_for_io())
+        if f is None:
+            return False  # not a supported type
+        f.write_tags(tags)
+
+        # now that we've written the tags to disk, remove any tags that the
+        # user asked to be deleted
+        to_remove = [k for k, v in tags.iteritems() if v is None]
+        for rm in to_remove:
+            if rm in self.__tags and self.__tags[rm] is None:
+                self.__tags.pop(rm)
+
+        # the written Format already has the new tags, so later reads
+        # of disk tags don't need to open the file again
+        _CACHER.add(self, f, replace=True)
+        return f
+
+    def read_tags(self, force=True, notify_changed=True, mtime=None):
         """
             Reads tags from the file for this Track.
             
             :param force: If not True, then only read the tags if the file has
                           be modified.
+            :param mtime: The modification time of the file as returned by
+                          :func:`get_file_mtime`, if already known
 
             Returns False if unsuccessful, and a Format object from
             `xl.metadata` otherwise.
@@ -389,47 +598,53 @@ class Track(object):
                 return False  # not a supported type
 
             # Retrieve file specific metadata
-            gloc = Gio.File.new_for_uri(loc)
-            mtime = gloc.query_info(
-                "time::modified", Gio.FileQueryInfoFlags.NONE, None
-            ).get_modification_time()
-            mtime = mtime.tv_sec + (mtime.tv_usec / 100000.0)
+            if mtime is None:
+                mtime = get_file_mtime(
+                    Gio.File.new_for_uri(loc).query_info(
+                        "time::modified", Gio.FileQueryInfoFlags.NONE, None
+                    )
+                )
 
             if not force and self.__tags.get('__modified', 0) >= mtime:
                 return f
 
-            # Read the tags
-            ntags = f.read_all()
-            ntags['__modified'] = mtime
+            self._set_read_tags(f, read_format_tags(f, loc, mtime), notify_changed)
+            return f
+        except Exception:
+            self._scan_valid = False
+            logger.exception("Error reading tags for %s", loc)
+            return False
 
-            # TODO: this probably breaks on non-local files
-            ntags['__basedir'] = gloc.get_parent().get_path()
+    def _set_read_tags(self, f, ntags, notify_changed=True):
+        """
+            Applies tags returned by :func:`read_format_tags`
 
-            # remove tags that could be in the file, but are in fact not
-            # in the file. Retain tags in the DB that aren't supported by
-            # the file format.
+            :param f: the Format object the tags were read with
+            :param ntags: the tags read from the file
+        """
+        # the file has changed, a cached Format has the old tags
+        _CACHER.remove(self)
 
-            nkeys = set(ntags.keys())
-            ekeys = {k for k in self.__tags.keys() if not k.startswith('__')}
+        # remove tags that could be in the file, but are in fact not
+        # in the file. Retain tags in the DB that aren't supported by
+        # the file format.
 
-            # delete anything that wasn't in the new tags
-            to_del = ekeys - nkeys
+        nkeys = set(ntags.keys())
+        ekeys = {k for k in self.__tags.keys() if not k.startswith('__')}
 
-            # but if not others set, only delete supported tags
-            if not f.others:
-                to_del &= set(f.tag_mapping.keys())
+        # delete anything that wasn't in the new tags
+        to_del = ekeys - nkeys
 
-            for tag in to_del:
-                ntags[tag] = None
+        # but if not others set, only delete supported tags
+        if not f.others:
+            to_del &= set(f.tag_mapping.keys())
 
-            self.set_tags(notify_changed=notify_changed, **ntags)
+        for tag in to_del:
+            ntags[tag] = None
 
-            self._scan_valid = True
-            return f
-        except Exception:
-            self._scan_valid = False
-            logger.exception("Error reading tags for %s", loc)
-            return False
+        self.set_tags(notify_changed=notify_changed, **ntags)
+
+        self._scan_valid = True
 
     def is_local(self):
         """
@@ -475,6 +690,7 @@ class Track(object):
             internal use only please
         """
         self.__tags = deepcopy(pickle_obj)
+        self._sort_keys = None
 
     def list_tags(self):
         """
@@ -568,6 +784,11 @@ class Track(object):
 
         if changed:
             self._dirty = True
+            for listener in list(self.__dirty_listeners):
+                listener._track_dirty(self)
+            # replaced rather than cleared, so that a sort key computed
+            # concurrently from the old values is never cached
+            self._sort_keys = None
             if notify_changed:
                 event.log_event("track_tags_changed", self, changed)
 
@@ -610,7 +831,30 @@ class Track(object):
                 tag=="albumartist".
             :param extend_title: If the title tag is unknown, try to
                 add some identifying information to it.
+
+            Joined values are cached until the tags of the track or
+            the ``collection/strip_list`` option change.
         """
+        if not join:
+            return self._get_tag_sort(tag, join, artist_compilations)
+
+        # artist_compilations only affects albumartist
+        key = tag
+        if artist_compilations and tag == 'albumartist':
+            key = '\0albumartist'
+
+        cache = self._sort_keys
+        if cache is None:
+            cache = self._sort_keys = {}
+        else:
+            try:
+                return cache[key]
+            except KeyError:
+                pass
+        value = cache[key] = self._get_tag_sort(tag, join, artist_compilations)
+        return value
+
+    def _get_tag_sort(self, tag, join, artist_compilations):
         # The two magic values here are to ensure that compilations
         # and unknown values are always sorted below all normal
         # values.
@@ -822,7 +1066,8 @@ class Track(object):
                 return None
             if not f:
                 return None
-        _CACHER.add(self, f)
+            # another thread may have opened the file meanwhile
+            f = _CACHER.add(self, f)
         return f
 
     def get_tag_disk(self, tag):
@@ -1054,6 +1299,8 @@ class Track(object):
         """
         if data == "collection/strip_list":
             cls._Track__the_cuts = settings.get_option('collection/strip_list', [])
+            for track in cls._Track__tracksdict.values():
+                track._sort_keys = None
 
     ### Utility method intended for TrackDB ###
 
@@ -1062,5 +1309,22 @@ class Track(object):
         '''Internal API, returns number of track objects we have'''
         return len(cls._Track__tracksdict)
 
+    @classmethod
+    def _add_state_source(cls, trackdb):
+        '''
+            Internal API, registers a TrackDB that creates its tracks lazily.
+            The TrackDB is only weakly referenced.
+        '''
+        cls._Track__state_sources.add(trackdb)
+
+    @classmethod
+    def _add_dirty_listener(cls, trackdb):
+        '''
+            Internal API, registers a TrackDB whose _track_dirty method
+            is called whenever the tags of a track change.
+            The TrackDB is only weakly referenced.
+        '''
+        cls._Track__dirty_listeners.add(trackdb)
+
 
 event.add_callback(Track._the_cuts_cb, 'collection_option_set')
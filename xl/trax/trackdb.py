@@ -27,22 +27,29 @@
 from __future__ import absolute_import
 
 import logging
+import os
+import threading
 
 from copy import deepcopy
 
-from xl import common, event
+from xl import common, event, settings
 from xl.nls import gettext as _
 
 from xl.trax.track import Track
 from xl.trax.util import sort_tracks
-from xl.trax.search import search_tracks_from_string
+from xl.trax.search import search_tracks_from_string, _intersect_candidates
+from xl.trax.index import TrackSearchIndex
+from xl.trax.snapshot import TrackSnapshot, SnapshotError, write_snapshot
 
-from time import time
+import time
 
 logger = logging.getLogger(__name__)
 
 
 class TrackHolder(object):
+    # whether _track has been created, see _SnapshotTrackHolder
+    _loaded = True
+
     def __init__(self, track, key, **kwargs):
         self._track = track
         self._key = key
@@ -52,6 +59,42 @@ class TrackHolder(object):
         return getattr(self._track, attr)
 
 
+class _SnapshotTrackHolder(TrackHolder):
+    """
+        A TrackHolder whose Track is only created from a
+        :class:`xl.trax.snapshot.TrackSnapshot` when it is first accessed
+    """
+
+    def __init__(self, snapshot, row, key):
+        self._snapshot = snapshot
+        self._row = row
+        self._key = key
+        self._holder_track = None
+        self._holder_attrs = None
+
+    @property
+    def _loaded(self):
+        return self._holder_track is not None
+
+    @property
+    def _track(self):
+        if self._holder_track is None:
+            self._holder_track = Track(_unpickles=self._snapshot.get_state(self._row))
+        return self._holder_track
+
+    @property
+    def _attrs(self):
+        if self._holder_attrs is None:
+            self._holder_attrs = self._snapshot.get_attrs(self._row)
+        return self._holder_attrs
+
+    def _get_state(self):
+        """
+            Returns the saved tags without creating the Track
+        """
+        return self._snapshot.get_state(self._row)
+
+
 class TrackDBIterator(object):
     def __init__(self, track_iterator):
         self.iter = track_iterator
@@ -104,12 +147,23 @@ class TrackDB(object):
         self._dirty = False
         self.tracks = {}  # key is always URI of the track
         self.pickle_attrs = pickle_attrs
-        self.pickle_attrs += ['tracks', 'name', '_key']
+        self.pickle_attrs += ['tracks', 'name', '_key', '_serial']
         self._saving = False
         self._key = 0
+        # incremented on every save, ties a snapshot to the saved state
+        self._serial = 0
+        self._snapshot_serial = None
         self._dbversion = 2.0
         self._dbminorversion = 0
         self._deleted_keys = []
+        # locations of the tracks changed since the last save
+        self._dirty_tracks = set()
+        self._dirty_lock = threading.Lock()
+        self._index = TrackSearchIndex()
+        self._index.set_tracks(self._get_index_tracks)
+        Track._add_state_source(self)
+        Track._add_dirty_listener(self)
+        event.add_callback(self._on_track_tags_changed, 'track_tags_changed')
         if location:
             self.load_from_location()
             self._timeout_save()
@@ -201,9 +255,21 @@ class TrackDB(object):
                     self, pdata, pdata['_dbversion'], self._dbversion
                 )
 
+        snapshot = None
+        if 'tracks' in self.pickle_attrs:
+            snapshot = self._open_snapshot(location, pdata.get('_serial', 0))
+
         for attr in self.pickle_attrs:
             try:
-                if 'tracks' == attr:
+                if 'tracks' == attr and snapshot is not None:
+                    data = {}
+                    keys = snapshot.get_keys()
+                    for row, loc in enumerate(snapshot.get_locations()):
+                        if loc is None or loc in data:
+                            continue
+                        data[loc] = _SnapshotTrackHolder(snapshot, row, keys[row])
+                    setattr(self, attr, data)
+                elif 'tracks' == attr:
                     data = {}
                     for k in (x for x in pdata.keys() if x.startswith("tracks-")):
                         p = pdata[k]
@@ -226,24 +292,139 @@ class TrackDB(object):
 
         pdata.close()
 
+        self._index.set_tracks(self._get_index_tracks)
         self._dirty = False
 
+        if snapshot is not None:
+            self._snapshot_serial = self._serial
+        elif 'tracks' in self.pickle_attrs:
+            # the slow path was taken, make sure the next load is fast
+            self.save_snapshot(location)
+
+        if settings.get_option('collection/precompute_sort_keys', False):
+            self.precompute_sort_keys()
+
+    def precompute_sort_keys(self, tags=common.BASE_SORT_TAGS):
+        """
+            Fills the sort value cache of every track for the given
+            tags, see :meth:`xl.trax.Track.get_tag_sort`
+
+            .. note:: This loads every track of a snapshot
+        """
+        for holder in self.tracks.values():
+            track = holder._track
+            for tag in tags:
+                track.get_tag_sort(tag)
+                if tag == 'albumartist':
+                    track.get_tag_sort(tag, artist_compilations=True)
+
+    def _get_index_tracks(self):
+        return [holder._track for holder in self.tracks.values()]
+
+    def _get_snapshot_location(self, location):
+        return location + '.snapshot'
+
+    def _open_snapshot(self, location, serial):
+        """
+            Opens the snapshot belonging to a DB location, if it matches
+            the saved state of the DB
+
+            :returns: a :class:`xl.trax.snapshot.TrackSnapshot` or None
+        """
+        path = self._get_snapshot_location(location)
+        if not os.path.exists(path):
+            return None
+        try:
+            snapshot = TrackSnapshot(path)
+        except (SnapshotError, EnvironmentError):
+            logger.warning("Ignoring unreadable DB snapshot %s", path, exc_info=True)
+            return None
+        if snapshot.serial != serial:
+            logger.info("DB snapshot %s is outdated, not using it", path)
+            snapshot.close()
+            return None
+        logger.debug("Loading %s tracks from snapshot %s", snapshot.count, path)
+        return snapshot
+
+    @common.synchronized
+    def save_snapshot(self, location=None):
+        """
+            Saves the tracks to a snapshot next to the DB location, which
+            allows the next load to skip unpickling every single track.
+
+            The DB is saved first if necessary. Nothing is written if the
+            existing snapshot is current.
+
+            :param location: the location of the DB
+            :type location: string
+        """
+        if not location:
+            location = self.location
+        if not location:
+            raise AttributeError(_("You did not specify a location to save the db"))
+
+        self.save_to_location(location)
+        if self._snapshot_serial == self._serial:
+            return
+
+        entries = []
+        for holder in self.tracks.values():
+            if holder._loaded:
+                state = holder._track._pickles()
+            else:
+                state = holder._get_state()
+            entries.append((state, holder._key, holder._attrs))
+
+        path = self._get_snapshot_location(location)
+        logger.debug("Saving %s DB snapshot to %s.", self.name, path)
+        try:
+            write_snapshot(path, self._serial, entries)
+        except Exception:
+            logger.exception("Failed to save DB snapshot %s", path)
+            return
+        self._snapshot_serial = self._serial
+
+    def _get_unloaded_track_state(self, loc):
+        """
+            Returns the saved tags of a track in this DB that has not been
+            created yet, so :class:`Track` does not need to scan it.
+        """
+        holder = self.tracks.get(loc)
+        if holder is not None and not holder._loaded:
+            return holder._get_state()
+        return None
+
+    def _set_loaded_track(self, loc, track):
+        """
+            Called by :class:`Track` after creating a track from
+            :meth:`_get_unloaded_track_state`
+        """
+        holder = self.tracks.get(loc)
+        if holder is not None and not holder._loaded:
+            holder._holder_track = track
+
+    def _track_dirty(self, track):
+        """
+            Called by :class:`Track` when the tags of a track change
+        """
+        loc = track.get_loc_for_io()
+        if loc in self.tracks:
+            with self._dirty_lock:
+                self._dirty_tracks.add(loc)
+
     @common.synchronized
     def save_to_location(self, location=None):
         """
             Saves a pickled representation of this :class:`TrackDB` to the
             specified location.
 
+            Only the tracks that changed since the last save are written,
+            unless the location does not contain this DB yet.
+
             :param location: the location to save the data to
             :type location: string
         """
-        if not self._dirty:
-            for track in self.tracks.itervalues():
-                if track._track._dirty:
-                    self._dirty = True
-                    break
-
-        if not self._dirty:
+        if not self._dirty and not self._dirty_tracks:
             return
 
         if not location:
@@ -256,6 +437,7 @@ class TrackDB(object):
         self._saving = True
 
         logger.debug("Saving %s DB to %s.", self.name, location)
+        start = time.time()
 
         try:
             pdata = common.open_shelf(location)
@@ -263,19 +445,64 @@ class TrackDB(object):
                 raise common.VersionError("DB was created on a newer Exaile.")
         except Exception:
             logger.exception("Failed to open music DB for writing.")
+            self._saving = False
             return
 
+        with self._dirty_lock:
+            dirty, self._dirty_tracks = self._dirty_tracks, set()
+        try:
+            if '_dbversion' not in pdata:
+                dirty = self.tracks.keys()
+            self.__write_shelf(pdata, dirty)
+        except Exception:
+            logger.exception("Failed to save music DB.")
+            # the changed tracks are written by the next save
+            with self._dirty_lock:
+                self._dirty_tracks |= set(dirty)
+            return
+        finally:
+            try:
+                pdata.close()
+            except Exception:
+                logger.exception("Failed to close music DB.")
+            self._saving = False
+
+        self._dirty = False
+        logger.debug(
+            "Saved %d changed tracks of %s DB in %.1f ms",
+            len(dirty),
+            self.name,
+            (time.time() - start) * 1000,
+        )
+
+    def __write_shelf(self, pdata, dirty):
+        """
+            Writes the changed tracks and the other attributes to an
+            open shelf, see :meth:`save_to_location`
+        """
+        # Invalidate any snapshot before writing tracks, so a snapshot is
+        # never mistaken for a partially written DB
+        self._serial += 1
+        pdata['_serial'] = self._serial
+        pdata.sync()
+
         for attr in self.pickle_attrs:
             # bad hack to allow saving of lists/dicts of Tracks
             if 'tracks' == attr:
-                for k, track in self.tracks.iteritems():
-                    key = "tracks-%s" % track._key
-                    if track._track._dirty or key not in pdata:
-                        pdata[key] = (
-                            track._track._pickles(),
-                            track._key,
-                            deepcopy(track._attrs),
-                        )
+                for loc in dirty:
+                    holder = self.tracks.get(loc)
+                    if holder is None:
+                        continue
+                    if holder._loaded:
+                        state = holder._track._pickles()
+                        holder._track._dirty = False
+                    else:
+                        state = holder._get_state()
+                    pdata["tracks-%s" % holder._key] = (
+                        state,
+                        holder._key,
+                        holder._attrs,
+                    )
             else:
                 pdata[attr] = deepcopy(getattr(self, attr))
 
@@ -287,13 +514,24 @@ class TrackDB(object):
                 del pdata[key]
 
         pdata.sync()
-        pdata.close()
+        del self._deleted_keys[:]
 
-        for track in self.tracks.itervalues():
-            track._track._dirty = False
+    def _on_track_tags_changed(self, type, track, tags):
+        """
+            Keeps the search index current
+        """
+        self._index.update_track(track, tags)
 
-        self._dirty = False
-        self._saving = False
+    def get_search_candidates(self, trackmatchers):
+        """
+            Uses the search index to find the tracks that may match all
+            of the given matchers. Used by :func:`xl.trax.search_tracks`.
+
+            :param trackmatchers: A list of TrackMatcher objects
+            :returns: a set of :class:`xl.trax.Track`, or None if the
+                index cannot narrow down the search
+        """
+        return _intersect_candidates(trackmatchers, self._index)
 
     def get_track_by_loc(self, loc, raw=False):
         """
@@ -307,10 +545,15 @@ class TrackDB(object):
 
     def get_tracks_by_locs(self, locs):
         """
-            returns the track having the given loc. if no such track exists,
-            returns None
+            returns the tracks having the given locs, in the same order.
+            locs without a track give None.
         """
-        return [self.get_track_by_loc(loc) for loc in locs]
+        holders = self.tracks
+        tracks = []
+        for loc in locs:
+            holder = holders.get(loc)
+            tracks.append(None if holder is None else holder._track)
+        return tracks
 
     def loc_is_member(self, loc):
         """
@@ -340,7 +583,8 @@ class TrackDB(object):
             Like add(), but takes a list of :class:`xl.trax.Track`
         """
         locations = []
-        now = time()
+        added = []
+        now = time.time()
         for tr in tracks:
             if not tr.get_tag_raw('__date_added'):
                 tr.set_tags(__date_added=now)
@@ -349,9 +593,15 @@ class TrackDB(object):
             if location in self.tracks:
                 continue
             locations += [location]
+            added.append(tr)
             self.tracks[location] = TrackHolder(tr, self._key)
             self._key += 1
 
+        with self._dirty_lock:
+            self._dirty_tracks.update(locations)
+
+        self._index.add_tracks(added)
+
         if locations:
             event.log_event('tracks_added', self, locations)
             self._dirty = True
@@ -377,6 +627,11 @@ class TrackDB(object):
             self._deleted_keys.append(self.tracks[location]._key)
             del self.tracks[location]
 
+        with self._dirty_lock:
+            self._dirty_tracks.difference_update(locations)
+
+        self._index.remove_tracks(tracks)
+
         event.log_event('tracks_removed', self, locations)
 
         self._dirty = True
@@ -112,12 +112,18 @@ def sort_tracks(fields, iter, trackfunc=None, reverse=False, artist_compilations
         :type reverse: boolean
     """
     fields = list(fields)  # we need the index method
+    # Track.get_tag_sort caches its values, so building the keys is
+    # mostly dict lookups
     if trackfunc is None:
-        trackfunc = lambda tr: tr
-    keyfunc = lambda tr: [
-        trackfunc(tr).get_tag_sort(field, artist_compilations=artist_compilations)
-        for field in fields
-    ]
+        keyfunc = lambda tr: [
+            tr.get_tag_sort(field, artist_compilations=artist_compilations)
+            for field in fields
+        ]
+    else:
+        keyfunc = lambda tr: [
+            trackfunc(tr).get_tag_sort(field, artist_compilations=artist_compilations)
+            for field in fields
+        ]
     return sorted(iter, key=keyfunc, reverse=reverse)
 
 
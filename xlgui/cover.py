@@ -64,6 +64,127 @@ def save_pixbuf(pixbuf, path, type_):
     pixbuf.savev(path, type_, [None], [])
 
 
+class CoverPixbufCache(object):
+    """
+        Keeps recently used covers in memory, decoded and scaled to
+        the sizes they are displayed at
+
+        Scaled down versions of cached covers are also stored on disk
+        by the core cover manager, so they only need to be scaled once.
+    """
+
+    def __init__(self, limit=256):
+        """
+            :param limit: the maximum number of pixbufs to keep
+        """
+        self.__cache = common.LimitedCache(limit)
+        self.__lock = threading.Lock()
+
+        event.add_callback(self.on_cover_changed, 'cover_set')
+        event.add_callback(self.on_cover_changed, 'cover_removed')
+
+    def __get_cached(self, key):
+        with self.__lock:
+            try:
+                return self.__cache[key]
+            except KeyError:
+                return None
+
+    def __set_cached(self, key, pixbuf):
+        with self.__lock:
+            self.__cache[key] = pixbuf
+
+    def get_pixbuf(self, db_string, size):
+        """
+            Gets a cover scaled to fit a size
+
+            :param db_string: the db_string identifying the cover
+            :param size: the (width, height) to fit the cover into
+            :returns: the cover, or None if the cover cannot be loaded
+            :rtype: :class:`GdkPixbuf.Pixbuf`
+        """
+        key = (db_string, size)
+        pixbuf = self.__get_cached(key)
+        if pixbuf is not None:
+            return pixbuf
+
+        data = COVER_MANAGER.get_thumbnail_data(db_string, size)
+        if data is not None:
+            pixbuf = pixbuf_from_data(data)
+
+        if pixbuf is None:
+            data = COVER_MANAGER.get_cover_data(db_string)
+            pixbuf = pixbuf_from_data(data, size)
+            if pixbuf is None:
+                return None
+            try:
+                thumbnail = pixbuf.save_to_bufferv('png', [], [])[1]
+            except GLib.Error as e:
+                logger.warning('Failed to store cover thumbnail: %s', e.message)
+            else:
+                COVER_MANAGER.set_thumbnail_data(db_string, size, thumbnail)
+
+        self.__set_cached(key, pixbuf)
+        return pixbuf
+
+    def get_track_pixbuf(self, track, size):
+        """
+            Gets the cover that has been set for a track, see
+            :meth:`get_pixbuf`
+        """
+        db_string = COVER_MANAGER.get_db_string(track)
+        if db_string is None:
+            return None
+        return self.get_pixbuf(db_string, size)
+
+    def get_default_pixbuf(self, size=None):
+        """
+            Gets the cover to show if there is no cover
+
+            :param size: the (width, height) to fit the cover into, None
+                for the native size
+        """
+        key = (None, size)
+        pixbuf = self.__get_cached(key)
+        if pixbuf is None:
+            pixbuf = pixbuf_from_data(COVER_MANAGER.get_default_cover(), size)
+            self.__set_cached(key, pixbuf)
+        return pixbuf
+
+    @common.threaded
+    def prefetch(self, tracks, size):
+        """
+            Loads the covers of tracks in the background, so they
+            are in memory by the time they are displayed
+
+            :param tracks: the tracks to load the covers of
+            :param size: the (width, height) to fit the covers into
+        """
+        db_strings = []
+        for track in tracks:
+            db_string = COVER_MANAGER.get_db_string(track)
+            if db_string is not None and db_string not in db_strings:
+                db_strings.append(db_string)
+
+        for db_string in db_strings:
+            self.get_pixbuf(db_string, size)
+
+    def on_cover_changed(self, type, manager, track):
+        """
+            Drops covers whose data may have changed
+        """
+        # The data of sources other than the cover cache (e.g. local
+        # files) can change without their db_string changing
+        with self.__lock:
+            for key in self.__cache.keys():
+                if key[0] is not None and not key[0].startswith('cache:'):
+                    del self.__cache[key]
+
+
+#: The singleton :class:`CoverPixbufCache` instance
+PIXBUF_CACHE = CoverPixbufCache()
+
+
 class CoverManager(GObject.GObject):
     """
         Cover manager window
@@ -97,9 +218,7 @@ class CoverManager(GObject.GObject):
         self.outstanding_text = _('{outstanding} covers left to fetch')
         self.completed_text = _('All covers fetched')
         self.cover_size = (90, 90)
-        self.default_cover_pixbuf = pixbuf_from_data(
-            COVER_MANAGER.get_default_cover(), self.cover_size
-        )
+        self.default_cover_pixbuf = PIXBUF_CACHE.get_default_pixbuf(self.cover_size)
 
         builder = Gtk.Builder()
         builder.add_from_file(xdg.get_data_path('ui', 'covermanager.ui'))
@@ -170,7 +289,7 @@ class CoverManager(GObject.GObject):
 
         outstanding = []
         # Speed up the following loop
-        get_cover = COVER_MANAGER.get_cover
+        get_track_pixbuf = PIXBUF_CACHE.get_track_pixbuf
         default_cover_pixbuf = self.default_cover_pixbuf
         cover_size = self.cover_size
 
@@ -180,14 +299,9 @@ class CoverManager(GObject.GObject):
             if self.stopper.is_set():
                 return
 
-            cover_data = get_cover(self.album_tracks[album][0], set_only=True)
-            cover_pixbuf = pixbuf_from_data(cover_data) if cover_data else None
+            thumbnail_pixbuf = get_track_pixbuf(self.album_tracks[album][0], cover_size)
 
-            try:
-                thumbnail_pixbuf = cover_pixbuf.scale_simple(
-                    *cover_size, interp_type=GdkPixbuf.InterpType.BILINEAR
-                )
-            except AttributeError:  # cover_pixbuf is None
+            if thumbnail_pixbuf is None:
                 thumbnail_pixbuf = default_cover_pixbuf
                 outstanding.append(album)
 
@@ -526,6 +640,7 @@ class CoverWidget(Gtk.EventBox):
 
         self.image = image
         self.cover_data = None
+        self.__has_cover = False
         self.menu = CoverMenu(self)
         self.menu.attach_to_widget(self)
 
@@ -568,6 +683,13 @@ class CoverWidget(Gtk.EventBox):
         @common.threaded
         def __get_cover():
 
+            width = settings.get_option('gui/cover_width', 100)
+            pixbuf = PIXBUF_CACHE.get_track_pixbuf(track, (width, width))
+
+            if pixbuf is not None:
+                GLib.idle_add(self.on_cover_pixbuf_found, track, pixbuf)
+                return
+
             fetch = not settings.get_option('covers/automatic_fetching', True)
             cover_data = COVER_MANAGER.get_cover(track, set_only=fetch)
 
@@ -579,11 +701,20 @@ class CoverWidget(Gtk.EventBox):
         if track is not None:
             __get_cover()
 
+    def get_cover_data(self):
+        """
+            Gets the raw image data of the current cover, loading it
+            if only the scaled cover has been loaded so far
+        """
+        if self.cover_data is None and self.__has_cover:
+            self.cover_data = COVER_MANAGER.get_cover(self.__track, set_only=True)
+        return self.cover_data
+
     def show_cover(self):
         """
             Shows the current cover
         """
-        if not self.cover_data:
+        if not self.get_cover_data():
             return
 
         pixbuf = pixbuf_from_data(self.cover_data)
@@ -624,10 +755,11 @@ class CoverWidget(Gtk.EventBox):
 
         self.drag_dest_unset()
 
-        pixbuf = pixbuf_from_data(COVER_MANAGER.get_default_cover())
+        pixbuf = PIXBUF_CACHE.get_default_pixbuf()
         self.image.set_from_pixbuf(pixbuf)
         self.set_drag_source_enabled(False)
         self.cover_data = None
+        self.__has_cover = False
 
         self.emit('cover-found', None)
 
@@ -696,7 +828,7 @@ class CoverWidget(Gtk.EventBox):
         if self.filename is None:
             self.filename = tempfile.mkstemp(prefix='exaile_cover_')[1]
 
-        pixbuf = pixbuf_from_data(self.cover_data)
+        pixbuf = pixbuf_from_data(self.get_cover_data())
         save_pixbuf(pixbuf, self.filename, 'png')
         selection.set_uris([Gio.File.new_for_path(self.filename).get_uri()])
 
@@ -743,6 +875,22 @@ class CoverWidget(Gtk.EventBox):
         self.image.set_from_pixbuf(pixbuf)
         self.set_drag_source_enabled(True)
         self.cover_data = cover_data
+        self.__has_cover = True
+
+        self.emit('cover-found', pixbuf)
+
+    def on_cover_pixbuf_found(self, track, pixbuf):
+        """
+            Called when the scaled cover of a track has been loaded
+        """
+        if self.__track != track:
+            return
+
+        self.image.set_from_pixbuf(pixbuf)
+        self.set_drag_source_enabled(True)
+        # The full cover is only loaded when it is needed
+        self.cover_data = None
+        self.__has_cover = True
 
         self.emit('cover-found', pixbuf)
 
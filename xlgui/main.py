@@ -38,7 +38,7 @@ from xlgui.accelerators import Accelerator
 from xlgui.playlist_container import PlaylistContainer
 from xlgui.widgets import dialogs, info, menu, playback
 from xlgui.widgets.playlist import PlaylistPage, PlaylistView
-from xlgui import guiutil, tray, menu as mainmenu
+from xlgui import cover, guiutil, tray, menu as mainmenu
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +48,9 @@ SEEK_STEP_DEFAULT = 10
 # Length of volume steps when user presses up/down key
 VOLUME_STEP_DEFAULT = 0.1
 
+# Number of upcoming tracks to load the covers of on playback start
+COVER_PREFETCH_COUNT = 20
+
 
 class MainWindow(GObject.GObject):
     """
@@ -928,6 +931,15 @@ class MainWindow(GObject.GObject):
         self.playpause_button.set_image(self.pause_image)
         self.playpause_button.set_tooltip_text(_('Pause Playback'))
 
+        # Load the covers of the upcoming tracks before they are needed
+        playlist = player.QUEUE.current_playlist
+        if playlist is not None:
+            start = max(playlist.current_position, 0)
+            width = settings.get_option('gui/cover_width', 100)
+            cover.PIXBUF_CACHE.prefetch(
+                playlist[start : start + COVER_PREFETCH_COUNT], (width, width)
+            )
+
     def on_playback_end(self, type, player, object):
         """
             Called when playback ends
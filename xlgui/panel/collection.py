@@ -158,6 +158,130 @@ DEFAULT_ORDERS = [
 ]
 
 
+def _bisect_right(items, key, keyfunc):
+    """
+        Like bisect.bisect_right, for a list sorted by keyfunc
+    """
+    lo, hi = 0, len(items)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key < keyfunc(items[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def _get_sort_key(tags, track):
+    return [track.get_tag_sort(tag) for tag in tags]
+
+
+class CollectionNode(object):
+    """
+        A group of tracks in the collection tree
+
+        The children of a node are grouped from the tracks of the node
+        alone when they are first requested, so loading a subtree never
+        looks at the rest of the collection.
+    """
+
+    __slots__ = ['depth', 'display', 'match_query', 'sort_key', 'tracks', 'children']
+
+    def __init__(self, depth, tracks, display=None, match_query=None, sort_key=None):
+        """
+            :param depth: the level of the node in the Order, -1 for
+                the root node
+            :param tracks: a list of :class:`xl.trax.SearchResultTrack`
+        """
+        self.depth = depth
+        self.display = display
+        self.match_query = match_query
+        self.sort_key = sort_key
+        self.tracks = tracks
+        # None until the children are grouped
+        self.children = None
+
+    def get_children(self, order):
+        """
+            Returns the child nodes, grouping them if necessary
+
+            :raises IndexError: if this node is at the bottom of the tree
+        """
+        if self.children is None:
+            self.children = self._group(order)
+        return self.children
+
+    def _describe(self, order, depth, track):
+        """
+            Returns the display value and the search query of the node
+            a track belongs to
+        """
+        tags = order.get_sort_tags(depth)
+        display = order.format_track(depth, track)
+        match_query = " ".join([track.get_tag_search(t, format=True) for t in tags])
+        if depth == len(order) - 1:
+            match_query += " " + track.get_tag_search("__loc", format=True)
+        return display, match_query
+
+    def _group(self, order):
+        depth = self.depth + 1
+        tags = order.get_sort_tags(depth)
+        srtrs = self.tracks
+        # the root tracks are already sorted by the first level
+        if depth > 0:
+            srtrs = trax.sort_result_tracks(tags, srtrs)
+        bottom = depth == len(order) - 1
+
+        children = []
+        node = None
+        last_val = None
+        for srtr in srtrs:
+            sort_key = _get_sort_key(tags, srtr.track)
+            if node is None or last_val != sort_key or bottom:
+                last_val = sort_key
+                display, match_query = self._describe(order, depth, srtr.track)
+                # Different *sort tags can cause sort values not to match
+                # while the nodes would display identical entries, so only
+                # add nodes that display different results.
+                if (
+                    node is None
+                    or bottom
+                    or match_query != node.match_query
+                    or display != node.display
+                ):
+                    node = CollectionNode(depth, [], display, match_query, sort_key)
+                    children.append(node)
+            node.tracks.append(srtr)
+        return children
+
+    def find_child(self, order, track):
+        """
+            Returns the grouped child a track belongs to, or None
+        """
+        depth = self.depth + 1
+        if depth == len(order) - 1:
+            return None  # every track has its own node
+        display, match_query = self._describe(order, depth, track)
+        for child in self.children:
+            if child.match_query == match_query and child.display == display:
+                return child
+        return None
+
+    def add_child(self, order, track):
+        """
+            Adds an empty child node for a track to the grouped children
+
+            :returns: the index of the new node, and the node
+        """
+        depth = self.depth + 1
+        sort_key = _get_sort_key(order.get_sort_tags(depth), track)
+        display, match_query = self._describe(order, depth, track)
+        node = CollectionNode(depth, [], display, match_query, sort_key)
+        index = _bisect_right(self.children, sort_key, lambda n: n.sort_key)
+        self.children.insert(index, node)
+        return index, node
+
+
 class CollectionPanel(panel.Panel):
     """
         The collection panel
@@ -209,6 +333,8 @@ class CollectionPanel(panel.Panel):
         self.order = None
         self.tracks = []
         self.sorted_tracks = []
+        self._matchers = []
+        self._root = CollectionNode(-1, self.tracks)
 
         event.add_ui_callback(
             self._check_collection_empty, 'libraries_modified', collection
@@ -265,7 +391,7 @@ class CollectionPanel(panel.Panel):
             }
         )
         self.tree.connect('key-release-event', self.on_key_released)
-        event.add_ui_callback(self.refresh_tags_in_tree, 'track_tags_changed')
+        event.add_batch_callback(self.refresh_tags_in_tree, 'track_tags_changed')
         event.add_ui_callback(
             self.refresh_tracks_in_tree, 'tracks_added', self.collection
         )
@@ -422,7 +548,8 @@ class CollectionPanel(panel.Panel):
             (lambda m, i, d: m.get_value(i, 1) is None), None
         )
 
-        self.model = Gtk.TreeStore(GdkPixbuf.Pixbuf, str, object)
+        # image, display value, search query, CollectionNode
+        self.model = Gtk.TreeStore(GdkPixbuf.Pixbuf, str, object, object)
 
         self.tree.connect("row-expanded", self.on_expanded)
 
@@ -430,11 +557,10 @@ class CollectionPanel(panel.Panel):
         """
             finds tracks matching a given iter.
         """
-        self.load_subtree(iter)
-        search = self.get_node_search_terms(iter)
-        matcher = trax.TracksMatcher(search)
-        srtrs = trax.search_tracks(self.tracks, [matcher])
-        return [x.track for x in srtrs]
+        node = self.model.get_value(iter, 3)
+        if node is None:
+            return []
+        return [x.track for x in node.tracks]
 
     def append_to_playlist(self, item=None, event=None, replace=False):
         """
@@ -483,16 +609,181 @@ class CollectionPanel(panel.Panel):
 
         return " ".join(queries)
 
-    def refresh_tags_in_tree(self, type, track, tags):
-        if (
-            settings.get_option('gui/sync_on_tag_change', True)
-            and bool(tags & self.order.all_sort_tags())
-            and self.collection.loc_is_member(track.get_loc_for_io())
-        ):
+    def refresh_tags_in_tree(self, type, changes):
+        if not settings.get_option('gui/sync_on_tag_change', True):
+            return
+        sort_tags = self.order.all_sort_tags()
+        for track, tags in changes:
+            if tags & sort_tags and self.collection.loc_is_member(
+                track.get_loc_for_io()
+            ):
+                self._refresh_tags_in_tree()
+                return
+
+    def refresh_tracks_in_tree(self, type, obj, locs):
+        # Many tracks are added while scanning, reload once it's done
+        if self.collection._scanning or self.order is None:
             self._refresh_tags_in_tree()
+            return
+
+        if type == 'tracks_added':
+            tracks = [self.collection.get_track_by_loc(loc) for loc in locs]
+            self._add_tracks_to_tree([tr for tr in tracks if tr is not None])
+        else:
+            removed = set(locs)
+            self._remove_tracks_from_tree(
+                {tr for tr in self.sorted_tracks if tr.get_loc_for_io() in removed}
+            )
+
+    def _add_tracks_to_tree(self, tracks):
+        """
+            Adds new tracks to the loaded parts of the tree
+        """
+        present = set(self.sorted_tracks)
+        tracks = [tr for tr in tracks if tr not in present]
+        if not tracks:
+            return
+
+        tags = self.order.get_sort_tags(0)
+        keyfunc = lambda tr: _get_sort_key(tags, tr)
+        for tr in tracks:
+            key = keyfunc(tr)
+            self.sorted_tracks.insert(
+                _bisect_right(self.sorted_tracks, key, keyfunc), tr
+            )
+
+        children = len(self._root.children)
+        for srtr in trax.search_tracks(tracks, self._matchers):
+            key = keyfunc(srtr.track)
+            self.tracks.insert(
+                _bisect_right(self.tracks, key, lambda s: keyfunc(s.track)), srtr
+            )
+            self._add_to_node(self._root, None, srtr)
+
+        if children != len(self._root.children):
+            self._update_separators()
+
+    def _add_to_node(self, node, iter, srtr):
+        """
+            Adds a search result to a node whose row is iter, and to its
+            loaded children
+        """
+        if node is not self._root:
+            node.tracks.append(srtr)
+            self.model.set_value(iter, 1, self._get_node_label(node))
+        if node.children is None:
+            return  # grouped from node.tracks when loaded
+
+        child = node.find_child(self.order, srtr.track)
+        if child is None:
+            index, child = node.add_child(self.order, srtr.track)
+            child_iter = self._insert_node_row(iter, node, index)
+        else:
+            child_iter = self._find_node_iter(iter, child)
+        self._add_to_node(child, child_iter, srtr)
 
-    def refresh_tracks_in_tree(self, type, obj, loc):
-        self._refresh_tags_in_tree()
+    def _remove_tracks_from_tree(self, tracks):
+        """
+            Removes tracks from the loaded parts of the tree
+
+            :param tracks: a set of :class:`xl.trax.Track`
+        """
+        if not tracks:
+            return
+        self.sorted_tracks[:] = [tr for tr in self.sorted_tracks if tr not in tracks]
+        children = len(self._root.children)
+        self._remove_from_node(self._root, None, tracks)
+        if children != len(self._root.children):
+            self._update_separators()
+
+    def _remove_from_node(self, node, iter, tracks):
+        # in place, the tracks of the root node are self.tracks
+        node.tracks[:] = [srtr for srtr in node.tracks if srtr.track not in tracks]
+        if node is not self._root and node.tracks:
+            self.model.set_value(iter, 1, self._get_node_label(node))
+        if node.children is None:
+            return
+
+        row = self.model.iter_children(iter)
+        while row is not None:
+            next_row = self.model.iter_next(row)
+            child = self.model.get_value(row, 3)
+            if child is not None:
+                self._remove_from_node(child, row, tracks)
+                if not child.tracks:
+                    self.model.remove(row)
+                    node.children.remove(child)
+            row = next_row
+
+    def _find_node_iter(self, parent, node):
+        """
+            Returns the row of a node below the row parent
+        """
+        iter = self.model.iter_children(parent)
+        while iter is not None:
+            if self.model.get_value(iter, 3) is node:
+                return iter
+            iter = self.model.iter_next(iter)
+        return None
+
+    def _insert_node_row(self, parent, node, index):
+        """
+            Inserts the row for a new child of node at its position
+
+            :param parent: the row of node
+            :param index: the index of the child in node.children
+        """
+        child = node.children[index]
+        row = self._get_node_row(child)
+        sibling = None
+        if index + 1 < len(node.children):
+            sibling = self._find_node_iter(parent, node.children[index + 1])
+        if sibling is None:
+            iter = self.model.append(parent, row)
+        else:
+            iter = self.model.insert_before(parent, sibling, row)
+        if not self._is_bottom(child):
+            self.model.append(iter, [None, None, None, None])
+        return iter
+
+    def _is_bottom(self, node):
+        return node.depth == len(self.order) - 1
+
+    def _get_node_label(self, node):
+        if self._is_bottom(node) or not settings.get_option(
+            'gui/display_track_counts', True
+        ):
+            return node.display
+        return "%s (%s)" % (node.display, len(node.tracks))
+
+    def _get_node_row(self, node):
+        tags = self.order.get_sort_tags(node.depth)
+        try:
+            image = getattr(self, "%s_image" % tags[-1])
+        except Exception:
+            image = None
+        return [image, self._get_node_label(node), node.match_query, node]
+
+    def _update_separators(self):
+        """
+            Places separators between the top level nodes whose
+            values start with a different character
+        """
+        draw_seps = settings.get_option('gui/draw_separators', True)
+        tag = self.order.get_sort_tags(0)[0]
+        last_char = None
+        iter = self.model.get_iter_first()
+        while iter is not None:
+            next_iter = self.model.iter_next(iter)
+            node = self.model.get_value(iter, 3)
+            if node is None:
+                self.model.remove(iter)
+            elif draw_seps:
+                char = first_meaningful_char(node.tracks[0].track.get_tag_sort(tag))
+                if last_char is not None and char != last_char:
+                    self.model.insert_before(None, iter, [None, None, None, None])
+                last_char = char
+            iter = next_iter
 
     @common.glib_wait(500)
     def _refresh_tags_in_tree(self):
@@ -543,11 +834,19 @@ class CollectionPanel(panel.Panel):
         tags += self.order.all_search_tags()
         tags = list(set(tags))  # uniquify list to speed up search
 
-        self.tracks = list(
-            trax.search_tracks_from_string(
-                self.sorted_tracks, keyword, case_sensitive=False, keyword_tags=tags
-            )
-        )
+        matchers = self._matchers = [
+            trax.TracksMatcher(keyword, case_sensitive=False, keyword_tags=tags)
+        ]
+
+        # let the collection's search index narrow down the tracks, while
+        # keeping them in sorted order
+        tracks = self.sorted_tracks
+        candidates = self.collection.get_search_candidates(matchers)
+        if candidates is not None:
+            tracks = [tr for tr in tracks if tr in candidates]
+
+        self.tracks = list(trax.search_tracks(tracks, matchers))
+        self._root = CollectionNode(-1, self.tracks)
 
         self.load_subtree(None)
 
@@ -593,133 +892,51 @@ class CollectionPanel(panel.Panel):
 
             @param node: the node
         """
-        previously_loaded = False  # was the subtree already loaded
         iter_sep = None
         if parent is None:
-            depth = 0
+            node = self._root
         else:
-            if (
-                self.model.iter_n_children(parent) != 1
-                or self.model.get_value(self.model.iter_children(parent), 1) is not None
-            ):
-                previously_loaded = True
+            node = self.model.get_value(parent, 3)
+            if node is None or node.children is not None:
+                return  # not a node, or the subtree was already loaded
             iter_sep = self.model.iter_children(parent)
-            depth = self.model.iter_depth(parent) + 1
-        if previously_loaded:
-            return
-
-        search = self.get_node_search_terms(parent)
 
         try:
-            tags = self.order.get_sort_tags(depth)
-            matchers = [trax.TracksMatcher(search)]
-            srtrs = trax.search_tracks(self.tracks, matchers)
-            # sort only if we are not on top level, because tracks are
-            # already sorted by fist order
-            if depth > 0:
-                srtrs = trax.sort_result_tracks(tags, srtrs)
+            children = node.get_children(self.order)
         except IndexError:
             return  # at the bottom of the tree
-        try:
-            image = getattr(self, "%s_image" % tags[-1])
-        except Exception:
-            image = None
-        bottom = False
-        if depth == len(self.order) - 1:
-            bottom = True
-
-        display_counts = settings.get_option('gui/display_track_counts', True)
-        draw_seps = settings.get_option('gui/draw_separators', True)
-        last_char = ''
-        last_val = ''
-        last_dval = ''
-        last_matchq = ''
-        count = 0
-        first = True
-        path = None
-        expanded = False
-        to_expand = []
 
-        for srtr in srtrs:
-            stagvals = [unicode(srtr.track.get_tag_sort(x)) for x in tags]
-            stagval = " ".join(stagvals)
-            if last_val != stagval or bottom:
-                tagval = self.order.format_track(depth, srtr.track)
-                match_query = " ".join(
-                    [srtr.track.get_tag_search(t, format=True) for t in tags]
-                )
-                if bottom:
-                    match_query += " " + srtr.track.get_tag_search("__loc", format=True)
-
-                # Different *sort tags can cause stagval to not match
-                # but the below code will produce identical entries in
-                # the displayed tree.  This condition checks to ensure
-                # that new entries are added if and only if they will
-                # display different results, avoiding that problem.
-                if match_query != last_matchq or tagval != last_dval or bottom:
-                    if display_counts and path and not bottom:
-                        iter = self.model.get_iter(path)
-                        val = self.model.get_value(iter, 1)
-                        val = "%s (%s)" % (val, count)
-                        self.model.set_value(iter, 1, val)
-                        count = 0
-
-                    last_val = stagval
-                    last_dval = tagval
-                    if depth == 0 and draw_seps:
-                        val = srtr.track.get_tag_sort(tags[0])
-                        char = first_meaningful_char(val)
-                        if first:
-                            last_char = char
-                        else:
-                            if char != last_char and last_char != '':
-                                self.model.append(parent, [None, None, None])
-                            last_char = char
-                    first = False
-
-                    last_matchq = match_query
-                    iter = self.model.append(parent, [image, tagval, match_query])
-                    path = self.model.get_path(iter)
-                    expanded = False
-                    if not bottom:
-                        self.model.append(iter, [None, None, None])
-            count += 1
-            if not expanded:
-                alltags = []
-                for i in range(depth + 1, len(self.order)):
-                    alltags.extend(self.order.get_sort_tags(i))
-                for t in alltags:
-                    if t in srtr.on_tags:
-                        # keep original path intact for following block
-                        newpath = path
-                        if depth > 0:
-                            # for some reason, nested iters are always
-                            # off by one in the terminal entry.
-                            newpath = Gtk.TreePath.new_from_indices(
-                                newpath[:-1] + [newpath[-1] - 1]
-                            )
-                        to_expand.append(newpath)
-                        expanded = True
-
-        if display_counts and path and not bottom:
-            iter = self.model.get_iter(path)
-            val = self.model.get_value(iter, 1)
-            val = "%s (%s)" % (val, count)
-            self.model.set_value(iter, 1, val)
-            count = 0
-
-        if (
+        depth = node.depth + 1
+        alltags = []
+        for i in range(depth + 1, len(self.order)):
+            alltags.extend(self.order.get_sort_tags(i))
+        expand = (
             settings.get_option("gui/expand_enabled", True)
-            and len(to_expand) < settings.get_option("gui/expand_maximum_results", 100)
             and len(self.keyword.strip())
             >= settings.get_option("gui/expand_minimum_term_length", 2)
-        ):
-            for row in to_expand:
-                GLib.idle_add(self.tree.expand_row, row, False)
+        )
+        to_expand = []
+
+        for child in children:
+            iter = self.model.append(parent, self._get_node_row(child))
+            if self._is_bottom(child):
+                continue
+            self.model.append(iter, [None, None, None, None])
+            if expand and any(
+                t in srtr.on_tags for srtr in child.tracks for t in alltags
+            ):
+                to_expand.append(iter)
+
+        if depth == 0:
+            self._update_separators()
 
         if iter_sep is not None:
             self.model.remove(iter_sep)
 
+        if len(to_expand) < settings.get_option("gui/expand_maximum_results", 100):
+            for iter in to_expand:
+                GLib.idle_add(self.tree.expand_row, self.model.get_path(iter), False)
+
 
 class CollectionDragTreeView(DragTreeView):
     """
@@ -788,10 +1005,8 @@ class CollectionDragTreeView(DragTreeView):
             :return: list of tracks [xl.trax.Track]
         """
         it = self.get_model().get_iter(path)
-        search = self.container.get_node_search_terms(it)
-        matcher = trax.TracksMatcher(search)
-        for i in trax.search_tracks(self.container.tracks, [matcher]):
-            yield i.track
+        for track in self.container._find_tracks(it):
+            yield track
 
 
 # vim: et sts=4 sw=4
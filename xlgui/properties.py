@@ -42,7 +42,9 @@ from gi.repository import Pango
 from xl.nls import gettext as _
 from xl.metadata import CoverImage
 from xl import common, settings, trax, xdg
+from xl.trax import tagwriter
 
+import xlgui
 from xlgui.widgets import dialogs
 from xlgui.guiutil import GtkTemplate
 from xl.metadata.tags import tag_data, get_default_tagdata
@@ -200,7 +202,7 @@ class TrackPropertiesDialog(GObject.GObject):
 
     def _tags_write(self, data):
         errors = []
-        dialog = SavingProgressWindow(self.dialog, len(data))
+        tracks = []
         for n, trackdata in data:
             track = self.tracks[n]
             poplist = []
@@ -239,26 +241,30 @@ class TrackPropertiesDialog(GObject.GObject):
                 for tag in poplist:
                     self._write_tag(track, tag, None)
 
-                if not track.write_tags():
-                    errors.append(track.get_loc_for_io())
+                tracks.append(track)
             except Exception:
                 logger.warning("Error saving track", exc_info=True)
                 errors.append(track.get_loc_for_io())
 
-            trax.track._CACHER.remove(track)
-            dialog.step()
-        dialog.destroy()
-
-        if len(errors) > 0:
-            self.message.clear_buttons()
-            self.message.add_button(Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE)
-            self.message.show_error(
-                _('Writing of tags failed'),
-                _(
-                    'Tags could not be written to the following files:\n' '{files}'
-                ).format(files='\n'.join(errors)),
+        # the files are written in the background, so the dialog can be
+        # closed and the writing cancelled meanwhile
+        batch = tagwriter.WRITER.write_tracks(tracks)
+        batch.connect('done', self._on_tags_written, errors)
+        controller = xlgui.get_controller()
+        if controller is None:
+            batch.start()
+        else:
+            controller.progress_manager.add_monitor(
+                batch, _("Writing tags..."), 'document-save'
             )
 
+    @common.idle_add()
+    def _on_tags_written(self, batch, errors):
+        errors = errors + batch.errors
+        if errors:
+            message = _('Tags could not be written to the following files:\n' '{files}')
+            dialogs.error(None, message.format(files='\n'.join(errors)))
+
     def _build_from_track(self, position):
         self._clear_grids()
 
@@ -1290,44 +1296,4 @@ class AllButton(Gtk.ToggleButton):
                 self.field.all_func(tag, multi_id, self.field.get_value, self.id_num)
 
 
-class SavingProgressWindow(Gtk.Window):
-    def __init__(self, parent, total, text=_("Saved %(count)s of %(total)s.")):
-        Gtk.Window.__init__(self)
-        self.count = 0
-        self.total = total
-        self.text = text
-
-        if parent:
-            self.set_transient_for(parent)
-        self.set_modal(True)
-        self.set_decorated(False)
-        self.set_resizable(False)
-        self.set_focus_on_map(False)
-        self.add(Gtk.Frame())
-        self.get_child().set_shadow_type(Gtk.ShadowType.OUT)
-        vbox = Gtk.Box(spacing=12, orientation=Gtk.Orientation.VERTICAL)
-        vbox.set_border_width(12)
-        self._label = Gtk.Label()
-        self._label.set_use_markup(True)
-        self._label.set_markup(self.text % {'count': 0, 'total': self.total})
-        vbox.pack_start(self._label, True, True, 0)
-        self._progress = Gtk.ProgressBar()
-        self._progress.set_size_request(300, -1)
-        vbox.pack_start(self._progress, True, True, 0)
-
-        self.get_child().add(vbox)
-
-        self.set_position(Gtk.WindowPosition.CENTER_ON_PARENT)
-        self.show_all()
-        while Gtk.events_pending():
-            Gtk.main_iteration()
-
-    def step(self):
-        self.count += 1
-        self._progress.set_fraction(common.clamp(self.count / float(self.total), 0, 1))
-        self._label.set_markup(self.text % {'count': self.count, 'total': self.total})
-        while Gtk.events_pending():
-            Gtk.main_iteration()
-
-
 # vim: et sts=4 sw=4
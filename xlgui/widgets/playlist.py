@@ -45,6 +45,9 @@ from xlgui import guiutil, icons
 
 logger = logging.getLogger(__name__)
 
+# PlaylistModel row cache key of the text searched by the playlist filter
+_SEARCH_CACHE_KEY = ('search',)
+
 
 def default_get_playlist_func(parent, context):
     return player.QUEUE.current_playlist
@@ -370,14 +373,7 @@ def __create_playlist_context_menu():
     def remove_tracks_cb(widget, name, playlistpage, context):
         tracks = context['selected-items']
         playlist = playlistpage.playlist
-        # If it's all one block, just delete it in one chunk for
-        # maximum speed.
-        positions = [t[0] for t in tracks]
-        if positions == range(positions[0], positions[0] + len(positions)):
-            del playlist[positions[0] : positions[0] + len(positions)]
-        else:
-            for position, track in tracks[::-1]:
-                del playlist[position]
+        playlist.remove_positions([t[0] for t in tracks])
 
     items.append(
         smi(
@@ -861,6 +857,14 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         self.selection.set_mode(Gtk.SelectionMode.MULTIPLE)
 
         self._filter_matcher = None
+        # Keywords and tags of the current filter, see filter_tracks
+        self._filter_keywords = None
+        self._filter_tags = None
+        # Tracks that passed the current filter
+        self._filter_visible = set()
+        # While narrowing down a filter, the tracks that passed the
+        # previous one; no other track can pass the new filter
+        self._filter_previous = None
 
         self._sort_columns = list(common.BASE_SORT_TAGS)  # Column sort order
 
@@ -925,6 +929,8 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
 
         if filter_string is None:
             self._filter_matcher = None
+            self._filter_keywords = None
+            self._filter_visible = set()
             self._refilter()
         else:
             # Merge default columns and currently enabled columns
@@ -935,10 +941,32 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
             self._filter_matcher = trax.TracksMatcher(
                 filter_string, case_sensitive=False, keyword_tags=keyword_tags
             )
+            self.model.search_tags = keyword_tags
+
+            # When the new filter only narrows down the previous one (more
+            # characters were typed), only the tracks that are currently
+            # visible need to be checked again.
+            keywords = self._filter_matcher.get_keywords()
+            tags = tuple(sorted(keyword_tags))
+            narrowed = (
+                keywords is not None
+                and self._filter_keywords is not None
+                and tags == self._filter_tags
+                and trax.search.keywords_narrowed(self._filter_keywords, keywords)
+            )
+            self._filter_keywords = keywords
+            self._filter_tags = tags
+
             logger.debug(
                 "Filtering playlist %r by %r.", self.playlist.name, filter_string
             )
-            self._refilter()
+            if narrowed:
+                self._filter_previous = self._filter_visible
+            self._filter_visible = set()
+            try:
+                self._refilter()
+            finally:
+                self._filter_previous = None
             logger.debug(
                 "Filtering playlist %r by %r completed.",
                 self.playlist.name,
@@ -1173,10 +1201,33 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         self.set_model(self.modelfilter)
 
     def _modelfilter_visible_func(self, model, iter, data):
-        if self._filter_matcher is not None:
-            track = model.get_value(iter, 0)
-            return self._filter_matcher.match(trax.SearchResultTrack(track))
-        return True
+        if self._filter_matcher is None:
+            return True
+
+        track = model.get_value(iter, 0)
+        previous = self._filter_previous
+        if previous is not None and track not in previous:
+            return False
+
+        keywords = self._filter_keywords
+        if keywords is None:
+            visible = self._filter_matcher.match(trax.SearchResultTrack(track))
+        else:
+            # The lowercased text of the keyword tags is kept in the row
+            # cache, which is cleared when the tags of the track change
+            cache = model.get_value(iter, 1)
+            tags, text = cache.get(_SEARCH_CACHE_KEY, (None, None))
+            if tags != self._filter_tags:
+                tags = self._filter_tags
+                text = trax.search.get_keyword_text(
+                    track, tags, case_sensitive=False
+                )
+                cache[_SEARCH_CACHE_KEY] = (tags, text)
+            visible = trax.search.match_keyword_text(keywords, text)
+
+        if visible:
+            self._filter_visible.add(track)
+        return visible
 
     def on_header_button_press(self, widget, event):
         if event.triggers_context_menu():
@@ -1408,11 +1459,7 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         elif event.keyval == Gdk.KEY_Delete:
             indexes = [x[0] for x in self.get_selected_paths()]
             with guiutil.without_model(self):
-                if indexes and indexes == range(indexes[0], indexes[0] + len(indexes)):
-                    del self.playlist[indexes[0] : indexes[0] + len(indexes)]
-                else:
-                    for i in indexes[::-1]:
-                        del self.playlist[i]
+                self.playlist.remove_positions(indexes)
 
         # TODO: localization?
         # -> Also, would be good to expose these shortcuts somehow to the user...
@@ -1660,8 +1707,7 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
 
         # Remove tracks from the source playlist if moved
         if context.get_selected_action() == Gdk.DragAction.MOVE:
-            for i in positions[::-1]:
-                del playlist[i]
+            playlist.remove_positions(positions)
 
         delete = context.get_selected_action() == Gdk.DragAction.MOVE
         context.finish(True, delete, etime)
@@ -1794,12 +1840,15 @@ class PlaylistModel(Gtk.ListStore):
         self.player = player
 
         self._set_columns(column_names)
+        # keyword tags of the playlist filter, see PlaylistView.filter_tracks
+        self.search_tags = set()
 
         self.data_loading = False
         self.data_load_queue = []
 
-        self._redraw_timer = None
-        self._redraw_queue = []
+        # Track -> iters of the rows showing the track. Iters of a
+        # ListStore stay valid until their row is removed.
+        self._track_iters = {}
 
         event.add_ui_callback(
             self.on_tracks_added, "playlist_tracks_added", playlist, destroy_with=parent
@@ -1846,7 +1895,7 @@ class PlaylistModel(Gtk.ListStore):
             self.player,
             destroy_with=parent,
         )
-        event.add_ui_callback(
+        event.add_batch_callback(
             self.on_track_tags_changed, "track_tags_changed", destroy_with=parent
         )
 
@@ -1973,8 +2022,18 @@ class PlaylistModel(Gtk.ListStore):
         self._load_data(tracks)
 
     def on_tracks_removed(self, event_type, playlist, tracks):
+        track_iters = self._track_iters
         for position, track in reversed(tracks):
-            self.remove(self.iter_nth_child(None, position))
+            itr = self.iter_nth_child(None, position)
+            iters = track_iters.get(track)
+            if iters is not None:
+                for i, other in enumerate(iters):
+                    if self.get_path(other)[0] == position:
+                        del iters[i]
+                        break
+                if not iters:
+                    del track_iters[track]
+            self.remove(itr)
 
     def on_current_position_changed(self, event_type, playlist, positions):
         for position in positions:
@@ -2002,31 +2061,19 @@ class PlaylistModel(Gtk.ListStore):
             return
         self.update_row_params(position)
 
-    def on_track_tags_changed(self, type, track, tags):
-        if (
-            not track
-            or not settings.get_option('gui/sync_on_tag_change', True)
-            or not (tags & self.column_names)
-        ):
+    def on_track_tags_changed(self, type, changes):
+        if not settings.get_option('gui/sync_on_tag_change', True):
             return
 
-        if self._redraw_timer:
-            GLib.source_remove(self._redraw_timer)
-        self._redraw_queue.append(track)
-        self._redraw_timer = GLib.timeout_add(100, self._on_track_tags_changed)
-
-    def _on_track_tags_changed(self):
-        self._redraw_timer = None
-        redraw_queue = set(self._redraw_queue)
-        self._redraw_queue = []
-
-        COL_TRACK = self.COL_TRACK
+        shown_tags = self.column_names | self.search_tags
         COL_CACHE = self.COL_CACHE
 
-        for row in self:
-            if row[COL_TRACK] in redraw_queue:
-                row[COL_CACHE].clear()
-                self.row_changed(row.path, row.iter)
+        for track, tags in changes:
+            if not track or not (tags & shown_tags):
+                continue
+            for itr in self._track_iters.get(track, ()):
+                self.get_value(itr, COL_CACHE).clear()
+                self.row_changed(self.get_path(itr), itr)
 
     #
     # Loading data into the playlist:
@@ -2065,14 +2112,28 @@ class PlaylistModel(Gtk.ListStore):
 
     def _load_data_fn(self, tracks):
         indices = (0, 1, 2, 3, 4)
+        caches = [{} for _ in tracks]
+
+        # fill the row caches of the shown columns, so that rendering
+        # does not need to format the texts one row at a time
+        shown = [track for position, track in tracks]
+        for name in self.column_names:
+            column = providers.get_provider('playlist-columns', name)
+            texts = column and column.format_texts(shown)
+            if texts is not None:
+                for cache, text in zip(caches, texts):
+                    cache[name] = text
+
         return [
-            (position, indices, (track, {}) + self._compute_row_params(position))
-            for position, track in tracks
+            (position, indices, (track, cache) + self._compute_row_params(position))
+            for (position, track), cache in zip(tracks, caches)
         ]
 
     def _load_data_done(self, render_data):
+        track_iters = self._track_iters
         for args in render_data:
-            self.insert_with_valuesv(*args)
+            itr = self.insert_with_valuesv(*args)
+            track_iters.setdefault(args[2][0], []).append(itr)
 
         self.data_loading = False
         self.emit('data-loading', False)
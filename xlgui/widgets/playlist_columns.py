@@ -44,13 +44,27 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_COLUMNS = ['tracknumber', 'title', 'album', 'artist', '__length']
 
+# name -> TrackFormatter of the columns using the default formatter
+_FORMATTERS = {}
+
+
+def _get_formatter(cls):
+    """
+        Returns the formatter of a column class, which is shared by all
+        columns of the class
+    """
+    formatter = _FORMATTERS.get(cls.name)
+    if formatter is None:
+        formatter = _FORMATTERS[cls.name] = TrackFormatter('$%s' % cls.name)
+    return formatter
+
 
 class Column(Gtk.TreeViewColumn):
     name = ''
     display = ''
     menu_title = classproperty(lambda c: c.display)
     renderer = Gtk.CellRendererText
-    formatter = classproperty(lambda c: TrackFormatter('$%s' % c.name))
+    formatter = classproperty(_get_formatter)
     size = 10  # default size
     autoexpand = False  # whether to expand to fit space in Autosize mode
     datatype = str
@@ -159,6 +173,19 @@ class Column(Gtk.TreeViewColumn):
 
         cell.props.text = text
 
+    @classmethod
+    def format_texts(cls, tracks):
+        """
+            Returns the texts shown by columns of this class for a
+            number of tracks, or None if the texts are not cached by
+            :meth:`data_func`
+
+            Can be called from any thread.
+        """
+        if cls.data_func.__func__ is not Column.data_func.__func__:
+            return None
+        return cls.formatter.format_many(tracks)
+
     def __repr__(self):
         return '%s(%r, %r, %r)' % (
             self.__class__.__name__,
@@ -541,24 +568,22 @@ class ScheduleTimeColumn(Column):
             and playlist.shuffle_mode == 'disabled'
             and playlist.repeat_mode != 'track'
         ):
-            track = model.get_value(iter, 0)
-            position = playlist.index(track)
+            if isinstance(model, Gtk.TreeModelFilter):
+                iter = model.convert_iter_to_child_iter(iter)
+                model = model.get_model()
+            position = model.get_path(iter)[0]
             current_position = playlist.current_position
 
             # 5) this track is after the currently played one
             if position > current_position:
                 # The delay is the accumulated length of all tracks
-                # between the currently playing and this one
-                try:
-                    delay = sum(
-                        t.get_tag_raw('__length')
-                        for t in playlist[current_position:position]
-                    )
-                except TypeError:
-                    # on tracks with length == None, we cannot determine
-                    # when later tracks will play
-                    pass
-                else:
+                # between the currently playing and this one. On tracks
+                # with unknown length, we cannot determine when later
+                # tracks will play
+                delay = playlist.get_duration(
+                    current_position, position, allow_unknown=False
+                )
+                if delay is not None:
                     # Subtract the time which already has passed
                     delay -= self.player.get_time()
                     # The schedule time is the current time plus delay